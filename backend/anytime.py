@@ -0,0 +1,93 @@
+"""Deadlines and incumbent reporting for anytime optimization.
+
+A caller runs an optimization inside `anytime()`, optionally with a time limit
+and a callback. Solvers poll `expired()` in their search loops and offer every
+complete solution they reach to `report()`; the callback only sees solutions
+that beat all earlier ones. Outside such a block nothing expires and reporting
+is a no-op, the same way profiling is in metrics.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+_active_search: contextvars.ContextVar = contextvars.ContextVar("active_search", default=None)
+
+class Search:
+    """Deadline, cancellation and best reported distance of one optimization"""
+    __slots__ = ("deadline", "cancelled", "on_incumbent", "best", "best_routes")
+    
+    def __init__(self, time_limit: Optional[float] = None, on_incumbent: Optional[Callable] = None,
+                 cancelled: Optional[threading.Event] = None):
+        self.deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        self.cancelled = cancelled
+        self.on_incumbent = on_incumbent  # Called as on_incumbent(routes, total_distance)
+        self.best = float("inf")
+        self.best_routes: Optional[List] = None
+    
+    def expired(self) -> bool:
+        if self.cancelled is not None and self.cancelled.is_set():
+            return True
+        return self.deadline is not None and time.perf_counter() > self.deadline
+
+@contextmanager
+def anytime(time_limit: Optional[float] = None, on_incumbent: Optional[Callable] = None,
+            cancelled: Optional[threading.Event] = None) -> Iterator[Search]:
+    """Give everything run inside the block a time limit in seconds and an incumbent callback.
+    
+    Setting ``cancelled`` makes the search expire at once, e.g. when the
+    client that asked for it has gone away.
+    """
+    search = Search(time_limit, on_incumbent, cancelled)
+    token = _active_search.set(search)
+    try:
+        yield search
+    finally:
+        _active_search.reset(token)
+
+def expired(deadline: Optional[float] = None) -> bool:
+    """True once time.perf_counter() passes ``deadline`` or the active search has run out"""
+    if deadline is not None and time.perf_counter() > deadline:
+        return True
+    search = _active_search.get()
+    return search is not None and search.expired()
+
+def remaining() -> Optional[float]:
+    """Seconds left before the active search's deadline, or None without one"""
+    search = _active_search.get()
+    if search is None or search.deadline is None:
+        return None
+    return max(search.deadline - time.perf_counter(), 0.0)
+
+def cancellation() -> Optional[threading.Event]:
+    """The active search's cancellation event, for a nested search that must stop with it"""
+    search = _active_search.get()
+    return search.cancelled if search is not None else None
+
+def reporting() -> bool:
+    """Whether anyone listens for incumbents; lets solvers skip building them"""
+    search = _active_search.get()
+    return search is not None and search.on_incumbent is not None
+
+def report(routes: List) -> bool:
+    """Offer a complete solution; it is passed on only if it is shorter than every earlier one"""
+    search = _active_search.get()
+    if search is None or search.on_incumbent is None:
+        return False
+    total = sum(route.distance for route in routes)
+    if total >= search.best - 1e-9:
+        return False
+    search.best = total
+    search.best_routes = list(routes)
+    search.on_incumbent(routes, total)
+    return True
+
+def best_routes(routes: List) -> List:
+    """The given solution, or the reported one if that was shorter"""
+    search = _active_search.get()
+    if search is None or search.best_routes is None:
+        return routes
+    if sum(route.distance for route in routes) <= search.best + 1e-9:
+        return routes
+    return search.best_routes
@@ -0,0 +1,283 @@
+"""Benchmark the route optimizers on synthetic Coimbatore-scale instances.
+
+Example:
+    python benchmark.py --sizes 10,100,1000 --partners 1,10 --output bench.json
+    python benchmark.py --sizes 10,100,1000 --partners 1,10 --baseline bench.json
+    python benchmark.py --sizes 150 --partners 4 --one-way --timeout 30
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from jobs import JobTimeoutError, time_limit
+from road_network import RoadNetwork, haversine_km
+from route_optimizer import (
+    DistanceMatrix,
+    ProblemInstance,
+    Route,
+    optimize_route_backtracking,
+    optimize_route_divide_conquer,
+    optimize_route_dynamic,
+    optimize_route_greedy,
+    optimize_route_local_search,
+    optimize_route_savings,
+    optimize_route_vrptw,
+)
+
+# Area centroids from the coimbatore_areas table (db/coimbatore-schema.sql)
+COIMBATORE_AREAS = [
+    ("Peelamedu", 11.0279, 77.0254),
+    ("R.S. Puram", 11.0069, 76.9498),
+    ("Gandhipuram", 11.0175, 76.9674),
+    ("Singanallur", 11.0070, 77.0421),
+    ("Saibaba Colony", 11.0233, 76.9342),
+    ("Ganapathy", 11.0400, 76.9900),
+    ("Ukkadam", 10.9925, 76.9608),
+    ("Ramanathapuram", 11.0023, 77.0101),
+    ("Podanur", 10.9790, 76.9700),
+    ("Thudiyalur", 11.0700, 76.9400),
+]
+
+# Depot at the city centre, where the major highways meet (coimbatore_roads)
+DEPOT = ("Coimbatore Depot", 11.0168, 76.9558)
+
+OPTIMIZERS: Dict[str, Callable[[ProblemInstance, DistanceMatrix], List[Route]]] = {
+    "divide_and_conquer": optimize_route_divide_conquer,
+    "greedy": optimize_route_greedy,
+    "dynamic": optimize_route_dynamic,
+    "backtracking": optimize_route_backtracking,
+    "local_search": optimize_route_local_search,
+    "savings": optimize_route_savings,
+    "vrptw": optimize_route_vrptw,
+}
+
+def generate_instance(num_stops: int, num_partners: int, seed: int = 0,
+                      spread: float = 0.006, slack: float = 1.3) -> Tuple[List[Dict], List[Dict]]:
+    """Seeded instance with stops clustered around the Coimbatore area centroids.
+    
+    Stops are drawn from a Gaussian of standard deviation `spread` degrees
+    around a randomly chosen area. Partner capacities cover the total demand
+    with `slack` to spare; bikes carry half of what cars do, and every
+    partner can carry at least the heaviest single stop.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = np.array([(lat, lng) for _, lat, lng in COIMBATORE_AREAS])
+    area = rng.integers(0, len(centroids), num_stops)
+    coords = centroids[area] + rng.normal(0, spread, (num_stops, 2))
+    demand = rng.integers(1, 4, num_stops)
+    
+    locations = [{"id": 1, "name": DEPOT[0], "lat": DEPOT[1], "lng": DEPOT[2], "type": "depot"}]
+    for i in range(num_stops):
+        locations.append({
+            "id": i + 2,
+            "name": f"{COIMBATORE_AREAS[area[i]][0]} stop {i + 1}",
+            "lat": round(float(coords[i, 0]), 6),
+            "lng": round(float(coords[i, 1]), 6),
+            "type": "delivery",
+            "demand": int(demand[i])
+        })
+    
+    vehicles = rng.choice(["Bike", "Car"], num_partners)
+    weights = np.where(vehicles == "Car", 2.0, 1.0)
+    capacity = np.ceil(demand.sum() * slack * weights / weights.sum()).astype(int)
+    capacity = np.maximum(capacity, demand.max(initial=1))
+    partners = [
+        {"id": p + 1, "name": f"Partner {p + 1}", "vehicle": str(vehicles[p]), "capacity": int(capacity[p])}
+        for p in range(num_partners)
+    ]
+    return locations, partners
+
+def one_way_grid(rows: int = 30, step: float = 0.004) -> RoadNetwork:
+    """Grid of one-way streets across the city, directions alternating like a Manhattan grid.
+    
+    Distances over it are asymmetric, which the optimizers must handle
+    without assuming d(a, b) == d(b, a).
+    """
+    lat0 = min(lat for _, lat, _ in COIMBATORE_AREAS) - 0.03
+    lng0 = min(lng for _, _, lng in COIMBATORE_AREAS) - 0.03
+    k = np.arange(rows * rows)
+    lat = lat0 + (k // rows) * step
+    lng = lng0 + (k % rows) * step
+    
+    edges = []
+    for u in k.tolist():
+        r, c = divmod(u, rows)
+        # Even rows run east and odd rows west; even columns run north and odd columns south
+        for v, forward in ((u + 1, r % 2 == 0) if c + 1 < rows else (None, None),
+                           (u + rows, c % 2 == 0) if r + 1 < rows else (None, None)):
+            if v is None:
+                continue
+            length = float(haversine_km(lat[u], lng[u], lat[v], lng[v]))
+            edges.append((u, v, length) if forward else (v, u, length))
+    return RoadNetwork.from_graph(lat, lng, edges)
+
+def solution_quality(problem: ProblemInstance, routes: List[Route]) -> Dict:
+    """Total distance, per-route balance and coverage of a solution"""
+    distances = np.array([route.distance for route in routes]) if routes else np.zeros(1)
+    served = {loc_id for route in routes for loc_id in route.path}
+    missing = sum(1 for i in problem.deliveries() if problem.location_ids[i] not in served)
+    mean = distances.mean()
+    return {
+        "totalDistance": float(distances.sum()),
+        "maxRouteDistance": float(distances.max()),
+        "routes": len(routes),
+        # (longest - shortest) / mean route distance; 0 is perfectly balanced
+        "imbalance": float((distances.max() - distances.min()) / mean) if mean > 0 else 0.0,
+        "unservedStops": missing
+    }
+
+def run_case(algorithm: str, locations: List[Dict], partners: List[Dict],
+             repeat: int = 3, timeout: Optional[float] = None, provider=None) -> Dict:
+    """Time one optimizer on one instance, then measure its peak memory in a separate run.
+    
+    The provider supplies distances; the default is straight-line distance.
+    """
+    optimizer = OPTIMIZERS[algorithm]
+    case = {"algorithm": algorithm, "stops": len(locations) - 1, "partners": len(partners)}
+    
+    try:
+        setup_times, solve_times = [], []
+        for _ in range(repeat):
+            with time_limit(timeout):
+                start = time.perf_counter()
+                problem = ProblemInstance(locations, partners)
+                dist = DistanceMatrix(problem, provider)
+                setup_done = time.perf_counter()
+                routes = optimizer(problem, dist)
+                solve_done = time.perf_counter()
+            setup_times.append(setup_done - start)
+            solve_times.append(solve_done - setup_done)
+        
+        # tracemalloc slows Python code down, so memory gets its own run
+        tracemalloc.start()
+        try:
+            with time_limit(timeout):
+                problem = ProblemInstance(locations, partners)
+                optimizer(problem, DistanceMatrix(problem, provider))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    except JobTimeoutError:
+        case["error"] = f"timeout after {timeout:g}s"
+        return case
+    except MemoryError:
+        case["error"] = "out of memory"
+        return case
+    except ValueError as e:
+        case["error"] = str(e)
+        return case
+    
+    case.update({
+        "setupSeconds": min(setup_times),
+        "solveSeconds": min(solve_times),
+        "peakMemoryBytes": peak,
+        "quality": solution_quality(problem, routes)
+    })
+    return case
+
+def run_suite(sizes: List[int], partner_counts: List[int], algorithms: List[str], seed: int = 42,
+              repeat: int = 3, timeout: Optional[float] = None, log=sys.stderr, provider=None) -> Dict:
+    """Run every algorithm over every (stops, partners) combination"""
+    results = []
+    for num_stops in sizes:
+        for num_partners in partner_counts:
+            locations, partners = generate_instance(num_stops, num_partners, seed)
+            for algorithm in algorithms:
+                case = run_case(algorithm, locations, partners, repeat, timeout, provider)
+                results.append(case)
+                if log:
+                    log.write(format_case(case) + "\n")
+    
+    return {
+        "meta": {
+            "seed": seed,
+            "distance": "one-way grid" if isinstance(provider, RoadNetwork) else "euclidean",
+            "repeat": repeat,
+            "timeout": timeout,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+        },
+        "results": results
+    }
+
+def format_case(case: Dict) -> str:
+    label = f"{case['algorithm']:<20} {case['stops']:>6} stops {case['partners']:>4} partners"
+    if "error" in case:
+        return f"{label}  {case['error']}"
+    quality = case["quality"]
+    line = (f"{label}  setup {case['setupSeconds'] * 1000:9.1f} ms  solve {case['solveSeconds'] * 1000:9.1f} ms  "
+            f"peak {case['peakMemoryBytes'] / 2**20:8.1f} MiB  distance {quality['totalDistance']:9.4f}  "
+            f"imbalance {quality['imbalance']:5.2f}")
+    # A mode that leaves stops out, like vrptw under time windows, is not comparable on distance alone
+    if quality["unservedStops"]:
+        line += f"  unserved {quality['unservedStops']}"
+    return line
+
+def compare(baseline: Dict, current: Dict) -> List[str]:
+    """Relative change in solve time and distance for cases present in both runs"""
+    def key(case):
+        return case["algorithm"], case["stops"], case["partners"]
+    
+    previous = {key(case): case for case in baseline["results"]}
+    lines = []
+    for case in current["results"]:
+        old = previous.get(key(case))
+        if old is None or "error" in old or "error" in case:
+            continue
+        time_change = case["solveSeconds"] / old["solveSeconds"] - 1 if old["solveSeconds"] else 0.0
+        old_distance = old["quality"]["totalDistance"]
+        distance_change = case["quality"]["totalDistance"] / old_distance - 1 if old_distance else 0.0
+        lines.append(f"{case['algorithm']:<20} {case['stops']:>6} stops {case['partners']:>4} partners  "
+                     f"solve {time_change:+7.1%}  distance {distance_change:+7.2%}")
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,1000", help="Comma-separated stop counts")
+    parser.add_argument("--partners", default="1,10", help="Comma-separated partner counts")
+    parser.add_argument("--algorithms", default=",".join(OPTIMIZERS), help="Comma-separated algorithms")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case; the fastest is kept")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds before a case is abandoned")
+    parser.add_argument("--one-way", action="store_true",
+                        help="Measure distances over a grid of one-way streets instead of straight lines")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare against")
+    args = parser.parse_args()
+    
+    algorithms = args.algorithms.split(",")
+    unknown = [name for name in algorithms if name not in OPTIMIZERS]
+    if unknown:
+        parser.error(f"Unknown algorithms: {', '.join(unknown)}")
+    
+    report = run_suite(
+        [int(size) for size in args.sizes.split(",")],
+        [int(count) for count in args.partners.split(",")],
+        algorithms, args.seed, args.repeat, args.timeout,
+        provider=one_way_grid() if args.one_way else None
+    )
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        sys.stderr.write("\nChange against baseline:\n")
+        for line in compare(baseline, report):
+            sys.stderr.write(line + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Persistent, memory-mapped distances between recurring locations.
+
+Distances are kept on disk in a directory per metric and addressed by
+stable location id. Each id owns a slot; the slot-by-slot matrix is split
+into square float32 tiles appended to one file as pairs are first seen, so
+the store grows without moving what is already there. NaN marks an unknown
+pair. Every process maps the tile file shared, so concurrent gunicorn and
+process-pool workers read the same pages without copying; an advisory
+fcntl lock orders writers and lets readers see a consistent index.
+
+Removing ids frees their slots and, once a whole block of slots is free,
+the tiles that hold them; both are reused by later inserts rather than
+rebuilding the file.
+"""
+import fcntl
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Root directory of the stores; unset disables the store
+DISTANCE_STORE_PATH = os.environ.get("DISTANCE_STORE_PATH")
+# Locations kept per metric; the oldest are evicted beyond this
+DISTANCE_STORE_MAX_ENTRIES = int(os.environ.get("DISTANCE_STORE_MAX_ENTRIES", 20000))
+
+# Slots per tile side; a tile is TILE_SIZE^2 float32 values (256 KiB)
+TILE_SIZE = 256
+
+# Coordinates may move this far (degrees) before a location's distances are recomputed
+COORD_TOLERANCE = 1e-6
+
+class DistanceStore:
+    """Distances keyed by location id, stored as memory-mapped float32 tiles"""
+    def __init__(self, path: str, max_entries: int = DISTANCE_STORE_MAX_ENTRIES, tile_size: int = TILE_SIZE):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self._index_path = os.path.join(path, "index.json")
+        self._tiles_path = os.path.join(path, "tiles.f32")
+        self._lock_file = open(os.path.join(path, "lock"), "a+")
+        # flock is held per process; threads of one process take turns here
+        self._thread_lock = threading.Lock()
+        self._stamp = None
+        self._tiles = None
+        
+        self.tile_size = tile_size
+        self.ids: List = []  # Location id per slot; None for a free slot
+        self.coords: List[Optional[List[float]]] = []
+        self.inserted: List[int] = []  # Insertion sequence per slot, for eviction
+        self.tile_of: Dict[Tuple[int, int], int] = {}  # (block row, block col) -> tile number
+        self.free_tiles: List[int] = []
+        self.num_tiles = 0
+        self.sequence = 0
+        self.slot_of: Dict = {}
+        
+        with self._locked(exclusive=True):
+            if not os.path.exists(self._index_path):
+                self._save_index()
+    
+    def __len__(self) -> int:
+        return len(self.slot_of)
+    
+    # Locking and persistence
+    @contextmanager
+    def _locked(self, exclusive: bool) -> Iterator[None]:
+        """Hold the store lock and make sure the in-memory index is current"""
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                self._refresh()
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+    
+    def _refresh(self):
+        """Reload the index after another process changed it"""
+        try:
+            stat = os.stat(self._index_path)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+        
+        with open(self._index_path) as f:
+            index = json.load(f)
+        self.tile_size = index["tileSize"]
+        self.ids = index["ids"]
+        self.coords = index["coords"]
+        self.inserted = index["inserted"]
+        self.tile_of = {tuple(map(int, key.split(","))): t for key, t in index["tiles"].items()}
+        self.free_tiles = index["freeTiles"]
+        self.num_tiles = index["numTiles"]
+        self.sequence = index["sequence"]
+        self.slot_of = {loc_id: slot for slot, loc_id in enumerate(self.ids) if loc_id is not None}
+        self._stamp = stamp
+        self._map()
+    
+    def _save_index(self):
+        """Replace the index atomically so readers never see half of it"""
+        index = {
+            "tileSize": self.tile_size,
+            "ids": self.ids,
+            "coords": self.coords,
+            "inserted": self.inserted,
+            "tiles": {f"{bi},{bj}": t for (bi, bj), t in self.tile_of.items()},
+            "freeTiles": self.free_tiles,
+            "numTiles": self.num_tiles,
+            "sequence": self.sequence
+        }
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(tmp, self._index_path)
+        stat = os.stat(self._index_path)
+        self._stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    
+    def _map(self):
+        """Map every tile in the file, remapping after it has grown"""
+        if self.num_tiles == 0:
+            self._tiles = None
+            return
+        if self._tiles is not None and len(self._tiles) == self.num_tiles:
+            return
+        self._tiles = np.memmap(self._tiles_path, dtype=np.float32, mode="r+",
+                                shape=(self.num_tiles, self.tile_size, self.tile_size))
+    
+    # Tiles
+    def _new_tile(self) -> int:
+        """A NaN-filled tile, reusing a freed one before growing the file"""
+        if self.free_tiles:
+            t = self.free_tiles.pop()
+            self._tiles[t] = np.nan
+            return t
+        blank = np.full((self.tile_size, self.tile_size), np.nan, dtype=np.float32)
+        with open(self._tiles_path, "ab") as f:
+            f.write(blank.tobytes())
+        self.num_tiles += 1
+        self._map()
+        return self.num_tiles - 1
+    
+    def _blocks(self, slots: np.ndarray) -> Dict[int, np.ndarray]:
+        """Positions of the given slots grouped by block"""
+        blocks = slots // self.tile_size
+        return {int(b): np.flatnonzero(blocks == b) for b in np.unique(blocks)}
+    
+    def _read(self, slots: np.ndarray, to_slots: np.ndarray) -> np.ndarray:
+        result = np.full((len(slots), len(to_slots)), np.nan)
+        offsets, to_offsets = slots % self.tile_size, to_slots % self.tile_size
+        to_blocks = self._blocks(to_slots)
+        for bi, rows in self._blocks(slots).items():
+            for bj, cols in to_blocks.items():
+                t = self.tile_of.get((bi, bj))
+                if t is not None:
+                    result[np.ix_(rows, cols)] = self._tiles[t][np.ix_(offsets[rows], to_offsets[cols])]
+        return result
+    
+    def _write(self, slots: np.ndarray, to_slots: np.ndarray, values: np.ndarray):
+        offsets, to_offsets = slots % self.tile_size, to_slots % self.tile_size
+        to_blocks = self._blocks(to_slots)
+        for bi, rows in self._blocks(slots).items():
+            for bj, cols in to_blocks.items():
+                t = self.tile_of.get((bi, bj))
+                if t is None:
+                    t = self.tile_of[(bi, bj)] = self._new_tile()
+                self._tiles[t][np.ix_(offsets[rows], to_offsets[cols])] = values[np.ix_(rows, cols)]
+    
+    def _clear_slot(self, slot: int):
+        """Forget every stored distance to and from a slot"""
+        block, offset = divmod(slot, self.tile_size)
+        for (bi, bj), t in self.tile_of.items():
+            if bi == block:
+                self._tiles[t][offset, :] = np.nan
+            if bj == block:
+                self._tiles[t][:, offset] = np.nan
+    
+    # Slots
+    def _assign(self, loc_id, lat: float, lng: float) -> int:
+        """Give a location a slot, reusing a free one first"""
+        if None in self.ids:
+            slot = self.ids.index(None)
+        else:
+            slot = len(self.ids)
+            self.ids.append(None)
+            self.coords.append(None)
+            self.inserted.append(0)
+        self.ids[slot] = loc_id
+        self.coords[slot] = [lat, lng]
+        self.sequence += 1
+        self.inserted[slot] = self.sequence
+        self.slot_of[loc_id] = slot
+        return slot
+    
+    def _release(self, slots: List[int]):
+        """Free slots, and the tiles of any block left without a used slot"""
+        for slot in slots:
+            self._clear_slot(slot)
+            del self.slot_of[self.ids[slot]]
+            self.ids[slot] = None
+            self.coords[slot] = None
+            self.inserted[slot] = 0
+        
+        used = {slot // self.tile_size for slot in self.slot_of.values()}
+        for key in [key for key in self.tile_of if key[0] not in used or key[1] not in used]:
+            self.free_tiles.append(self.tile_of.pop(key))
+    
+    def _known_slots(self, ids: List, lat: np.ndarray, lng: np.ndarray) -> List[Optional[int]]:
+        """Slot of every id whose stored coordinates still match, else None"""
+        slots = []
+        for loc_id, a, b in zip(ids, lat.tolist(), lng.tolist()):
+            slot = self.slot_of.get(loc_id)
+            if slot is not None:
+                stored = self.coords[slot]
+                if abs(stored[0] - a) > COORD_TOLERANCE or abs(stored[1] - b) > COORD_TOLERANCE:
+                    slot = None
+            slots.append(slot)
+        return slots
+    
+    # Public API
+    def matrix(self, ids: List, lat: np.ndarray, lng: np.ndarray, provider) -> np.ndarray:
+        """Distance matrix between locations, computing only rows with unknown pairs"""
+        n = len(ids)
+        result = np.full((n, n), np.nan)
+        with self._locked(exclusive=False):
+            slots = self._known_slots(ids, lat, lng)
+            known = np.array([k for k in range(n) if slots[k] is not None], dtype=np.intp)
+            if len(known):
+                known_slots = np.array([slots[k] for k in known], dtype=np.int64)
+                result[np.ix_(known, known)] = self._read(known_slots, known_slots)
+        
+        # Rows with a gap; an asymmetric metric also needs every row towards a new location
+        unknown = len(known) < n
+        missing = np.isnan(result).any(axis=1)
+        if unknown and not provider.symmetric:
+            missing[:] = True
+        rows = np.flatnonzero(missing)
+        if not len(rows):
+            return result
+        
+        values = provider.matrix(lat[rows], lng[rows], lat, lng).astype(np.float32)
+        result[rows, :] = values
+        if provider.symmetric:
+            result[:, rows] = values.T
+        
+        with self._locked(exclusive=True):
+            slots = self._known_slots(ids, lat, lng)
+            for k in range(n):
+                if slots[k] is None:
+                    if ids[k] in self.slot_of:
+                        # The location moved; its old distances are stale
+                        self._release([self.slot_of[ids[k]]])
+                    slots[k] = self._assign(ids[k], float(lat[k]), float(lng[k]))
+            slots = np.array(slots, dtype=np.int64)
+            self._write(slots[rows], slots, values)
+            if provider.symmetric:
+                self._write(slots, slots[rows], values.T)
+            self._evict(keep=set(ids))
+            self._save_index()
+        return result
+    
+    def remove(self, ids: List):
+        """Forget locations, freeing their slots for reuse"""
+        with self._locked(exclusive=True):
+            slots = [self.slot_of[loc_id] for loc_id in ids if loc_id in self.slot_of]
+            if slots:
+                self._release(slots)
+                self._save_index()
+    
+    def _evict(self, keep: set):
+        """Drop the oldest locations beyond max_entries, never those in `keep`"""
+        excess = len(self.slot_of) - self.max_entries
+        if excess <= 0:
+            return
+        candidates = sorted((self.inserted[slot], slot) for loc_id, slot in self.slot_of.items()
+                            if loc_id not in keep)
+        self._release([slot for _, slot in candidates[:excess]])
+    
+    def stats(self) -> Dict:
+        with self._locked(exclusive=False):
+            return {
+                "entries": len(self.slot_of),
+                "slots": len(self.ids),
+                "tiles": len(self.tile_of),
+                "freeTiles": len(self.free_tiles),
+                "bytes": self.num_tiles * self.tile_size * self.tile_size * 4
+            }
+
+class StoredDistance:
+    """Distance provider that answers from a DistanceStore and fills it from another provider"""
+    def __init__(self, store: DistanceStore, provider, ids: List):
+        self.store = store
+        self.provider = provider
+        self.ids = ids
+        self.units = provider.units
+        self.symmetric = provider.symmetric
+    
+    def matrix(self, lat: np.ndarray, lng: np.ndarray,
+               to_lat: Optional[np.ndarray] = None, to_lng: Optional[np.ndarray] = None) -> np.ndarray:
+        if to_lat is not None:
+            # Only whole requests are keyed by id
+            return self.provider.matrix(lat, lng, to_lat, to_lng)
+        return self.store.matrix(self.ids, lat, lng, self.provider)
+
+_stores: Dict[str, DistanceStore] = {}
+_stores_lock = threading.Lock()
+
+def default_store(metric: str) -> Optional[DistanceStore]:
+    """The store for a metric under DISTANCE_STORE_PATH, or None if no path is set"""
+    if not DISTANCE_STORE_PATH:
+        return None
+    with _stores_lock:
+        if metric not in _stores:
+            _stores[metric] = DistanceStore(os.path.join(DISTANCE_STORE_PATH, metric))
+        return _stores[metric]
@@ -0,0 +1,144 @@
+"""Scoring of delivery plans from any source, many plans at once.
+
+A plan is a list of routes, each a partner id and a path of location ids,
+as returned by /api/optimize. All paths of all plans are flattened into one
+array of location indices, so distances, loads, trips and durations come
+from a handful of vectorised gathers and bincounts instead of per-route
+loops; only mapping ids to indices touches every stop in Python.
+"""
+from typing import Dict, List
+
+import numpy as np
+
+from route_optimizer import (
+    DELIVERY,
+    DEPOT,
+    KM_PER_UNIT,
+    DistanceMatrix,
+    ProblemInstance,
+    distance_provider,
+)
+
+def _imbalance(values: np.ndarray) -> np.ndarray:
+    """(max - min) / mean of every row; 0 is perfectly balanced"""
+    if not values.shape[1]:
+        return np.zeros(len(values))
+    mean = values.mean(axis=1)
+    spread = values.max(axis=1) - values.min(axis=1)
+    return np.divide(spread, mean, out=np.zeros_like(mean), where=mean > 0)
+
+def evaluate_plans(problem: ProblemInstance, plans: List[List[Dict]], provider=None) -> List[Dict]:
+    """Score plans given as lists of {"partnerId", "path"} routes over the problem's locations.
+    
+    Every partner is scored in every plan, idle ones with zero distance and
+    load. A trip is the stretch of a path between two depot visits; it
+    violates capacity when its load exceeds its partner's capacity.
+    Durations are travel time at the partner's vehicle speed plus service
+    times, in minutes.
+    """
+    num_plans, m = len(plans), problem.num_partners
+    
+    # Flatten every path of every plan into one array of location indices
+    route_plan, route_partner, paths = [], [], []
+    for k, plan in enumerate(plans):
+        for route in plan:
+            if not route["path"]:
+                continue
+            if route["partnerId"] not in problem.partner_index:
+                raise ValueError(f"Unknown partner {route['partnerId']} in plan {k}")
+            route_plan.append(k)
+            route_partner.append(problem.partner_index[route["partnerId"]])
+            paths.append(route["path"])
+    lengths = np.fromiter((len(path) for path in paths), dtype=np.intp, count=len(paths))
+    index = problem.index
+    try:
+        nodes = np.fromiter((index[loc_id] for path in paths for loc_id in path), dtype=np.intp,
+                            count=int(lengths.sum()))
+    except KeyError as e:
+        raise ValueError(f"Unknown location {e.args[0]} in a plan")
+    
+    route_of = np.repeat(np.arange(len(paths)), lengths)
+    slot = np.asarray(route_plan, dtype=np.intp) * m + np.asarray(route_partner, dtype=np.intp)
+    slot_of = slot[route_of] if len(paths) else np.empty(0, dtype=np.intp)
+    
+    # Consecutive nodes of the same route are its edges
+    same = route_of[:-1] == route_of[1:]
+    u, v = nodes[:-1][same], nodes[1:][same]
+    provider = provider or distance_provider("euclidean")
+    if hasattr(provider, "pairwise"):
+        edge = provider.pairwise(problem.lat[u], problem.lng[u], problem.lat[v], problem.lng[v])
+    else:
+        edge = DistanceMatrix(problem, provider).matrix[u, v]
+    distance = np.bincount(slot_of[:-1][same], weights=edge, minlength=num_plans * m).reshape(num_plans, m)
+    
+    # Loads, per partner and per trip; a depot visit closes a trip
+    is_depot = problem.type_code[nodes] == DEPOT
+    demand = np.where(is_depot, 0.0, problem.demand[nodes])
+    load = np.bincount(slot_of, weights=demand, minlength=num_plans * m).reshape(num_plans, m)
+    starts = np.zeros(len(nodes), dtype=bool)
+    starts[np.cumsum(lengths[:-1])] = True
+    trip_of = np.cumsum(starts | np.concatenate(([False], is_depot[:-1])))
+    trip_load = np.bincount(trip_of, weights=demand)
+    trip_slot = np.zeros(len(trip_load), dtype=np.intp)
+    trip_slot[trip_of] = slot_of
+    has_stops = np.bincount(trip_of, weights=(~is_depot).astype(np.float64)) > 0
+    excess = np.maximum(trip_load - problem.capacity[trip_slot % m], 0.0) if len(trip_load) else trip_load
+    over = has_stops & (excess > 1e-9)
+    violations = np.bincount(trip_slot[over] // m, minlength=num_plans)
+    excess_total = np.bincount(trip_slot[over] // m, weights=excess[over], minlength=num_plans)
+    trips = np.bincount(trip_slot[has_stops], minlength=num_plans * m).reshape(num_plans, m)
+    stops = np.bincount(slot_of[~is_depot], minlength=num_plans * m).reshape(num_plans, m)
+    
+    # Travel at the vehicle's speed plus time spent at every stop
+    km = distance * KM_PER_UNIT.get(provider.units, 1.0)
+    service = np.bincount(slot_of, weights=np.where(is_depot, 0.0, problem.service_time[nodes]),
+                          minlength=num_plans * m).reshape(num_plans, m)
+    duration = 60 * km / problem.speed[None, :] + service
+    load_imbalance = _imbalance(load)
+    
+    # Coverage: deliveries a plan never visits, and repeat visits
+    plan_of = slot_of // m if m else slot_of
+    delivered = problem.type_code[nodes] == DELIVERY
+    visits = np.bincount(plan_of[delivered], minlength=num_plans)
+    distinct = np.unique(plan_of[delivered] * len(problem) + nodes[delivered]) // len(problem)
+    served = np.bincount(distinct, minlength=num_plans)
+    num_deliveries = int(np.count_nonzero(problem.type_code == DELIVERY))
+    
+    partner_ids = problem.partner_ids
+    capacity = problem.capacity.tolist()
+    scores = []
+    for k in range(num_plans):
+        scores.append({
+            "totalDistance": float(distance[k].sum()),
+            "maxRouteDistance": float(distance[k].max(initial=0)),
+            "loadImbalance": float(load_imbalance[k]),
+            "capacityViolations": int(violations[k]),
+            "capacityExcess": float(excess_total[k]),
+            "durationMinutes": float(duration[k].max(initial=0)),
+            "totalDurationMinutes": float(duration[k].sum()),
+            "unservedStops": num_deliveries - int(served[k]),
+            "repeatedStops": int(visits[k] - served[k]),
+            "partners": [
+                {
+                    "partnerId": partner_ids[p],
+                    "distance": float(distance[k, p]),
+                    "load": float(load[k, p]),
+                    "capacity": capacity[p],
+                    "stops": int(stops[k, p]),
+                    "trips": int(trips[k, p]),
+                    "durationMinutes": float(duration[k, p])
+                }
+                for p in range(m)
+            ]
+        })
+    return scores
+
+def evaluate(locations_data: List[Dict], partners_data: List[Dict], plans: List[Dict],
+             distance: str = "euclidean") -> Dict:
+    """Score plans, each {"routes": [...]} with an optional "id", against one problem"""
+    problem = ProblemInstance(locations_data, partners_data)
+    provider = distance_provider(distance, problem.location_ids)
+    scores = evaluate_plans(problem, [plan["routes"] for plan in plans], provider)
+    for k, (plan, score) in enumerate(zip(plans, scores)):
+        score["id"] = plan.get("id", plan.get("algorithm", k))
+    return {"distanceUnits": provider.units, "plans": scores}
@@ -0,0 +1,47 @@
+"""Gunicorn settings for serving the optimizer API in production.
+
+Run with ``gunicorn --config gunicorn.conf.py server:app``; every setting is
+overridable from the environment. One worker process serves requests on a
+pool of threads, so Server-Sent Event streams and polled requests don't
+block each other, and it warms up the optimizers before taking requests.
+
+Jobs, batches, the replanner's partner state and the in-memory result cache
+live in that process. The solving mostly does not: jobs, batches and
+synchronous optimizations run on the job process pool (OPTIMIZER_WORKERS
+processes), so CPU-bound solves use every core rather than taking turns on
+this worker's GIL, and no more dense distance matrices are held at once
+than the pool has processes. Only streamed solves, which report incumbents
+as they go, run on a thread here. Raising GUNICORN_WORKERS above 1 splits
+that state between workers, so job polling, cancelling and position updates can
+land on a worker that never saw the job or partner; only do so behind a
+load balancer that pins clients to a worker, with OPTIMIZER_CACHE_PATH
+set to share cached results.
+"""
+import os
+import time
+
+bind = os.environ.get("GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+# A single process keeps jobs and partner state in one place; threads serve requests concurrently
+workers = int(os.environ.get("GUNICORN_WORKERS", 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+# Seconds; the heartbeat runs beside the request threads, so long solves don't trip it
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+# Restart a worker after this many requests to return memory held by large matrices; 0 never does
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+def post_worker_init(worker):
+    # Imports and first-call costs are paid before the worker accepts connections
+    from server import warm_up
+    
+    start = time.perf_counter()
+    warm_up()
+    worker.log.info("Worker %s warmed up in %.2fs", worker.pid, time.perf_counter() - start)
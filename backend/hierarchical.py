@@ -0,0 +1,252 @@
+"""Hierarchical solving for city-scale instances: cluster first, solve, stitch.
+
+Deliveries are grouped by their "area" (a coimbatore_areas name, say) or,
+without one, into spatial clusters, and any group larger than AREA_SIZE is
+split again. Every area's tour is solved on its own small distance matrix,
+on the process pool when it has workers. A coarse tour over the area
+centres orders the areas, each area tour is opened where it joins its
+neighbours best, and windows around the joins are re-optimized. The giant
+tour is then split among partners by capacity. No step builds the full
+distance matrix, so time and memory grow about linearly with the stops.
+"""
+import time
+from collections import defaultdict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from anytime import anytime, expired, remaining
+from metrics import count, phase
+from parallel import parallel_workers, pool
+from partition import partition
+from route_optimizer import (
+    DistanceMatrix,
+    ProblemInstance,
+    Route,
+    distance_provider,
+    find_depot,
+    improve_tour,
+    solve_tsp,
+)
+
+AREA_SIZE = 200  # Most stops solved as one area
+AREA_FANOUT = 16  # Parts an oversized group is split into at a time
+JOIN_WINDOW = 15  # Stops re-optimized on either side of a join between areas
+
+def group_areas(problem: ProblemInstance, deliveries: np.ndarray, areas: Optional[List] = None) -> List[np.ndarray]:
+    """Delivery indices per area, from the given area labels or spatial clusters, none over AREA_SIZE.
+    
+    Oversized groups are split AREA_FANOUT ways at a time, so the balanced
+    k-means never compares every stop with every area.
+    """
+    if areas is not None and all(areas[i] is not None for i in deliveries.tolist()):
+        labelled = defaultdict(list)
+        for i in deliveries.tolist():
+            labelled[areas[i]].append(i)
+        pending = [np.asarray(group, dtype=np.intp) for group in labelled.values()]
+    else:
+        pending = [deliveries] if len(deliveries) else []
+    
+    groups = []
+    while pending:
+        group = pending.pop()
+        if len(group) <= AREA_SIZE:
+            groups.append(group)
+            continue
+        k = min(AREA_FANOUT, -(-len(group) // AREA_SIZE))
+        lat, lng = problem.lat[group], problem.lng[group]
+        labels = partition(lat, lng, lat.mean(), lng.mean(), np.ones(len(group)), np.ones(k))
+        pending.extend(group[labels == c] for c in range(k) if np.any(labels == c))
+    return groups
+
+def area_tour(lat: np.ndarray, lng: np.ndarray, distance: str, ids: List) -> Tuple[List[int], np.ndarray, np.ndarray]:
+    """Closed tour through one area's stops, as local indices.
+    
+    Also returns the length of the edge into each stop and, for walking the
+    tour backwards, of the edge out of it to its predecessor; on one-way
+    roads the two differ.
+    """
+    if len(lat) == 1:
+        return [0], np.zeros(1), np.zeros(1)
+    dist = DistanceMatrix.from_coordinates(lat, lng, distance_provider(distance, ids))
+    tour = np.asarray(solve_tsp(dist, 0, list(range(1, len(lat))))[:-1], dtype=np.intp)
+    return tour.tolist(), dist.matrix[np.roll(tour, 1), tour], dist.matrix[tour, np.roll(tour, 1)]
+
+def _area_tour(lat: np.ndarray, lng: np.ndarray, distance: str, ids: List,
+               finish_by: Optional[float]) -> Tuple[List[int], np.ndarray, np.ndarray]:
+    """Worker entry point: area_tour, stopping at time.time() finish_by"""
+    with anytime(max(finish_by - time.time(), 0.0) if finish_by is not None else None):
+        return area_tour(lat, lng, distance, ids)
+
+def solve_areas(problem: ProblemInstance, groups: List[np.ndarray],
+                distance: str) -> List[Tuple[List[int], np.ndarray, np.ndarray]]:
+    """area_tour of every group; on the process pool when it has more than one worker"""
+    ids = problem.location_ids
+    tasks = [(problem.lat[group], problem.lng[group], distance, [ids[i] for i in group.tolist()]) for group in groups]
+    if parallel_workers() > 1 and len(groups) > 1:
+        time_limit = remaining()
+        finish_by = time.time() + time_limit if time_limit is not None else None
+        futures = [pool().submit(_area_tour, *task, finish_by) for task in tasks]
+        return [future.result() for future in futures]
+    return [area_tour(*task) for task in tasks]
+
+def area_order(problem: ProblemInstance, depot: int, groups: List[np.ndarray], distance: str) -> List[int]:
+    """Order in which to visit the groups: a tour from the depot through their centres"""
+    lat = np.array([problem.lat[depot]] + [problem.lat[group].mean() for group in groups])
+    lng = np.array([problem.lng[depot]] + [problem.lng[group].mean() for group in groups])
+    coarse = DistanceMatrix.from_coordinates(lat, lng, distance_provider(distance))
+    return [g - 1 for g in solve_tsp(coarse, 0, list(range(1, len(lat))))[1:-1]]
+
+def stitch(problem: ProblemInstance, depot: int, groups: List[np.ndarray],
+           tours: List[Tuple[List[int], np.ndarray, np.ndarray]], order: List[int], distance: str) -> Tuple[np.ndarray, np.ndarray, List[int]]:
+    """Join the area tours in the given order into one giant tour from the depot back to it.
+    
+    Each closed area tour is opened, in either direction, where entering
+    from the previous area and heading for the next area's centre costs
+    least. Returns the giant tour, the length of each of its edges and the
+    indices of the edges that join two areas.
+    """
+    provider = distance_provider(distance)
+    lat, lng = problem.lat, problem.lng
+    centres = [(problem.lat[group].mean(), problem.lng[group].mean()) for group in groups]
+    
+    giant = [np.array([depot])]
+    edges = []
+    joins = []
+    length = 1
+    last = depot
+    for k, g in enumerate(order):
+        tour, tour_edges, back_edges = tours[g]
+        nodes = groups[g][tour]
+        next_lat, next_lng = centres[order[k + 1]] if k + 1 < len(order) else (lat[depot], lng[depot])
+        
+        into = provider.matrix(lat[[last]], lng[[last]], lat[nodes], lng[nodes])[0]
+        onward = provider.matrix(lat[nodes], lng[nodes], np.array([next_lat]), np.array([next_lng]))[:, 0]
+        
+        # Opening the tour before position i: forwards enters nodes[i] and leaves nodes[i - 1], backwards the
+        # reverse. Backwards drives every edge the other way, which costs more or less on one-way roads
+        forward = into - tour_edges + np.roll(onward, 1) + tour_edges.sum()
+        backward = np.roll(into, 1) - back_edges + onward + back_edges.sum()
+        i, j = int(forward.argmin()), int(backward.argmin())
+        if forward[i] <= backward[j]:
+            path, inner, entry = np.roll(nodes, -i), np.roll(tour_edges, -i)[1:], into[i]
+        else:
+            path, inner, entry = np.roll(nodes, -j)[::-1], np.roll(back_edges, -j)[1:][::-1], into[j - 1]
+        
+        joins.append(length - 1)
+        giant.append(path)
+        edges.append(np.concatenate(([entry], inner)))
+        length += len(path)
+        last = int(path[-1])
+    
+    joins.append(length - 1)
+    giant.append(np.array([depot]))
+    edges.append(provider.matrix(lat[[last]], lng[[last]], lat[[depot]], lng[[depot]])[0])
+    return np.concatenate(giant).astype(np.intp), np.concatenate(edges), joins
+
+def repair_joins(problem: ProblemInstance, giant: np.ndarray, edges: np.ndarray, joins: List[int], distance: str):
+    """Re-optimize the stops around every join in place, keeping each window's outer neighbours fixed"""
+    ids = problem.location_ids
+    done = 1
+    repaired = 0
+    for t in joins:
+        if expired():
+            break
+        # giant[a:b] may move; giant[a - 1] and giant[b] anchor the window
+        a = max(t - JOIN_WINDOW + 1, done)
+        b = min(t + JOIN_WINDOW + 1, len(giant) - 1)
+        if b - a < 3:
+            continue
+        nodes = giant[a - 1:b + 1].copy()
+        provider = distance_provider(distance, [ids[i] for i in nodes.tolist()])
+        cost = provider.matrix(problem.lat[nodes], problem.lng[nodes])
+        
+        # A strongly negative edge between the anchors keeps them adjacent in the closed tour
+        m = len(nodes)
+        cost = np.array(cost, dtype=np.float64)
+        cost[0, m - 1] = cost[m - 1, 0] = -(np.abs(cost).sum() + 1)
+        tour = improve_tour(cost, list(range(m)))
+        k = tour.index(0)
+        tour = tour[k:] + tour[:k]
+        if tour[1] == m - 1:
+            tour = [0] + tour[:0:-1]
+        
+        giant[a - 1:b + 1] = nodes[tour]
+        edges[a - 1:b] = cost[tour[:-1], tour[1:]]
+        done = b
+        repaired += 1
+    count("hierarchical_joins_repaired", repaired)
+
+def split_tour(problem: ProblemInstance, depot: int, giant: np.ndarray, edges: np.ndarray, distance: str) -> List[Route]:
+    """Cut the giant tour into one stretch per partner in proportion to capacity.
+    
+    A partner returns to the depot within its stretch whenever the next
+    stop would exceed its capacity.
+    """
+    stops = giant[1:-1]
+    inner = edges[1:-1]  # inner[t] is the edge from stops[t] to stops[t + 1]
+    provider = distance_provider(distance)
+    lat, lng = problem.lat, problem.lng
+    outbound = provider.matrix(lat[[depot]], lng[[depot]], lat[stops], lng[stops])[0].tolist()
+    inbound = provider.matrix(lat[stops], lng[stops], lat[[depot]], lng[[depot]])[:, 0].tolist()
+    
+    demand = problem.demand[stops]
+    capacity = problem.capacity
+    shares = capacity / capacity.sum() if capacity.sum() > 0 else np.full(len(capacity), 1.0 / len(capacity))
+    cumulative = np.cumsum(demand)
+    bounds = [0] + np.searchsorted(cumulative, np.cumsum(shares)[:-1] * cumulative[-1], side="right").tolist()
+    bounds.append(len(stops))
+    
+    stops_list = stops.tolist()
+    inner_list = inner.tolist()
+    demand_list = demand.tolist()
+    routes = []
+    for p in range(problem.num_partners):
+        start, end = bounds[p], bounds[p + 1]
+        if start >= end:
+            continue
+        limit = float(capacity[p])
+        path = [depot, stops_list[start]]
+        distance_total = outbound[start]
+        load = demand_list[start]
+        for t in range(start + 1, end):
+            if load + demand_list[t] > limit:
+                # Back to the depot to reload before the next stop
+                path.append(depot)
+                distance_total += inbound[t - 1] + outbound[t]
+                load = 0.0
+            else:
+                distance_total += inner_list[t - 1]
+            path.append(stops_list[t])
+            load += demand_list[t]
+        path.append(depot)
+        distance_total += inbound[end - 1]
+        routes.append(problem.route(p, path, distance_total))
+    return routes
+
+def solve_hierarchical(problem: ProblemInstance, distance: str = "euclidean",
+                       areas: Optional[List] = None) -> List[Route]:
+    """Route city-scale instances area by area; areas optionally labels every location's area"""
+    if not problem.num_partners:
+        return []
+    depot = find_depot(problem)
+    deliveries = np.asarray(problem.deliveries(), dtype=np.intp)
+    if not len(deliveries):
+        return []
+    
+    with phase("partition"):
+        groups = group_areas(problem, deliveries, areas)
+    count("hierarchical_areas", len(groups))
+    
+    with phase("areas"):
+        tours = solve_areas(problem, groups, distance)
+    
+    with phase("stitch"):
+        order = area_order(problem, depot, groups, distance)
+        giant, edges, joins = stitch(problem, depot, groups, tours, order, distance)
+    
+    with phase("repair"):
+        repair_joins(problem, giant, edges, joins, distance)
+    
+    with phase("split"):
+        return split_tour(problem, depot, giant, edges, distance)
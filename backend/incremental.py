@@ -0,0 +1,208 @@
+"""Incremental repair of existing routes when stops are added or cancelled.
+
+Instead of re-running an optimizer from scratch, cancelled stops are cut out
+of their route and new stops are put in at the cheapest feasible position.
+Only the trips that changed are re-sequenced, with a local search seeded at
+the change and capped in moves, so every other stop keeps its place.
+"""
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+from metrics import count, phase
+from route_optimizer import (
+    DistanceMatrix,
+    ProblemInstance,
+    Route,
+    calculate_route_distance,
+    distance_provider,
+    find_depot,
+    improve_tour,
+    neighbour_lists,
+)
+
+# Improving moves allowed per repaired trip; keeps a repair to milliseconds
+REPAIR_MAX_MOVES = 50
+
+# A trip is the stops between two depot visits, as location indices
+Trip = List[int]
+
+def split_trips(path: List[int], depot: int) -> List[Trip]:
+    """Split a path of location indices into the trips between depot visits"""
+    trips = [[]]
+    for i in path:
+        if i == depot:
+            trips.append([])
+        else:
+            trips[-1].append(i)
+    return [trip for trip in trips if trip]
+
+def join_trips(trips: List[Trip], depot: int) -> List[int]:
+    """Path that starts at the depot and returns to it after every trip"""
+    path = [depot]
+    for trip in trips:
+        if trip:
+            path.extend(trip)
+            path.append(depot)
+    return path if len(path) > 1 else []
+
+def _cheapest_insertion(problem: ProblemInstance, dist: DistanceMatrix, depot: int, plans: Dict[int, List[Trip]],
+                        stop: int) -> Tuple[int, int, int]:
+    """Best (partner, trip, position) for a new stop; trip == len(trips) opens a new trip"""
+    demand = problem.demand[stop]
+    capacity = problem.capacity
+    best = None
+    best_cost = np.inf
+    
+    # Every gap of every trip whose partner still has room for the stop
+    slots = []
+    before, after = [], []
+    for p, trips in plans.items():
+        for t, trip in enumerate(trips):
+            if problem.demand[trip].sum() + demand > capacity[p]:
+                continue
+            stops = [depot] + trip + [depot]
+            slots.extend((p, t, k) for k in range(len(trip) + 1))
+            before.extend(stops[:-1])
+            after.extend(stops[1:])
+    count("insertion_slots_considered", len(slots))
+    
+    if slots:
+        before = np.asarray(before, dtype=np.intp)
+        after = np.asarray(after, dtype=np.intp)
+        matrix = dist.matrix
+        delta = matrix[before, stop] + matrix[stop, after] - matrix[before, after]
+        k = int(delta.argmin())
+        best, best_cost = slots[k], float(delta[k])
+    
+    # A partner without a route can take the stop as a trip of its own
+    capable = np.flatnonzero(capacity >= demand)
+    if not len(capable):
+        raise ValueError(f"Demand of location {problem.location_ids[stop]} exceeds every partner's capacity")
+    round_trip = float(dist.matrix[depot, stop] + dist.matrix[stop, depot])
+    idle = [p for p in capable.tolist() if not any(plans.get(p, ()))]
+    if idle and round_trip < best_cost:
+        best, best_cost = (idle[0], 0, 0), round_trip
+    
+    # Otherwise the least-loaded capable partner makes an extra trip
+    if best is None:
+        p = min(capable.tolist(), key=lambda q: sum(len(trip) for trip in plans.get(q, ())))
+        best = (p, len(plans.get(p, ())), 0)
+    return best
+
+def _resequence(dist: DistanceMatrix, depot: int, trip: Trip, changed: List[int],
+                max_moves: int) -> Trip:
+    """Improve one trip with a local search that starts at the changed stops"""
+    if len(trip) < 3:
+        return trip
+    
+    nodes = np.asarray([depot] + trip, dtype=np.intp)
+    cost = dist.submatrix(nodes)
+    position = {i: k for k, i in enumerate(nodes.tolist())}
+    active = [position[i] for i in changed if i in position]
+    
+    tour = improve_tour(cost, list(range(len(nodes))), neighbour_lists(cost), active, max_moves)
+    k = tour.index(0)
+    tour = tour[k + 1:] + tour[:k]
+    return [int(nodes[i]) for i in tour]
+
+def repair_routes(problem: ProblemInstance, routes: List[Tuple[int, List[int]]],
+                  added: List[int], removed: List[int], max_moves: int = REPAIR_MAX_MOVES,
+                  dist: Optional[DistanceMatrix] = None) -> Tuple[List[Route], List[int]]:
+    """Apply added and removed stops to existing routes.
+    
+    Routes are (partner index, path of location indices) pairs. Insertion
+    costs and route distances come from dist, which should use the metric
+    the routes were planned with. Returns the updated routes, in their
+    original order followed by routes of newly used partners, and the
+    indices of the partners whose route changed.
+    """
+    depot = find_depot(problem)
+    if dist is None:
+        dist = DistanceMatrix(problem)
+    plans: Dict[int, List[Trip]] = {}
+    order = []
+    where: Dict[int, Tuple[int, int]] = {}
+    for p, path in routes:
+        if p in plans:
+            raise ValueError(f"Partner {problem.partner_ids[p]} has more than one route")
+        plans[p] = split_trips(path, depot)
+        order.append(p)
+        for t, trip in enumerate(plans[p]):
+            for i in trip:
+                where[i] = (p, t)
+    
+    # Stops next to a change are where the local search starts looking
+    touched: Dict[Tuple[int, int], List[int]] = {}
+    
+    with phase("removal"):
+        for i in removed:
+            if i not in where:
+                raise ValueError(f"Location {problem.location_ids[i]} is not on any route")
+            p, t = where.pop(i)
+            trip = plans[p][t]
+            k = trip.index(i)
+            del trip[k]
+            touched.setdefault((p, t), []).extend(trip[max(k - 1, 0):k + 1])
+    
+    with phase("insertion"):
+        for i in added:
+            if i == depot:
+                raise ValueError("The depot cannot be added as a stop")
+            if i in where:
+                raise ValueError(f"Location {problem.location_ids[i]} is already on a route")
+            p, t, k = _cheapest_insertion(problem, dist, depot, plans, i)
+            if p not in plans:
+                plans[p] = []
+                order.append(p)
+            if t == len(plans[p]):
+                plans[p].append([])
+            plans[p][t].insert(k, i)
+            where[i] = (p, t)
+            touched.setdefault((p, t), []).append(i)
+    
+    with phase("resequence"):
+        for (p, t), changed in touched.items():
+            plans[p][t] = _resequence(dist, depot, plans[p][t], changed, max_moves)
+    
+    changed_partners = sorted({p for p, _ in touched})
+    result = []
+    for p in order:
+        path = join_trips(plans[p], depot)
+        if not path:
+            continue
+        result.append(problem.route(p, path, calculate_route_distance(dist, path)))
+    return result, changed_partners
+
+def reoptimize_routes(locations_data: List[Dict], partners_data: List[Dict], routes_data: List[Dict],
+                      add: Optional[List] = None, remove: Optional[List] = None,
+                      distance: str = "euclidean") -> Dict:
+    """Repair routes in the optimize_routes response format after stops change.
+    
+    distance names the metric the routes were planned with, as for optimize_routes.
+    """
+    problem = ProblemInstance(locations_data, partners_data)
+    provider = distance_provider(distance, problem.location_ids)
+    
+    def location_index(loc_id) -> int:
+        if loc_id not in problem.index:
+            raise ValueError(f"Unknown location: {loc_id}")
+        return problem.index[loc_id]
+    
+    routes = []
+    for route in routes_data:
+        if route["partnerId"] not in problem.partner_index:
+            raise ValueError(f"Unknown partner: {route['partnerId']}")
+        routes.append((problem.partner_index[route["partnerId"]], [location_index(i) for i in route["path"]]))
+    
+    repaired, changed = repair_routes(
+        problem, routes,
+        [location_index(i) for i in add or ()],
+        [location_index(i) for i in remove or ()],
+        dist=DistanceMatrix(problem, provider)
+    )
+    return {
+        "algorithm": "Incremental Repair (Cheapest Insertion)",
+        "routes": [route.to_dict() for route in repaired],
+        "changedPartners": [problem.partner_ids[p] for p in changed],
+        "distanceUnits": provider.units
+    }
@@ -0,0 +1,321 @@
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from metrics import Profile, profiling
+from parallel import mark_worker
+from result_cache import ResultCache, problem_key
+from route_optimizer import optimize_routes
+
+# Pool and queue limits, overridable from the environment
+MAX_WORKERS = int(os.environ.get("OPTIMIZER_WORKERS", os.cpu_count() or 1))
+MAX_PENDING_JOBS = int(os.environ.get("OPTIMIZER_MAX_PENDING_JOBS", 64))
+JOB_TIMEOUT = float(os.environ.get("OPTIMIZER_JOB_TIMEOUT", 60))
+JOB_RETENTION = float(os.environ.get("OPTIMIZER_JOB_RETENTION", 600))
+MAX_BATCH_SIZE = int(os.environ.get("OPTIMIZER_MAX_BATCH_SIZE", 200))
+CANCEL_POLL_INTERVAL = 0.1  # Seconds between a worker's checks of its job's cancel event
+
+class QueueFullError(Exception):
+    """Raised when too many jobs are already queued or running"""
+
+class JobTimeoutError(Exception):
+    """Raised inside a worker when a job runs past its time limit"""
+
+def _on_timeout(signum, frame):
+    raise JobTimeoutError()
+
+@contextmanager
+def time_limit(seconds: Optional[float]):
+    """Raise JobTimeoutError in the main thread once `seconds` have passed"""
+    if not seconds or not hasattr(signal, "setitimer"):
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+@contextmanager
+def watching(cancel) -> Iterator[Optional[threading.Event]]:
+    """A local event that is set soon after the shared `cancel` event is.
+    
+    The search polls its event constantly; a thread here polls the manager's
+    every CANCEL_POLL_INTERVAL instead, so each poll isn't a round trip.
+    """
+    if cancel is None:
+        yield None
+        return
+    local = threading.Event()
+    done = threading.Event()
+    
+    def watch():
+        try:
+            while not done.is_set():
+                if cancel.wait(CANCEL_POLL_INTERVAL):
+                    local.set()
+                    return
+        except (EOFError, OSError):
+            # The manager has shut down; nobody is left to cancel the job
+            return
+    
+    threading.Thread(target=watch, name="job-cancel", daemon=True).start()
+    try:
+        yield local
+    finally:
+        done.set()
+
+def run_optimization(locations: List[Dict], partners: List[Dict], algorithm: str, timeout: float,
+                     distance: str = "euclidean", cancel=None) -> Dict:
+    """Worker entry point: run one optimization, interrupted after `timeout` seconds.
+    
+    Setting the shared `cancel` event stops the search at its next check, and
+    the best solution reached so far is returned.
+    """
+    with time_limit(timeout), watching(cancel) as cancelled:
+        return optimize_routes(locations, partners, algorithm, distance=distance, cancelled=cancelled)
+
+def run_profiled(locations: List[Dict], partners: List[Dict], algorithm: str, distance: str = "euclidean",
+                 time_limit: Optional[float] = None) -> Tuple[Dict, Profile]:
+    """Worker entry point for a request waiting on its result: the result and the profile of its phases"""
+    with profiling() as profile:
+        result = optimize_routes(locations, partners, algorithm, distance=distance, time_limit=time_limit)
+    return result, profile
+
+def _worker_ready() -> int:
+    """Worker entry point that does nothing; unpickling it imports this module and the optimizers"""
+    return os.getpid()
+
+class Job:
+    def __init__(self, algorithm: str):
+        self.id = uuid.uuid4().hex
+        self.algorithm = algorithm
+        self.status = "queued"  # queued, running, cancelling, completed, failed, cancelled or timeout
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.future: Optional[Future] = None
+        self.key: Optional[str] = None  # Result cache key of the problem
+        self.cancel_event = None  # Manager event the worker watches; set to stop a running job
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled", "timeout")
+    
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "algorithm": self.algorithm,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "createdAt": self.created_at,
+            "finishedAt": self.finished_at
+        }
+
+class JobManager:
+    """Runs optimizations on a bounded process pool and tracks them by job id"""
+    def __init__(self, max_workers: int = MAX_WORKERS, max_pending: int = MAX_PENDING_JOBS,
+                 timeout: float = JOB_TIMEOUT, retention: float = JOB_RETENTION,
+                 cache: Optional[ResultCache] = None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retention = retention
+        self.cache = cache
+        self.jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+    
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # Created on first use so importing the server does not spawn workers;
+        # spawn avoids forking a multi-threaded web server. A job already has its
+        # core, so its solve runs inline rather than starting a pool of its own
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=mark_worker
+            )
+        return self._executor
+    
+    def _cancel_event(self):
+        """A new event the pool's workers can see, from a manager process started on first use"""
+        if self._manager is None:
+            self._manager = multiprocessing.get_context("spawn").Manager()
+        return self._manager.Event()
+    
+    def start(self):
+        """Spawn every pool worker now, so the first solves don't wait for processes to start"""
+        for future in [self.executor.submit(_worker_ready) for _ in range(self.max_workers)]:
+            future.result()
+    
+    def pending_count(self) -> int:
+        return sum(1 for job in self.jobs.values() if not job.finished)
+    
+    def submit(self, locations: List[Dict], partners: List[Dict], algorithm: str,
+               distance: str = "euclidean") -> Job:
+        """Queue an optimization and return its job"""
+        key = problem_key(locations, partners, algorithm, distance=distance)
+        cached = self.cache.get(key) if self.cache is not None else None
+        
+        with self._lock:
+            self._expire()
+            job = Job(algorithm)
+            job.key = key
+            
+            # Cached problems complete immediately without touching the pool
+            if cached is not None:
+                job.status = "completed"
+                job.result = cached
+                job.finished_at = time.time()
+                self.jobs[job.id] = job
+                return job
+            
+            if self.pending_count() >= self.max_pending:
+                raise QueueFullError(f"Too many pending jobs (limit {self.max_pending})")
+            
+            self.jobs[job.id] = job
+            job.cancel_event = self._cancel_event()
+            job.future = self.executor.submit(run_optimization, locations, partners, algorithm, self.timeout, distance,
+                                              job.cancel_event)
+        
+        job.future.add_done_callback(lambda future: self._finish(job, future))
+        return job
+    
+    def solve(self, locations: List[Dict], partners: List[Dict], algorithm: str, distance: str = "euclidean",
+              time_limit: Optional[float] = None) -> Tuple[Dict, Profile]:
+        """Run one optimization on the pool and wait for it.
+        
+        Synchronous requests solve here rather than on their server thread, so
+        concurrent solves run side by side instead of taking turns on the
+        server's GIL, and no more dense matrices are held at once than the
+        pool has workers.
+        """
+        return self.executor.submit(run_profiled, locations, partners, algorithm, distance, time_limit).result()
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job, refreshing whether it has started"""
+        job = self.jobs.get(job_id)
+        if job and job.status == "queued" and job.future is not None and job.future.running():
+            job.status = "running"
+        return job
+    
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job; False once it has finished.
+        
+        A queued job is dropped at once. A running one is asked to stop: it
+        is "cancelling" until its search notices, then "cancelled" with the
+        best solution it had reached as its result.
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        
+        if job.future.cancel():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            return True
+        
+        # Running: it keeps its worker, and its place in the pending count, until its search stops
+        with self._lock:
+            if job.finished:
+                return False
+            job.status = "cancelling"
+        job.cancel_event.set()
+        return True
+    
+    def run_batch(self, instances: List[Tuple[int, Dict]]) -> Iterator[Dict]:
+        """Solve independent (index, instance) problems in parallel, yielding each as it finishes"""
+        futures = {}
+        try:
+            for index, instance in instances:
+                algorithm = instance.get("algorithm", "greedy")
+                distance = instance.get("distance", "euclidean")
+                key = problem_key(instance["locations"], instance["partners"], algorithm, distance=distance)
+                cached = self.cache.get(key) if self.cache is not None else None
+                if cached is not None:
+                    yield self._batch_item(index, instance, "completed", result=cached)
+                    continue
+                
+                future = self.executor.submit(
+                    run_optimization, instance["locations"], instance["partners"], algorithm, self.timeout, distance
+                )
+                futures[future] = (index, instance, key)
+            
+            for future in as_completed(futures):
+                index, instance, key = futures[future]
+                try:
+                    result = future.result()
+                except JobTimeoutError:
+                    yield self._batch_item(index, instance, "timeout", error=f"Optimization exceeded {self.timeout:g}s")
+                    continue
+                except Exception as e:
+                    yield self._batch_item(index, instance, "failed", error=str(e))
+                    continue
+                
+                if self.cache is not None:
+                    self.cache.put(key, result)
+                yield self._batch_item(index, instance, "completed", result=result)
+        finally:
+            # Drop queued work if the client goes away before the batch is done
+            for future in futures:
+                future.cancel()
+    
+    @staticmethod
+    def _batch_item(index: int, instance: Dict, status: str, result: Optional[Dict] = None,
+                    error: Optional[str] = None) -> Dict:
+        item = {"index": index, "id": instance.get("id"), "status": status}
+        if result is not None:
+            item["result"] = result
+        if error is not None:
+            item["error"] = error
+        return item
+    
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+    
+    def _finish(self, job: Job, future: Future):
+        with self._lock:
+            if job.finished:
+                return
+            job.finished_at = time.time()
+            try:
+                job.result = future.result()
+                # A cancelled search's result is only the best it reached, so it is not cached
+                if job.status == "cancelling":
+                    job.status = "cancelled"
+                else:
+                    job.status = "completed"
+                    if self.cache is not None:
+                        self.cache.put(job.key, job.result)
+            except CancelledError:
+                job.status = "cancelled"
+            except JobTimeoutError:
+                job.status = "timeout"
+                job.error = f"Optimization exceeded {self.timeout:g}s"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+    
+    def _expire(self):
+        # Forget finished jobs once they have been kept for the retention period
+        cutoff = time.time() - self.retention
+        for job_id in [job.id for job in self.jobs.values() if job.finished and job.finished_at < cutoff]:
+            del self.jobs[job_id]
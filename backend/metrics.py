@@ -0,0 +1,164 @@
+"""Per-request profiling and Prometheus metrics for the route optimizers.
+
+The optimizers report phase timings and search counters through `phase()` and
+`count()`. Both are no-ops unless a profile is active in the current context,
+so library callers pay nothing for instrumentation they never asked for.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+_active_profile: contextvars.ContextVar = contextvars.ContextVar("active_profile", default=None)
+
+class Profile:
+    """Wall-clock time per phase and event counters for one optimization"""
+    __slots__ = ("phases", "counters")
+    
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+    
+    def add_time(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+    
+    def merge(self, other: "Profile"):
+        """Add another profile's phases and counters, such as one collected in a pool worker"""
+        for name, seconds in other.phases.items():
+            self.add_time(name, seconds)
+        for name, n in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + n
+    
+    def to_dict(self) -> Dict:
+        return {
+            "phasesMs": {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()},
+            "counters": dict(self.counters)
+        }
+
+@contextmanager
+def profiling() -> Iterator[Profile]:
+    """Collect phase timings and counters from everything run inside the block"""
+    profile = Profile()
+    token = _active_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _active_profile.reset(token)
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Add the time spent inside the block to the active profile's `name` phase"""
+    profile = _active_profile.get()
+    if profile is None:
+        yield
+        return
+    
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_time(name, time.perf_counter() - start)
+
+def count(name: str, n: int = 1):
+    """Add n to a counter of the active profile; call once per batch, not per event"""
+    profile = _active_profile.get()
+    if profile is not None:
+        profile.counters[name] = profile.counters.get(name, 0) + int(n)
+
+# Request latency buckets in seconds, from cache hits up to the job timeout
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus sense"""
+    __slots__ = ("buckets", "counts", "total", "observations")
+    
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.total = 0.0
+        self.observations = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.observations += 1
+
+def _labels(**labels) -> str:
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """Process-wide optimizer metrics rendered in the Prometheus text format"""
+    
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        self._latency: Dict[Tuple[str, str], Histogram] = {}
+        self._phase_seconds: Dict[Tuple[str, str], float] = {}
+        self._counters: Dict[Tuple[str, str], int] = {}
+        self._errors = 0
+    
+    def observe(self, algorithm: str, seconds: float, profile: Optional[Profile] = None, cache: str = "miss"):
+        """Record one finished optimization request"""
+        with self._lock:
+            histogram = self._latency.get((algorithm, cache))
+            if histogram is None:
+                histogram = self._latency[(algorithm, cache)] = Histogram(self._buckets)
+            histogram.observe(seconds)
+            if profile is not None:
+                for name, spent in profile.phases.items():
+                    key = (algorithm, name)
+                    self._phase_seconds[key] = self._phase_seconds.get(key, 0.0) + spent
+                for name, n in profile.counters.items():
+                    key = (algorithm, name)
+                    self._counters[key] = self._counters.get(key, 0) + n
+    
+    def observe_error(self):
+        with self._lock:
+            self._errors += 1
+    
+    def render(self, extra: Optional[List[Tuple[str, str, str, float]]] = None) -> str:
+        """Prometheus exposition text; extra holds (name, type, help, value) samples"""
+        lines = []
+        with self._lock:
+            lines.append("# HELP route_optimizer_request_seconds Optimization request latency")
+            lines.append("# TYPE route_optimizer_request_seconds histogram")
+            for (algorithm, cache), histogram in sorted(self._latency.items()):
+                cumulative = 0
+                bounds = [_number(b) for b in histogram.buckets] + ["+Inf"]
+                for bound, n in zip(bounds, histogram.counts):
+                    cumulative += n
+                    lines.append(f"route_optimizer_request_seconds_bucket"
+                                 f"{_labels(algorithm=algorithm, cache=cache, le=bound)} {cumulative}")
+                labels = _labels(algorithm=algorithm, cache=cache)
+                lines.append(f"route_optimizer_request_seconds_sum{labels} {_number(histogram.total)}")
+                lines.append(f"route_optimizer_request_seconds_count{labels} {histogram.observations}")
+            
+            lines.append("# HELP route_optimizer_phase_seconds_total Time spent per optimization phase")
+            lines.append("# TYPE route_optimizer_phase_seconds_total counter")
+            for (algorithm, name), spent in sorted(self._phase_seconds.items()):
+                lines.append(f"route_optimizer_phase_seconds_total{_labels(algorithm=algorithm, phase=name)} "
+                             f"{_number(spent)}")
+            
+            lines.append("# HELP route_optimizer_search_events_total Search work done by the optimizers")
+            lines.append("# TYPE route_optimizer_search_events_total counter")
+            for (algorithm, name), n in sorted(self._counters.items()):
+                lines.append(f"route_optimizer_search_events_total{_labels(algorithm=algorithm, event=name)} {n}")
+            
+            lines.append("# HELP route_optimizer_request_errors_total Optimization requests that failed")
+            lines.append("# TYPE route_optimizer_request_errors_total counter")
+            lines.append(f"route_optimizer_request_errors_total {self._errors}")
+        
+        for name, kind, help_text, value in extra or ():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {_number(value)}")
+        
+        return "\n".join(lines) + "\n"
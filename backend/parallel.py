@@ -0,0 +1,135 @@
+"""Process pool and shared-memory distance matrices for solving in parallel.
+
+Work that fans out over processes copies the distance matrix, and the
+coordinates of its locations, into shared memory once; workers map it
+through SharedDistance instead of each receiving a pickled copy. Pools
+never nest: solves inside a pool worker, this module's or the job pool's,
+see parallel_workers() == 1 and run inline.
+"""
+import multiprocessing
+import multiprocessing.util
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from anytime import anytime, remaining
+
+# Pool size, overridable from the environment
+PARALLEL_WORKERS = int(os.environ.get("PARALLEL_WORKERS", os.cpu_count() or 1))
+
+# Set in pool workers, whose solves must not start a pool of their own
+_in_worker = False
+
+def mark_worker():
+    """Pool initializer: solves in this process run inline instead of starting a nested pool"""
+    global _in_worker
+    _in_worker = True
+
+def parallel_workers() -> int:
+    """Processes a solve may fan out over: PARALLEL_WORKERS, or 1 inside a pool worker"""
+    return 1 if _in_worker else PARALLEL_WORKERS
+
+class SharedDistance:
+    """Distance provider for a matrix that another process placed in shared memory.
+    
+    The block holds the n x n matrix followed by two rows with the
+    locations' latitudes and longitudes.
+    """
+    def __init__(self, name: str, size: int, units: str, symmetric: bool):
+        self.name = name
+        self.size = size
+        self.units = units
+        self.symmetric = symmetric
+        self._shm: Optional[SharedMemory] = None
+    
+    def __getstate__(self):
+        return {"name": self.name, "size": self.size, "units": self.units, "symmetric": self.symmetric}
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = None
+    
+    def _block(self) -> np.ndarray:
+        if self._shm is None:
+            self._shm = SharedMemory(name=self.name)
+        return np.ndarray((self.size + 2, self.size), dtype=np.float64, buffer=self._shm.buf)
+    
+    def matrix(self, lat: np.ndarray, lng: np.ndarray,
+               to_lat: Optional[np.ndarray] = None, to_lng: Optional[np.ndarray] = None) -> np.ndarray:
+        if to_lat is not None or len(lat) != self.size:
+            raise ValueError("A shared distance matrix only covers the problem it was built for")
+        return self._block()[:self.size]
+    
+    def coordinates(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Latitudes and longitudes of the matrix's locations"""
+        block = self._block()
+        return block[self.size], block[self.size + 1]
+    
+    def close(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+@contextmanager
+def shared_distances(dist) -> Iterator[SharedDistance]:
+    """Copy a DistanceMatrix into shared memory for the duration of the block"""
+    n = len(dist)
+    shm = SharedMemory(create=True, size=max((n + 2) * n * 8, 1))
+    try:
+        block = np.ndarray((n + 2, n), dtype=np.float64, buffer=shm.buf)
+        block[:n] = dist.matrix
+        block[n] = dist.lat
+        block[n + 1] = dist.lng
+        del block
+        yield SharedDistance(shm.name, n, dist.units, dist.symmetric)
+    finally:
+        shm.close()
+        shm.unlink()
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def pool() -> ProcessPoolExecutor:
+    """The shared process pool, created on first use"""
+    # Spawn avoids forking a multi-threaded web server
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PARALLEL_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=mark_worker)
+            # Inside a job worker the pool must stop before the worker closes its queues and joins its children
+            multiprocessing.util.Finalize(_executor, _executor.shutdown, exitpriority=100)
+        return _executor
+
+def _sequence(shared: SharedDistance, start: int, stops: List[int], finish_by: Optional[float]) -> List[int]:
+    """Worker entry point: solve_tsp over the shared matrix, stopping at time.time() finish_by"""
+    from route_optimizer import DistanceMatrix, solve_tsp
+    
+    try:
+        lat, lng = shared.coordinates()
+        dist = DistanceMatrix.from_coordinates(lat, lng, shared)
+        with anytime(max(finish_by - time.time(), 0.0) if finish_by is not None else None):
+            path = solve_tsp(dist, start, stops)
+        # Views of the shared block must be gone before it can be closed
+        del dist, lat, lng
+        return path
+    finally:
+        shared.close()
+
+def sequence_clusters(dist, start: int, clusters: List[List[int]]) -> List[List[int]]:
+    """Closed path from the start through each cluster, with the clusters solved on the pool.
+    
+    Workers get what is left of the active search's time limit.
+    """
+    time_limit = remaining()
+    finish_by = time.time() + time_limit if time_limit is not None else None
+    with shared_distances(dist) as shared:
+        futures = [pool().submit(_sequence, shared, start, stops, finish_by) for stops in clusters]
+        return [future.result() for future in futures]
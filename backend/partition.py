@@ -0,0 +1,108 @@
+"""Geographic partitioning of stops into one cluster per partner.
+
+A polar sweep around the depot seeds the clusters, and a capacity-balanced
+k-means pass then pulls every cluster together around its own centre. Each
+cluster's share of the total demand follows its partner's share of the total
+capacity. All distance work is vectorised over the stops, so a pass costs
+O(n k) for n stops and k clusters.
+"""
+from typing import Optional
+
+import numpy as np
+
+# Lloyd iterations of the balanced k-means pass; it usually settles well before
+KMEANS_ITERATIONS = 10
+
+# A cluster may exceed its demand share by this fraction, leaving room to stay compact
+BALANCE_SLACK = 0.05
+
+def _shares(capacity: np.ndarray) -> np.ndarray:
+    total = capacity.sum()
+    if total <= 0:
+        return np.full(len(capacity), 1.0 / len(capacity))
+    return capacity / total
+
+def sweep(lat: np.ndarray, lng: np.ndarray, origin_lat: float, origin_lng: float,
+          weights: np.ndarray, capacity: np.ndarray) -> np.ndarray:
+    """Cluster label per stop from cutting the stops' polar order around the origin into weighted wedges.
+    
+    The sweep starts at the widest angular gap between stops, so no wedge
+    straddles an empty sector.
+    """
+    n = len(lat)
+    labels = np.empty(n, dtype=np.intp)
+    if n == 0:
+        return labels
+    
+    angle = np.arctan2(lat - origin_lat, lng - origin_lng)
+    order = np.argsort(angle, kind="stable")
+    gaps = np.diff(angle[order], append=angle[order[0]] + 2 * np.pi)
+    order = np.roll(order, -(int(gaps.argmax()) + 1))
+    
+    # Each stop goes to the wedge its weight midpoint falls into
+    cumulative = np.cumsum(weights[order])
+    total = cumulative[-1]
+    midpoint = (cumulative - weights[order] / 2) / total if total > 0 else (np.arange(n) + 0.5) / n
+    bounds = np.cumsum(_shares(capacity))[:-1]
+    labels[order] = np.searchsorted(bounds, midpoint, side="right")
+    return labels
+
+def _assign(lat: np.ndarray, lng: np.ndarray, weights: np.ndarray, centre_lat: np.ndarray,
+            centre_lng: np.ndarray, limit: np.ndarray) -> np.ndarray:
+    """Nearest centre per stop, subject to each centre's weight limit.
+    
+    Stops with the most to lose from their second choice pick first; a stop
+    that fits nowhere goes to the centre with the most room left.
+    """
+    d_lat = lat[:, None] - centre_lat[None, :]
+    d_lng = lng[:, None] - centre_lng[None, :]
+    d = d_lat * d_lat + d_lng * d_lng
+    preference = np.argsort(d, axis=1, kind="stable")
+    
+    if d.shape[1] > 1:
+        ranked = np.take_along_axis(d, preference[:, :2], axis=1)
+        regret = ranked[:, 1] - ranked[:, 0]
+    else:
+        regret = np.zeros(len(lat))
+    
+    room = limit.astype(np.float64)
+    labels = np.empty(len(lat), dtype=np.intp)
+    weight = weights.tolist()
+    for i in np.argsort(-regret, kind="stable").tolist():
+        w = weight[i]
+        for c in preference[i].tolist():
+            if room[c] >= w:
+                break
+        else:
+            c = int(room.argmax())
+        labels[i] = c
+        room[c] -= w
+    return labels
+
+def balanced_kmeans(lat: np.ndarray, lng: np.ndarray, weights: np.ndarray, capacity: np.ndarray,
+                    labels: np.ndarray, iterations: int = KMEANS_ITERATIONS) -> np.ndarray:
+    """Improve cluster labels with k-means whose clusters keep to their demand shares"""
+    k = len(capacity)
+    limit = weights.sum() * _shares(capacity) * (1 + BALANCE_SLACK)
+    for _ in range(iterations):
+        size = np.bincount(labels, minlength=k)
+        centre_lat = np.bincount(labels, weights=lat, minlength=k)
+        centre_lng = np.bincount(labels, weights=lng, minlength=k)
+        # A cluster left empty keeps no centre to pull stops towards
+        used = size > 0
+        centre_lat = np.where(used, centre_lat / np.maximum(size, 1), np.inf)
+        centre_lng = np.where(used, centre_lng / np.maximum(size, 1), np.inf)
+        
+        updated = _assign(lat, lng, weights, centre_lat, centre_lng, np.where(used, limit, 0.0))
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return labels
+
+def partition(lat: np.ndarray, lng: np.ndarray, origin_lat: float, origin_lng: float,
+              weights: np.ndarray, capacity: np.ndarray, iterations: Optional[int] = KMEANS_ITERATIONS) -> np.ndarray:
+    """Cluster label per stop, one cluster per entry of capacity: a sweep refined by balanced k-means"""
+    labels = sweep(lat, lng, origin_lat, origin_lng, weights, capacity)
+    if iterations and len(lat) > len(capacity):
+        labels = balanced_kmeans(lat, lng, weights, capacity, labels, iterations)
+    return labels
@@ -0,0 +1,176 @@
+"""Portfolio solving: every strategy, plus seeded restarts, at once on a process pool.
+
+The distance matrix is built once in the calling process and placed in
+shared memory by parallel.shared_distances; workers map it instead of
+receiving a pickled copy, so a strategy starts at the cost of parsing the
+problem. Inside a pool worker, where pools don't nest, the runs take turns
+in-process instead. Plans that respect
+every partner's capacity beat shorter plans that do not, and among those
+the shortest wins.
+"""
+import os
+import time
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from anytime import anytime, cancellation, expired, remaining, report
+from metrics import count
+from parallel import PARALLEL_WORKERS, SharedDistance, parallel_workers, pool, shared_distances
+from route_optimizer import (
+    DistanceMatrix,
+    ProblemInstance,
+    Route,
+    find_depot,
+    optimize_route_backtracking,
+    optimize_route_divide_conquer,
+    optimize_route_dynamic,
+    optimize_route_greedy,
+    optimize_route_local_search,
+    optimize_route_savings,
+)
+
+# Budgets, overridable from the environment
+PORTFOLIO_TIME_LIMIT = float(os.environ.get("PORTFOLIO_TIME_LIMIT", 5))  # Seconds per strategy without a time limit
+PORTFOLIO_MIN_SEEDS = int(os.environ.get("PORTFOLIO_MIN_SEEDS", 2))  # Seeded local search restarts
+
+# Deterministic strategies, each run once
+STRATEGIES = {
+    "divide_and_conquer": optimize_route_divide_conquer,
+    "greedy": optimize_route_greedy,
+    "dynamic": optimize_route_dynamic,
+    "backtracking": optimize_route_backtracking,
+    "local_search": optimize_route_local_search,
+    "savings": optimize_route_savings,
+}
+
+def capacity_feasible(problem: ProblemInstance, routes: List[Route]) -> bool:
+    """Whether every trip between depot visits stays within its partner's capacity"""
+    depot = find_depot(problem)
+    for route in routes:
+        capacity = problem.capacity[problem.partner_index[route.partner_id]]
+        load = 0.0
+        for loc_id in route.path:
+            i = problem.index[loc_id]
+            load = 0.0 if i == depot else load + problem.demand[i]
+            if load > capacity + 1e-9:
+                return False
+    return True
+
+def _solve_run(strategy: str, seed: Optional[int], problem: ProblemInstance, dist: DistanceMatrix,
+               finish_by: float) -> Dict:
+    """One strategy run, stopping at time.time() finish_by or when the active search is cancelled"""
+    start = time.perf_counter()
+    # A run that waited its turn gets only what is left of the budget; its incumbents stay its own
+    with anytime(max(finish_by - time.time(), 0.0), cancelled=cancellation()):
+        if seed is None:
+            routes = STRATEGIES[strategy](problem, dist)
+        else:
+            routes = optimize_route_local_search(problem, dist, seed=seed)
+    return {
+        "routes": [route.to_dict() for route in routes],
+        "distance": float(sum(route.distance for route in routes)),
+        "feasible": capacity_feasible(problem, routes),
+        "seconds": time.perf_counter() - start
+    }
+
+def _run_strategy(strategy: str, seed: Optional[int], locations_data: List[Dict], partners_data: List[Dict],
+                  shared: SharedDistance, finish_by: float) -> Dict:
+    """Worker entry point: one strategy over the shared distance matrix, stopping at time.time() finish_by"""
+    problem = ProblemInstance(locations_data, partners_data)
+    try:
+        dist = DistanceMatrix(problem, shared)
+        run = _solve_run(strategy, seed, problem, dist, finish_by)
+        # Views of the shared block must be gone before it can be closed
+        del dist
+        return run
+    finally:
+        shared.close()
+
+def _run_inline(strategy: str, seed: Optional[int], problem: ProblemInstance, dist: DistanceMatrix,
+                finish_by: float) -> Future:
+    """One strategy run in this process, as an already finished future"""
+    future = Future()
+    try:
+        future.set_result(_solve_run(strategy, seed, problem, dist, finish_by))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def strategy_runs(workers: int = PARALLEL_WORKERS) -> List[Tuple[str, Optional[int]]]:
+    """(strategy, seed) pairs: every strategy once, then seeded restarts on the cores left over"""
+    seeds = max(PORTFOLIO_MIN_SEEDS, workers - len(STRATEGIES))
+    return [(name, None) for name in STRATEGIES] + [(f"local_search:seed={seed}", seed) for seed in range(1, seeds + 1)]
+
+def solve_portfolio(problem: ProblemInstance, dist: DistanceMatrix, locations_data: List[Dict],
+                    partners_data: List[Dict]) -> Tuple[List[Route], Dict]:
+    """Run every strategy run in parallel, or in turns inside a pool worker, and keep the best plan.
+    
+    Each run gets the active search's remaining time, or PORTFOLIO_TIME_LIMIT,
+    as its own cooperative limit; runs taking turns share it. Returns the
+    winning routes and a summary with the winner and every run's distance,
+    feasibility and time.
+    """
+    time_limit = remaining()
+    if time_limit is None:
+        time_limit = PORTFOLIO_TIME_LIMIT
+    
+    workers = parallel_workers()
+    with shared_distances(dist) if workers > 1 else nullcontext() as shared:
+        finish_by = time.time() + time_limit
+        futures: Dict[Future, str] = {}
+        for strategy, seed in strategy_runs(workers):
+            if shared is not None:
+                future = pool().submit(_run_strategy, strategy, seed, locations_data, partners_data, shared, finish_by)
+            elif futures and expired():
+                # Cancelled; the runs done so far are all there is
+                break
+            else:
+                future = _run_inline(strategy, seed, problem, dist, finish_by)
+            futures[future] = strategy
+        
+        # Runs stop themselves at the time limit; the grace covers their setup and first solution
+        give_up = time.perf_counter() + time_limit + max(1.0, time_limit)
+        runs: Dict[str, Dict] = {}
+        best: Optional[Tuple[bool, float, str]] = None
+        pending = set(futures)
+        while pending and time.perf_counter() < give_up:
+            done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+            for future in done:
+                strategy = futures[future]
+                try:
+                    run = future.result()
+                except Exception as e:
+                    runs[strategy] = {"error": str(e)}
+                    continue
+                runs[strategy] = run
+                routes = [Route(r["partnerId"], r["path"], r["distance"]) for r in run["routes"]]
+                run["routes"] = routes
+                # Only feasible plans stream out, so a short infeasible one cannot mask them
+                if run["feasible"]:
+                    report(routes)
+                rank = (not run["feasible"], run["distance"], strategy)
+                if best is None or rank < best:
+                    best = rank
+        for future in pending:
+            future.cancel()
+            runs[futures[future]] = {"error": "Did not finish in time"}
+    
+    count("portfolio_runs", len(futures))
+    if best is None:
+        raise ValueError("No portfolio strategy finished: " + "; ".join(
+            f"{name}: {run['error']}" for name, run in runs.items()))
+    
+    winner = best[2]
+    summary = {
+        "winner": winner,
+        "runs": [
+            {"strategy": name, "error": run["error"]} if "error" in run else
+            {"strategy": name, "distance": run["distance"], "feasible": run["feasible"],
+             "seconds": round(run["seconds"], 3)}
+            for name, run in sorted(runs.items(), key=lambda item: item[1].get("distance", np.inf))
+        ]
+    }
+    return runs[winner]["routes"], summary
@@ -0,0 +1,250 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from incremental import split_trips
+from route_optimizer import EXACT_TSP_MAX_NODES, held_karp, improve_tour, nearest_neighbour_tour, neighbour_lists
+
+# Re-planning cadence and budgets, overridable from the environment
+REPLAN_INTERVAL = float(os.environ.get("REPLAN_INTERVAL", 2))  # Seconds updates are coalesced for
+REPLAN_MIN_INTERVAL = float(os.environ.get("REPLAN_MIN_INTERVAL", 10))  # Per partner
+REPLAN_SOLVE_BUDGET = float(os.environ.get("REPLAN_SOLVE_BUDGET", 0.05))  # Per re-sequencing
+REPLAN_CYCLE_BUDGET = float(os.environ.get("REPLAN_CYCLE_BUDGET", 0.5))  # Per coalesced batch
+
+def sequence_from_position(coords: np.ndarray, deadline: Optional[float] = None) -> List[int]:
+    """Order stops for a rider who is out on a trip.
+    
+    coords holds the rider's position first, the depot last and the remaining
+    stops in between. Returns the visiting order of the stops as indices into
+    coords, for an open path that starts at the position and ends at the depot.
+    """
+    n = len(coords)
+    if n <= 3:
+        return list(range(1, n - 1))
+    
+    diff = coords[:, None, :] - coords[None, :, :]
+    cost = np.sqrt((diff * diff).sum(axis=2))
+    depot = n - 1
+    
+    if n <= EXACT_TSP_MAX_NODES:
+        # Held-Karp closes the tour at index 0; only the depot may close it
+        cost[:, 0] = np.inf
+        cost[depot, 0] = 0.0
+        return held_karp(cost)[1][1:-2]
+    
+    # 2-opt needs symmetric costs, so pin the depot-position edge instead:
+    # no move that removes it can ever be improving
+    cost[0, depot] = cost[depot, 0] = -(cost.sum() + 1.0)
+    tour = nearest_neighbour_tour(cost)
+    tour = improve_tour(cost, tour, neighbour_lists(cost), deadline=deadline)
+    k = tour.index(0)
+    tour = tour[k:] + tour[:k]
+    if tour[1] == depot:
+        tour = [0] + tour[:0:-1]
+    return tour[1:-1]
+
+def validate_update(update) -> Optional[str]:
+    """Return an error message if a position update is malformed"""
+    if not isinstance(update, dict):
+        return "Update must be an object"
+    
+    partner_id = update.get("partnerId")
+    if isinstance(partner_id, bool) or not isinstance(partner_id, (str, int)):
+        return "partnerId must be a string or an integer"
+    
+    if "lat" in update or "lng" in update:
+        lat, lng = update.get("lat"), update.get("lng")
+        if any(isinstance(v, bool) or not isinstance(v, (int, float)) or not np.isfinite(v) for v in (lat, lng)):
+            return "lat and lng must both be numbers"
+    
+    if not isinstance(update.get("completed", []), list):
+        return "completed must be a list of location ids"
+    
+    return None
+
+class PartnerPlan:
+    """Remaining stops of one partner, as location ids grouped into depot trips"""
+    def __init__(self, partner_id, trips: List[List]):
+        self.partner_id = partner_id
+        self.trips = trips  # trips[0] is in progress; it may be empty on the way back to the depot
+        self.position: Optional[Tuple[float, float]] = None  # Last GPS fix; None until the first update
+        self.revision = 0  # Bumped whenever the remaining stops or their order change
+        self.dirty = False  # Position changed since the last re-sequencing
+        self.updated_at: Optional[float] = None
+        self.planned_at = 0.0
+    
+    def complete(self, loc_id) -> bool:
+        """Drop a visited stop; trips before its own are dropped as well.
+        
+        A partner serving a later trip has been back to the depot since the
+        earlier ones, so any stops left on them are no longer its to serve.
+        """
+        for t, trip in enumerate(self.trips):
+            if loc_id in trip:
+                trip.remove(loc_id)
+                del self.trips[:t]
+                return True
+        return False
+    
+    def path(self, depot_id) -> List:
+        """Remaining path: the current trip, then a depot visit after every trip"""
+        if not self.trips:
+            return []
+        path = list(self.trips[0])
+        for trip in self.trips[1:]:
+            path.append(depot_id)
+            path.extend(trip)
+        path.append(depot_id)
+        return path
+    
+    def to_dict(self, depot_id):
+        return {
+            "partnerId": self.partner_id,
+            "position": {"lat": self.position[0], "lng": self.position[1]} if self.position else None,
+            "remaining": self.path(depot_id),
+            "revision": self.revision,
+            "pending": self.dirty,
+            "updatedAt": self.updated_at,
+            "plannedAt": self.planned_at or None
+        }
+
+class Replanner:
+    """Keeps partners' remaining routes and re-sequences them from live positions.
+    
+    Position updates only record the fix and mark the partner dirty. A
+    background thread wakes every `interval` seconds and re-sequences the
+    dirty partners, oldest plan first, so a burst of updates costs one
+    solve per partner. A partner is re-planned at most every `min_interval`
+    seconds, and one batch stops after `cycle_budget` seconds; the partners
+    it did not reach stay dirty for the next one.
+    """
+    def __init__(self, interval: float = REPLAN_INTERVAL, min_interval: float = REPLAN_MIN_INTERVAL,
+                 solve_budget: float = REPLAN_SOLVE_BUDGET, cycle_budget: float = REPLAN_CYCLE_BUDGET):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.solve_budget = solve_budget
+        self.cycle_budget = cycle_budget
+        self._plans: Dict = {}
+        self._coords: Dict = {}  # Location id -> (lat, lng)
+        self._depot_id = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def load(self, locations: List[Dict], routes: List[Dict]) -> int:
+        """Start tracking routes in the optimize_routes response format"""
+        depots = [loc["id"] for loc in locations if loc.get("type") == "depot"]
+        if not depots:
+            raise ValueError("No depot found in locations")
+        coords = {loc["id"]: (float(loc["lat"]), float(loc["lng"])) for loc in locations}
+        
+        plans = {}
+        for route in routes:
+            unknown = [loc_id for loc_id in route["path"] if loc_id not in coords]
+            if unknown:
+                raise ValueError(f"Unknown locations in route of partner {route['partnerId']}: {unknown}")
+            plans[route["partnerId"]] = PartnerPlan(route["partnerId"], split_trips(route["path"], depots[0]))
+        
+        with self._lock:
+            self._depot_id = depots[0]
+            self._coords.update(coords)
+            self._plans.update(plans)
+        self.start()
+        return len(plans)
+    
+    def update_positions(self, updates: List[Dict]) -> Tuple[int, List, List[Dict]]:
+        """Record a batch of GPS fixes and visited stops.
+        
+        Every update is checked before any is applied, so a malformed one
+        cannot leave the batch half-recorded; it is skipped and reported.
+        Returns (accepted, unknown partner ids, invalid updates by index).
+        """
+        now = time.time()
+        accepted = 0
+        unknown = []
+        invalid = []
+        valid = []
+        for index, update in enumerate(updates):
+            error = validate_update(update)
+            if error:
+                invalid.append({"index": index, "error": error})
+            else:
+                valid.append(update)
+        
+        with self._lock:
+            for update in valid:
+                plan = self._plans.get(update.get("partnerId"))
+                if plan is None:
+                    unknown.append(update.get("partnerId"))
+                    continue
+                if "lat" in update and "lng" in update:
+                    plan.position = (float(update["lat"]), float(update["lng"]))
+                for loc_id in update.get("completed", ()):
+                    if plan.complete(loc_id):
+                        plan.revision += 1
+                plan.dirty = True
+                plan.updated_at = now
+                accepted += 1
+        return accepted, unknown, invalid
+    
+    def get(self, partner_id) -> Optional[Dict]:
+        with self._lock:
+            plan = self._plans.get(partner_id)
+            return plan.to_dict(self._depot_id) if plan else None
+    
+    def replan_pending(self) -> int:
+        """Re-sequence the partners that are due; returns how many were re-planned"""
+        cycle_deadline = time.perf_counter() + self.cycle_budget
+        now = time.time()
+        with self._lock:
+            due = [plan for plan in self._plans.values()
+                   if plan.dirty and now - plan.planned_at >= self.min_interval]
+            due.sort(key=lambda plan: plan.planned_at)
+            depot = self._coords.get(self._depot_id)
+        
+        replanned = 0
+        for plan in due:
+            if time.perf_counter() >= cycle_deadline:
+                break
+            
+            with self._lock:
+                position, stops, revision = plan.position, list(plan.trips[0]) if plan.trips else [], plan.revision
+                coords = np.array([position] + [self._coords[i] for i in stops] + [depot]) if position else None
+            
+            order = None
+            if coords is not None and len(stops) > 1:
+                deadline = min(time.perf_counter() + self.solve_budget, cycle_deadline)
+                order = [stops[k - 1] for k in sequence_from_position(coords, deadline)]
+            
+            with self._lock:
+                # Stops visited meanwhile make this order stale; try again next batch
+                if plan.revision != revision:
+                    continue
+                if order is not None and order != plan.trips[0]:
+                    plan.trips[0] = order
+                    plan.revision += 1
+                plan.dirty = False
+                plan.planned_at = time.time()
+            replanned += 1
+        return replanned
+    
+    def start(self):
+        """Start the background re-planning thread if it is not running"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="replanner", daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.replan_pending()
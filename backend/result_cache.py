@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# Cache limits, overridable from the environment
+CACHE_MAX_ENTRIES = int(os.environ.get("OPTIMIZER_CACHE_SIZE", 1024))
+CACHE_TTL = float(os.environ.get("OPTIMIZER_CACHE_TTL", 3600))
+CACHE_PATH = os.environ.get("OPTIMIZER_CACHE_PATH")  # Enables the on-disk tier
+
+# Fields that only label an object and never change the optimization
+IGNORED_FIELDS = ("name",)
+
+# Bumped whenever the canonical form changes, so results stored on disk under older keys are never hit
+KEY_VERSION = 2
+
+def _normalize(item: Dict) -> Dict:
+    """Drop label-only fields and round coordinates so equal inputs hash equally"""
+    normalized = {}
+    for key, value in item.items():
+        if key in IGNORED_FIELDS:
+            continue
+        if isinstance(value, float):
+            value = round(value, 7)
+        normalized[key] = value
+    return normalized
+
+def problem_key(locations: List[Dict], partners: List[Dict], algorithm: str, **options) -> str:
+    """Stable hash of a problem instance, independent of location order and names.
+    
+    Partners keep their order: solvers hand out routes by partner position,
+    so a reordered partner list can get a different plan.
+    """
+    canonical = {
+        "version": KEY_VERSION,
+        "algorithm": algorithm,
+        "locations": sorted((_normalize(loc) for loc in locations), key=lambda loc: str(loc.get("id"))),
+        "partners": [_normalize(p) for p in partners],
+        "options": options
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+class ResultCache:
+    """LRU + TTL cache of optimization results with an optional SQLite tier on disk.
+    
+    Cached results are shared between callers and must not be mutated.
+    """
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL,
+                 disk_path: Optional[str] = CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached result for a key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            
+            value = self._disk_get(key, now)
+            if value is None:
+                self.misses += 1
+                return None
+            
+            # Promote disk hits into memory
+            self._store(key, value[1], value[0])
+            self.hits += 1
+            return value[1]
+    
+    def put(self, key: str, value: Dict):
+        """Store a result in memory and, if enabled, on disk"""
+        now = time.time()
+        with self._lock:
+            self._store(key, value, now)
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO results (key, value, stored_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), now)
+                )
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM results")
+    
+    def stats(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "maxEntries": self.max_entries,
+            "disk": self.disk_path is not None
+        }
+    
+    def _store(self, key: str, value: Dict, stored_at: float):
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def _disk_get(self, key: str, now: float) -> Optional[tuple]:
+        if self._disk is None:
+            return None
+        row = self._disk.execute("SELECT value, stored_at FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > self.ttl:
+            self._disk.execute("DELETE FROM results WHERE key = ?", (key,))
+            return None
+        return row[1], json.loads(row[0])
@@ -0,0 +1,368 @@
+"""Road-network distances answered from a contraction hierarchy.
+
+A road graph is loaded from a local edge list: rows shaped like the
+coimbatore_roads table (start_lat, start_lng, end_lat, end_lng), or an
+OSM-like JSON export with "nodes" and "edges". Nodes are contracted once,
+cheapest first, adding shortcut edges so that every shortest path can be
+found by two upward-only searches. Many-to-many queries run one upward
+search per endpoint and meet in per-node buckets, so a distance matrix
+over n locations costs 2n small searches instead of n full Dijkstras.
+
+Precompute and save a hierarchy with:
+    python road_network.py roads.csv roads.npz
+"""
+import csv
+import heapq
+import json
+import os
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from spatial_index import GridIndex
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Edge list or saved hierarchy used for "distance": "road" requests
+ROAD_NETWORK_PATH = os.environ.get("ROAD_NETWORK_PATH")
+
+# Long straight road rows are split so locations can snap close to them
+MAX_SEGMENT_KM = 0.25
+
+# Settled-node limit of a witness search while contracting; a lower limit
+# contracts faster at the price of a few unnecessary shortcuts
+WITNESS_SETTLE_LIMIT = 64
+
+# Locations the roads do not connect are charged crow-flies distance times this
+UNREACHABLE_DETOUR = 2.0
+
+def haversine_km(lat1, lng1, lat2, lng2) -> np.ndarray:
+    """Great-circle distance in kilometres, broadcast over NumPy operands"""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def _csr(n: int, tails: List[int], heads: List[int], weights: List[float]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Adjacency arrays: edges of node u are heads[first[u]:first[u + 1]]"""
+    tails = np.asarray(tails, dtype=np.int64)
+    heads = np.asarray(heads, dtype=np.int64)
+    order = np.lexsort((heads, tails))
+    first = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tails, minlength=n), out=first[1:])
+    return first, heads[order], np.asarray(weights, dtype=np.float64)[order]
+
+def contract(n: int, edges: List[Tuple[int, int, float]],
+             settle_limit: int = WITNESS_SETTLE_LIMIT) -> Tuple[List[Tuple[int, int, float]], List[Tuple[int, int, float]]]:
+    """Contract every node of a directed graph.
+    
+    Returns the upward edges (u -> w, rank[w] > rank[u]) searched forward
+    from a source, and the reversed downward edges (v -> u for an edge
+    u -> v with rank[u] > rank[v]) searched backward from a target.
+    """
+    out: List[Dict[int, float]] = [{} for _ in range(n)]
+    inc: List[Dict[int, float]] = [{} for _ in range(n)]
+    for u, v, w in edges:
+        if u != v and w < out[u].get(v, np.inf):
+            out[u][v] = w
+            inc[v][u] = w
+    # Without one-way roads shortcuts are added both ways, keeping both
+    # search graphs identical so one set of searches serves both directions
+    symmetric = all(out[v] == inc[v] for v in range(n))
+    
+    def witness(source: int, skip: int, targets: Dict[int, float]) -> Dict[int, float]:
+        """Bounded Dijkstra from source that avoids `skip`"""
+        limit = max(targets.values())
+        dist = {source: 0.0}
+        settled = {}
+        heap = [(0.0, source)]
+        remaining = len(targets)
+        while heap and len(settled) < settle_limit:
+            d, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled[u] = d
+            if u in targets:
+                remaining -= 1
+                if remaining == 0:
+                    break
+            if d > limit:
+                break
+            for v, w in out[u].items():
+                nd = d + w
+                if v != skip and nd < dist.get(v, np.inf):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return settled
+    
+    def shortcuts(v: int) -> List[Tuple[int, int, float]]:
+        """Edges needed to keep shortest paths through v once it is removed"""
+        needed = []
+        for u, w_in in inc[v].items():
+            targets = {x: w_in + w_out for x, w_out in out[v].items() if x != u}
+            if not targets:
+                continue
+            found = witness(u, v, targets)
+            needed.extend((u, x, d) for x, d in targets.items() if found.get(x, np.inf) > d)
+        if symmetric:
+            needed.extend([(x, u, d) for u, x, d in needed])
+        return needed
+    
+    deleted = [0] * n
+    
+    def priority(v: int, needed: List) -> int:
+        # Edge difference plus a term that spreads contraction evenly
+        return len(needed) - len(inc[v]) - len(out[v]) + deleted[v]
+    
+    heap = [(priority(v, shortcuts(v)), v) for v in range(n)]
+    heapq.heapify(heap)
+    up, down = [], []
+    while heap:
+        _, v = heapq.heappop(heap)
+        needed = shortcuts(v)
+        current = priority(v, needed)
+        if heap and current > heap[0][0]:
+            # Lazy update: the node became more expensive since it was queued
+            heapq.heappush(heap, (current, v))
+            continue
+        
+        # Every neighbour still in the graph ranks higher than v
+        up.extend((v, x, w) for x, w in out[v].items())
+        down.extend((v, u, w) for u, w in inc[v].items())
+        for u, x, d in needed:
+            if d < out[u].get(x, np.inf):
+                out[u][x] = d
+                inc[x][u] = d
+        for x in out[v]:
+            del inc[x][v]
+            deleted[x] += 1
+        for u in inc[v]:
+            del out[u][v]
+            deleted[u] += 1
+        out[v] = {}
+        inc[v] = {}
+    return up, down
+
+class RoadNetwork:
+    """Contraction hierarchy over a road graph, answering distance matrices in km"""
+    units = "km"
+    
+    def __init__(self, lat: np.ndarray, lng: np.ndarray,
+                 up: Tuple[np.ndarray, np.ndarray, np.ndarray], down: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lng = np.asarray(lng, dtype=np.float64)
+        self.up = up
+        self.down = down
+        # Searches walk plain lists; indexing NumPy arrays per edge is slow
+        self._up = tuple(a.tolist() for a in up)
+        self._down = tuple(a.tolist() for a in down)
+        # Without one-way roads both search directions see the same graph
+        self.symmetric = all(np.array_equal(a, b) for a, b in zip(up, down))
+        self._index = None
+        self._scratch = threading.local()
+    
+    def __len__(self) -> int:
+        return len(self.lat)
+    
+    @classmethod
+    def from_graph(cls, lat: np.ndarray, lng: np.ndarray, edges: List[Tuple[int, int, float]]) -> "RoadNetwork":
+        """Build the hierarchy for directed (u, v, km) edges between nodes at lat/lng"""
+        n = len(lat)
+        up, down = contract(n, edges)
+        return cls(lat, lng, _csr(n, *zip(*up)) if up else _csr(n, [], [], []),
+                   _csr(n, *zip(*down)) if down else _csr(n, [], [], []))
+    
+    @classmethod
+    def from_edges(cls, rows: List[Dict], max_segment_km: float = MAX_SEGMENT_KM) -> "RoadNetwork":
+        """Build from coimbatore_roads-shaped rows; optional length_km and oneway columns"""
+        nodes: Dict[Tuple[float, float], int] = {}
+        lat, lng = [], []
+        
+        def node(a: float, b: float) -> int:
+            key = (round(a, 7), round(b, 7))
+            if key not in nodes:
+                nodes[key] = len(lat)
+                lat.append(key[0])
+                lng.append(key[1])
+            return nodes[key]
+        
+        edges = []
+        for row in rows:
+            start = (float(row["start_lat"]), float(row["start_lng"]))
+            end = (float(row["end_lat"]), float(row["end_lng"]))
+            length = float(row.get("length_km") or haversine_km(*start, *end))
+            oneway = str(row.get("oneway", "")).lower() in ("1", "true", "yes")
+            
+            # Interpolate nodes along long rows; the length is shared out evenly
+            pieces = max(1, int(np.ceil(length / max_segment_km)))
+            points = [node(start[0] + (end[0] - start[0]) * k / pieces, start[1] + (end[1] - start[1]) * k / pieces)
+                      for k in range(pieces + 1)]
+            for a, b in zip(points, points[1:]):
+                edges.append((a, b, length / pieces))
+                if not oneway:
+                    edges.append((b, a, length / pieces))
+        
+        return cls.from_graph(np.array(lat), np.array(lng), edges)
+    
+    @classmethod
+    def from_osm(cls, data: Dict) -> "RoadNetwork":
+        """Build from {"nodes": [{id, lat, lng}], "edges": [{from, to, length_km?, oneway?}]}"""
+        ids = {node["id"]: i for i, node in enumerate(data["nodes"])}
+        lat = np.array([float(node["lat"]) for node in data["nodes"]])
+        lng = np.array([float(node["lng"]) for node in data["nodes"]])
+        
+        edges = []
+        for edge in data["edges"]:
+            u, v = ids[edge["from"]], ids[edge["to"]]
+            length = float(edge.get("length_km") or haversine_km(lat[u], lng[u], lat[v], lng[v]))
+            edges.append((u, v, length))
+            if not edge.get("oneway"):
+                edges.append((v, u, length))
+        return cls.from_graph(lat, lng, edges)
+    
+    @classmethod
+    def load(cls, path: str) -> "RoadNetwork":
+        """Load a saved hierarchy (.npz), or build one from a .csv or .json edge list"""
+        if path.endswith(".npz"):
+            with np.load(path) as f:
+                return cls(f["lat"], f["lng"], (f["up_first"], f["up_to"], f["up_km"]),
+                           (f["down_first"], f["down_to"], f["down_km"]))
+        if path.endswith(".csv"):
+            with open(path, newline="") as f:
+                return cls.from_edges(list(csv.DictReader(f)))
+        with open(path) as f:
+            data = json.load(f)
+        return cls.from_osm(data) if isinstance(data, dict) else cls.from_edges(data)
+    
+    def save(self, path: str):
+        np.savez(path, lat=self.lat, lng=self.lng,
+                 up_first=self.up[0], up_to=self.up[1], up_km=self.up[2],
+                 down_first=self.down[0], down_to=self.down[1], down_km=self.down[2])
+    
+    def _search(self, start: int, graph: Tuple[List[int], List[int], List[float]],
+                stall: Tuple[List[int], List[int], List[float]]) -> Dict[int, float]:
+        """Upward Dijkstra from start; nodes reached suboptimally are stalled, not expanded"""
+        first, heads, km = graph
+        stall_first, stall_heads, stall_km = stall
+        
+        # Tentative distances live in a per-thread list that is reset after each search
+        dist = getattr(self._scratch, "dist", None)
+        if dist is None:
+            dist = self._scratch.dist = [np.inf] * len(self.lat)
+        touched = [start]
+        dist[start] = 0.0
+        settled = {}
+        heap = [(0.0, start)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            # Stall-on-demand: a higher node already offers a shorter way here
+            stalled = False
+            for k in range(stall_first[u], stall_first[u + 1]):
+                if dist[stall_heads[k]] + stall_km[k] < d:
+                    stalled = True
+                    break
+            settled[u] = -1.0 if stalled else d
+            if stalled:
+                continue
+            for k in range(first[u], first[u + 1]):
+                v = heads[k]
+                nd = d + km[k]
+                if nd < dist[v]:
+                    if dist[v] == np.inf:
+                        touched.append(v)
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        
+        for u in touched:
+            dist[u] = np.inf
+        return {u: d for u, d in settled.items() if d >= 0}
+    
+    def distances(self, sources: List[int], targets: List[int]) -> np.ndarray:
+        """Shortest road distances in km between graph nodes; inf where unreachable"""
+        result = np.full((len(sources), len(targets)), np.inf)
+        
+        def spaces(nodes, graph, stall):
+            owner, meeting, km = [], [], []
+            for i, node in enumerate(nodes):
+                space = self._search(node, graph, stall)
+                owner.extend([i] * len(space))
+                meeting.extend(space.keys())
+                km.extend(space.values())
+            meeting = np.asarray(meeting, dtype=np.int64)
+            order = np.argsort(meeting, kind="stable")
+            return np.asarray(owner, dtype=np.int64)[order], meeting[order], np.asarray(km)[order]
+        
+        forward = spaces(sources, self._up, self._down)
+        if self.symmetric and list(sources) == list(targets):
+            backward = forward
+        else:
+            backward = spaces(targets, self._down, self._up)
+        
+        # Buckets: for each meeting node, join every source and target that reached it
+        f_nodes, f_start = np.unique(forward[1], return_index=True)
+        b_nodes, b_start = np.unique(backward[1], return_index=True)
+        f_end = np.append(f_start[1:], len(forward[1]))
+        b_end = np.append(b_start[1:], len(backward[1]))
+        common, fi, bi = np.intersect1d(f_nodes, b_nodes, assume_unique=True, return_indices=True)
+        for a, b in zip(fi.tolist(), bi.tolist()):
+            rows = forward[0][f_start[a]:f_end[a]]
+            cols = backward[0][b_start[b]:b_end[b]]
+            block = np.ix_(rows, cols)
+            result[block] = np.minimum(result[block], forward[2][f_start[a]:f_end[a], None] + backward[2][b_start[b]:b_end[b]])
+        return result
+    
+    def snap(self, lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+        """Nearest graph node of every point"""
+        if self._index is None:
+            self._index = GridIndex(self.lat, self.lng)
+        return np.array([int(self._index.knn(a, b, 1)[0]) for a, b in zip(lat.tolist(), lng.tolist())],
+                        dtype=np.int64)
+    
+    def matrix(self, lat: np.ndarray, lng: np.ndarray,
+               to_lat: Optional[np.ndarray] = None, to_lng: Optional[np.ndarray] = None) -> np.ndarray:
+        """Road distances in km from each point to each target point, via their nearest graph nodes.
+        
+        The targets default to the points themselves.
+        """
+        if to_lat is None:
+            to_lat, to_lng = lat, lng
+        nodes = self.snap(lat, lng)
+        to_nodes = nodes if to_lat is lat else self.snap(to_lat, to_lng)
+        access = haversine_km(lat, lng, self.lat[nodes], self.lng[nodes])
+        to_access = haversine_km(to_lat, to_lng, self.lat[to_nodes], self.lng[to_nodes])
+        
+        sources, inverse = np.unique(nodes, return_inverse=True)
+        targets, to_inverse = np.unique(to_nodes, return_inverse=True)
+        between = self.distances(sources.tolist(), targets.tolist())[np.ix_(inverse, to_inverse)]
+        
+        crow_flies = haversine_km(lat[:, None], lng[:, None], to_lat[None, :], to_lng[None, :])
+        matrix = access[:, None] + between + to_access[None, :]
+        # Points sharing a node, or never reaching each other, use the direct line
+        same = nodes[:, None] == to_nodes[None, :]
+        matrix[same] = crow_flies[same]
+        unreachable = ~np.isfinite(matrix)
+        matrix[unreachable] = crow_flies[unreachable] * UNREACHABLE_DETOUR
+        return matrix
+
+_default_network: Optional[RoadNetwork] = None
+_default_lock = threading.Lock()
+
+def default_network() -> RoadNetwork:
+    """The network at ROAD_NETWORK_PATH, loaded once per process"""
+    global _default_network
+    with _default_lock:
+        if _default_network is None:
+            if not ROAD_NETWORK_PATH:
+                raise ValueError("Road distances need ROAD_NETWORK_PATH to point at a road network")
+            _default_network = RoadNetwork.load(ROAD_NETWORK_PATH)
+        return _default_network
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("usage: python road_network.py EDGES.csv|EDGES.json HIERARCHY.npz")
+    network = RoadNetwork.load(sys.argv[1])
+    network.save(sys.argv[2])
+    print(f"Saved hierarchy of {len(network)} nodes to {sys.argv[2]}")
@@ -1,16 +1,141 @@
 import numpy as np
 import heapq
-from typing import List, Dict, Tuple, Any, Optional
+import threading
+import time
+from collections import deque
+from typing import List, Dict, Tuple, Any, Callable, Optional
 import json
 
+from anytime import anytime, best_routes, expired, report, reporting
+from distance_store import StoredDistance, default_store
+from metrics import count, phase, profiling
+from parallel import parallel_workers, sequence_clusters
+from partition import partition
+from road_network import default_network
+from spatial_index import GridIndex
+
 # Data structures
+# Location type codes; any other type seen in a request gets the next free code
+LOCATION_TYPES = ("delivery", "depot")
+DELIVERY, DEPOT = 0, 1
+
+# Average travel speed per vehicle type; other vehicles travel at DEFAULT_SPEED_KMH
+VEHICLE_SPEEDS_KMH = {"Bike": 20.0, "Car": 30.0}
+DEFAULT_SPEED_KMH = VEHICLE_SPEEDS_KMH["Car"]
+
+class ProblemInstance:
+    """Array-backed optimization problem.
+    
+    Locations and partners are stored column-wise in contiguous arrays and
+    addressed by dense index; ``index`` and ``partner_index`` map the
+    caller's IDs to those indices. Solvers work on indices only and IDs are
+    restored when routes are built.
+    """
+    def __init__(self, locations_data: List[Dict], partners_data: List[Dict]):
+        n = len(locations_data)
+        self.location_ids = [loc["id"] for loc in locations_data]
+        self.index = {loc_id: i for i, loc_id in enumerate(self.location_ids)}
+        self.names = [loc["name"] for loc in locations_data]
+        self.lat = np.fromiter((loc["lat"] for loc in locations_data), dtype=np.float64, count=n)
+        self.lng = np.fromiter((loc["lng"] for loc in locations_data), dtype=np.float64, count=n)
+        self.demand = np.fromiter((loc.get("demand", 1) for loc in locations_data), dtype=np.float64, count=n)
+        
+        # Time windows and service durations in minutes; without a window a location is always open
+        self.ready_time = np.fromiter((loc.get("readyTime", 0) for loc in locations_data), dtype=np.float64, count=n)
+        self.due_time = np.fromiter((loc.get("dueTime", np.inf) for loc in locations_data), dtype=np.float64, count=n)
+        self.service_time = np.fromiter((loc.get("serviceTime", 0) for loc in locations_data), dtype=np.float64, count=n)
+        closed = np.flatnonzero(self.due_time < self.ready_time)
+        if len(closed):
+            raise ValueError(f"Locations {[self.location_ids[i] for i in closed]} are due before they are ready")
+        
+        # Location types are stored as small integer codes
+        self.type_names = list(LOCATION_TYPES)
+        codes = {name: code for code, name in enumerate(self.type_names)}
+        self.type_code = np.empty(n, dtype=np.int8)
+        for i, loc in enumerate(locations_data):
+            location_type = loc.get("type", "delivery")
+            if location_type not in codes:
+                codes[location_type] = len(self.type_names)
+                self.type_names.append(location_type)
+            self.type_code[i] = codes[location_type]
+        
+        depots = np.flatnonzero(self.type_code == DEPOT)
+        self.depot_index = int(depots[0]) if len(depots) else None
+        
+        m = len(partners_data)
+        self.partner_ids = [p["id"] for p in partners_data]
+        self.partner_index = {partner_id: p for p, partner_id in enumerate(self.partner_ids)}
+        self.partner_names = [p["name"] for p in partners_data]
+        self.vehicles = [p.get("vehicle", "Car") for p in partners_data]
+        self.speed = np.fromiter((VEHICLE_SPEEDS_KMH.get(v, DEFAULT_SPEED_KMH) for v in self.vehicles),
+                                 dtype=np.float64, count=m)
+        self.capacity = np.fromiter((p.get("capacity", 100) for p in partners_data), dtype=np.float64, count=m)
+    
+    def __len__(self) -> int:
+        return len(self.location_ids)
+    
+    @property
+    def num_partners(self) -> int:
+        return len(self.partner_ids)
+    
+    def deliveries(self) -> List[int]:
+        """Indices of the delivery locations"""
+        return np.flatnonzero(self.type_code == DELIVERY).tolist()
+    
+    def location(self, i: int) -> "Location":
+        return Location(self, i)
+    
+    def partner(self, p: int) -> "DeliveryPartner":
+        return DeliveryPartner(self, p)
+    
+    def route(self, p: int, path: List[int], distance: float) -> "Route":
+        """Build a Route for partner index p from a path of location indices"""
+        ids = self.location_ids
+        return Route(self.partner_ids[p], [ids[i] for i in path], distance)
+
 class Location:
-    def __init__(self, id: int, name: str, lat: float, lng: float, location_type: str = "delivery"):
-        self.id = id
-        self.name = name
-        self.lat = lat
-        self.lng = lng
-        self.type = location_type  # "depot" or "delivery"
+    """A row of a ProblemInstance, read through to its arrays"""
+    __slots__ = ("problem", "index")
+    
+    def __init__(self, problem: ProblemInstance, index: int):
+        self.problem = problem
+        self.index = index
+    
+    @property
+    def id(self):
+        return self.problem.location_ids[self.index]
+    
+    @property
+    def name(self) -> str:
+        return self.problem.names[self.index]
+    
+    @property
+    def lat(self) -> float:
+        return float(self.problem.lat[self.index])
+    
+    @property
+    def lng(self) -> float:
+        return float(self.problem.lng[self.index])
+    
+    @property
+    def type(self) -> str:
+        return self.problem.type_names[self.problem.type_code[self.index]]  # "depot" or "delivery"
+    
+    @property
+    def demand(self) -> float:
+        return float(self.problem.demand[self.index])  # Load units picked up by the partner at this stop
+    
+    @property
+    def ready_time(self) -> float:
+        return float(self.problem.ready_time[self.index])  # Earliest service start, in minutes
+    
+    @property
+    def due_time(self) -> float:
+        return float(self.problem.due_time[self.index])  # Latest service start; inf without a window
+    
+    @property
+    def service_time(self) -> float:
+        return float(self.problem.service_time[self.index])
     
     def to_dict(self):
         return {
@@ -18,15 +143,40 @@ class Location:
             "name": self.name,
             "lat": self.lat,
             "lng": self.lng,
-            "type": self.type
+            "type": self.type,
+            "demand": self.demand,
+            "readyTime": self.ready_time,
+            "dueTime": self.due_time if np.isfinite(self.due_time) else None,
+            "serviceTime": self.service_time
         }
 
 class DeliveryPartner:
-    def __init__(self, id: int, name: str, vehicle: str, capacity: int):
-        self.id = id
-        self.name = name
-        self.vehicle = vehicle
-        self.capacity = capacity
+    """A partner of a ProblemInstance, read through to its arrays"""
+    __slots__ = ("problem", "index")
+    
+    def __init__(self, problem: ProblemInstance, index: int):
+        self.problem = problem
+        self.index = index
+    
+    @property
+    def id(self):
+        return self.problem.partner_ids[self.index]
+    
+    @property
+    def name(self) -> str:
+        return self.problem.partner_names[self.index]
+    
+    @property
+    def vehicle(self) -> str:
+        return self.problem.vehicles[self.index]
+    
+    @property
+    def capacity(self) -> float:
+        return float(self.problem.capacity[self.index])
+    
+    @property
+    def speed(self) -> float:
+        return float(self.problem.speed[self.index])  # km/h, from the vehicle type
     
     def to_dict(self):
         return {
@@ -37,6 +187,8 @@ class DeliveryPartner:
         }
 
 class Route:
+    __slots__ = ("partner_id", "path", "distance")
+    
     def __init__(self, partner_id: int, path: List[int], distance: float = 0):
         self.partner_id = partner_id
         self.path = path  # List of location IDs
@@ -49,23 +201,117 @@ class Route:
             "distance": self.distance
         }
 
+class ScheduledRoute(Route):
+    """A route with the service start time, in minutes, of every visit on its path"""
+    __slots__ = ("start_times",)
+    
+    def __init__(self, partner_id: int, path: List[int], distance: float, start_times: List[float]):
+        super().__init__(partner_id, path, distance)
+        self.start_times = start_times
+    
+    def to_dict(self):
+        result = super().to_dict()
+        result["startTimes"] = self.start_times
+        return result
+
+EUCLIDEAN_BLOCK_ROWS = 256  # Rows of a Euclidean matrix computed at a time
+
+class EuclideanDistance:
+    """Straight-line distance in raw lat/lng degrees, the default metric"""
+    units = "degrees"
+    symmetric = True
+    
+    def matrix(self, lat: np.ndarray, lng: np.ndarray,
+               to_lat: Optional[np.ndarray] = None, to_lng: Optional[np.ndarray] = None) -> np.ndarray:
+        if to_lat is None:
+            to_lat, to_lng = lat, lng
+        # Filled in place a block of rows at a time, so the temporaries stay small next to the result
+        out = np.empty((len(lat), len(to_lat)))
+        for start in range(0, len(lat), EUCLIDEAN_BLOCK_ROWS):
+            rows = slice(start, start + EUCLIDEAN_BLOCK_ROWS)
+            block = out[rows]
+            np.subtract(lat[rows, None], to_lat[None, :], out=block)
+            block *= block
+            d_lng = lng[rows, None] - to_lng[None, :]
+            d_lng *= d_lng
+            block += d_lng
+            np.sqrt(block, out=block)
+        return out
+    
+    def pairwise(self, lat: np.ndarray, lng: np.ndarray, to_lat: np.ndarray, to_lng: np.ndarray) -> np.ndarray:
+        """Distance from each point to the target point at the same position"""
+        d_lat = lat - to_lat
+        d_lng = lng - to_lng
+        return np.sqrt(d_lat * d_lat + d_lng * d_lng)
+
+class DistanceMatrix:
+    """Pairwise distances between all locations of a problem, addressed by index.
+    
+    Built once per optimization by a distance provider: any object with a
+    ``units`` name, a ``symmetric`` flag and a ``matrix(lat, lng, to_lat=None,
+    to_lng=None)`` method, such as a RoadNetwork. A provider may also offer
+    ``pairwise(lat, lng, to_lat, to_lng)`` for point-by-point distances, which
+    plan evaluation uses instead of a matrix.
+    The default is Euclidean distance, built with NumPy broadcasting over the
+    problem's contiguous lat/lng arrays.
+    """
+    def __init__(self, problem: ProblemInstance, provider=None):
+        self.lat = problem.lat
+        self.lng = problem.lng
+        
+        provider = provider or EuclideanDistance()
+        self.units = provider.units
+        self.symmetric = provider.symmetric
+        self.matrix = provider.matrix(self.lat, self.lng)
+    
+    @classmethod
+    def from_coordinates(cls, lat: np.ndarray, lng: np.ndarray, provider=None) -> "DistanceMatrix":
+        """Distances between bare coordinates, for callers without a ProblemInstance"""
+        dist = cls.__new__(cls)
+        dist.lat = lat
+        dist.lng = lng
+        
+        provider = provider or EuclideanDistance()
+        dist.units = provider.units
+        dist.symmetric = provider.symmetric
+        dist.matrix = provider.matrix(lat, lng)
+        return dist
+    
+    def __len__(self) -> int:
+        return len(self.lat)
+    
+    def submatrix(self, indices: List[int]) -> np.ndarray:
+        """Distance matrix restricted to the given locations, in the given order"""
+        idx = np.asarray(indices, dtype=np.intp)
+        if len(idx) == len(self.matrix) and np.array_equal(idx, np.arange(len(idx))):
+            # Every location in order: a read-only view rather than a copy of the whole matrix
+            view = self.matrix.view()
+            view.flags.writeable = False
+            return view
+        return self.matrix[np.ix_(idx, idx)]
+    
+    def route_distance(self, path: List[int]) -> float:
+        """Total distance of a path of location indices"""
+        if len(path) < 2:
+            return 0
+        idx = np.asarray(path, dtype=np.intp)
+        return float(self.matrix[idx[:-1], idx[1:]].sum())
+
 # Utility functions
 def calculate_distance(loc1: Location, loc2: Location) -> float:
     """Calculate Euclidean distance between two locations"""
     return np.sqrt((loc1.lat - loc2.lat)**2 + (loc1.lng - loc2.lng)**2)
 
-def calculate_route_distance(locations: Dict[int, Location], path: List[int]) -> float:
-    """Calculate the total distance of a route"""
-    if len(path) < 2:
-        return 0
-    
-    total_distance = 0
-    for i in range(len(path) - 1):
-        loc1 = locations[path[i]]
-        loc2 = locations[path[i + 1]]
-        total_distance += calculate_distance(loc1, loc2)
-    
-    return total_distance
+def calculate_route_distance(dist: DistanceMatrix, path: List[int]) -> float:
+    """Calculate the total distance of a route given as location indices"""
+    with phase("route_cost"):
+        return dist.route_distance(path)
+
+def find_depot(problem: ProblemInstance) -> int:
+    """Index of the depot (the first location of type "depot")"""
+    if problem.depot_index is None:
+        raise ValueError("No depot found in locations")
+    return problem.depot_index
 
 # 1. Divide and Conquer - Merge Sort
 def merge_sort(arr: List[Any], key=lambda x: x) -> List[Any]:
@@ -98,44 +344,56 @@ def merge(left: List[Any], right: List[Any], key=lambda x: x) -> List[Any]:
     result.extend(right[j:])
     return result
 
-def optimize_route_divide_conquer(locations: Dict[int, Location], partners: List[DeliveryPartner]) -> List[Route]:
+def partition_deliveries(problem: ProblemInstance, depot: int) -> List[Tuple[int, List[int]]]:
+    """(partner, deliveries) for every partner given a non-empty geographic cluster of the deliveries.
+    
+    Clusters come from a polar sweep around the depot refined by capacity-
+    balanced k-means, each holding about its partner's share of the demand.
+    """
+    deliveries = np.asarray(problem.deliveries(), dtype=np.intp)
+    with phase("partition"):
+        labels = partition(problem.lat[deliveries], problem.lng[deliveries], problem.lat[depot], problem.lng[depot],
+                           problem.demand[deliveries], problem.capacity)
+    
+    order = np.argsort(labels, kind="stable")
+    bounds = np.searchsorted(labels[order], np.arange(problem.num_partners + 1))
+    clusters = []
+    for p in range(problem.num_partners):
+        members = deliveries[order[bounds[p]:bounds[p + 1]]]
+        if len(members):
+            clusters.append((p, members.tolist()))
+    return clusters
+
+def optimize_route_divide_conquer(problem: ProblemInstance, dist: Optional[DistanceMatrix] = None) -> List[Route]:
     """Optimize routes using divide and conquer approach"""
     # Find depot
-    depot = next((loc for loc in locations.values() if loc.type == "depot"), None)
-    if not depot:
-        raise ValueError("No depot found in locations")
-    
-    # Sort delivery locations by distance from depot
-    delivery_locations = [loc for loc in locations.values() if loc.type == "delivery"]
+    depot = find_depot(problem)
     
-    sorted_locations = merge_sort(
-        delivery_locations,
-        key=lambda loc: calculate_distance(depot, loc)
-    )
+    if dist is None:
+        dist = DistanceMatrix(problem)
     
-    # Divide locations among partners
+    # Divide locations among partners by geography
     routes = []
-    if not partners:
+    if not problem.num_partners:
         return routes
     
-    locations_per_partner = len(sorted_locations) // len(partners)
-    remainder = len(sorted_locations) % len(partners)
-    
-    start_idx = 0
-    for i, partner in enumerate(partners):
-        # Distribute remainder locations
-        count = locations_per_partner + (1 if i < remainder else 0)
-        if count == 0:
-            continue
-            
-        partner_locations = sorted_locations[start_idx:start_idx + count]
-        start_idx += count
+    for p, partner_locations in partition_deliveries(problem, depot):
+        # Conquer: merge sort the cluster by angle around its centre, a loop through it
+        centre_lat = problem.lat[partner_locations].mean()
+        centre_lng = problem.lng[partner_locations].mean()
+        angle = dict(zip(partner_locations, np.arctan2(problem.lat[partner_locations] - centre_lat,
+                                                       problem.lng[partner_locations] - centre_lng).tolist()))
+        loop = np.asarray(merge_sort(partner_locations, key=lambda i: angle[i]), dtype=np.intp)
+        
+        # Open the loop where the detour through the depot costs least
+        previous = np.roll(loop, 1)
+        k = int(np.argmin(dist.matrix[depot, loop] + dist.matrix[previous, depot] - dist.matrix[previous, loop]))
         
         # Create route: depot -> locations -> depot
-        path = [depot.id] + [loc.id for loc in partner_locations] + [depot.id]
-        distance = calculate_route_distance(locations, path)
+        path = [depot] + np.roll(loop, -k).tolist() + [depot]
+        distance = calculate_route_distance(dist, path)
         
-        routes.append(Route(partner.id, path, distance))
+        routes.append(problem.route(p, path, distance))
     
     return routes
 
@@ -164,390 +422,1389 @@ class DisjointSet:
             if self.rank[root_x] == self.rank[root_y]:
                 self.rank[root_x] += 1
 
-def kruskal_mst(locations: Dict[int, Location]) -> List[Tuple[int, int]]:
+# Nearest neighbours per location offered to Kruskal as candidate edges
+MST_CANDIDATE_NEIGHBOURS = 10
+
+def kruskal_mst(dist: DistanceMatrix) -> List[Tuple[int, int]]:
     """Find Minimum Spanning Tree using Kruskal's algorithm"""
-    # Create list of all edges with weights
-    edges = []
-    location_ids = list(locations.keys())
+    n = len(dist)
+    if n < 2:
+        return []
     
-    for i in range(len(location_ids)):
-        for j in range(i + 1, len(location_ids)):
-            loc1 = locations[location_ids[i]]
-            loc2 = locations[location_ids[j]]
-            weight = calculate_distance(loc1, loc2)
-            edges.append((weight, i, j))
+    # Sparse candidate edges: the k-nearest-neighbour graph from a spatial index
+    index = GridIndex(dist.lat, dist.lng)
+    rows, cols = index.candidate_edges(MST_CANDIDATE_NEIGHBOURS)
+    weights = dist.matrix[rows, cols]
     
     # Sort edges by weight
-    edges.sort()
+    order = np.argsort(weights, kind="stable")
     
     # Apply Kruskal's algorithm
-    n = len(location_ids)
     disjoint_set = DisjointSet(n)
     mst = []
     
-    for weight, u, v in edges:
+    examined = 0
+    for u, v in zip(rows[order].tolist(), cols[order].tolist()):
+        examined += 1
         if disjoint_set.find(u) != disjoint_set.find(v):
             disjoint_set.union(u, v)
-            mst.append((location_ids[u], location_ids[v]))
+            mst.append((u, v))
+            if len(mst) == n - 1:
+                break
+    count("mst_candidate_edges", len(rows))
+    count("mst_edges_considered", examined)
+    
+    # Far-apart clusters can leave the candidate graph disconnected; join every
+    # component but the largest through its shortest outgoing edge (Boruvka step)
+    while len(mst) < n - 1:
+        roots = np.array([disjoint_set.find(i) for i in range(n)])
+        labels, sizes = np.unique(roots, return_counts=True)
+        for label in labels[np.argsort(sizes, kind="stable")[:-1]]:
+            inside = np.flatnonzero(roots == label)
+            outside = np.flatnonzero(roots != label)
+            block = dist.matrix[np.ix_(inside, outside)]
+            i, j = np.unravel_index(block.argmin(), block.shape)
+            u, v = int(inside[i]), int(outside[j])
+            if disjoint_set.find(u) != disjoint_set.find(v):
+                disjoint_set.union(u, v)
+                mst.append((u, v))
     
     return mst
 
-def optimize_route_greedy(locations: Dict[int, Location], partners: List[DeliveryPartner]) -> List[Route]:
-    """Optimize routes using greedy approach (Kruskal's algorithm)"""
-    # Find depot
-    depot = next((loc for loc in locations.values() if loc.type == "depot"), None)
-    if not depot:
-        raise ValueError("No depot found in locations")
-    
-    # Find MST
-    mst = kruskal_mst(locations)
-    
-    # Convert MST to adjacency list
-    adj_list = {loc_id: [] for loc_id in locations}
+def rooted_tree(dist: DistanceMatrix, mst: List[Tuple[int, int]], root: int) -> Tuple[List[int], List[List[int]]]:
+    """Preorder of the MST from the root, and every node's children, nearest first"""
+    n = len(dist)
+    adj_list = [[] for _ in range(n)]
     for u, v in mst:
         adj_list[u].append(v)
         adj_list[v].append(u)
     
-    # Create routes using DFS on MST
+    children = [[] for _ in range(n)]
+    order = []
+    seen = [False] * n
+    seen[root] = True
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        row = dist.matrix[node]
+        kids = sorted((c for c in adj_list[node] if not seen[c]), key=row.item)
+        for c in kids:
+            seen[c] = True
+        children[node] = kids
+        stack.extend(reversed(kids))
+    return order, children
+
+def partition_tree(order: List[int], children: List[List[int]], demand: List[float], limit: float) -> List[bool]:
+    """Cut a rooted tree into parts whose demand stays within limit, as few as possible.
+    
+    Bottom up, a node whose remaining subtree is over the limit cuts off its
+    heaviest remaining child subtrees until it fits (Kundu and Misra). Returns
+    for every node whether it roots a part of its own; the tree's root does.
+    """
+    residual = list(demand)
+    cut = [False] * len(demand)
+    for v in reversed(order):
+        total = demand[v] + sum(residual[c] for c in children[v])
+        if total > limit:
+            for c in sorted(children[v], key=residual.__getitem__, reverse=True):
+                cut[c] = True
+                total -= residual[c]
+                if total <= limit:
+                    break
+            children[v] = [c for c in children[v] if not cut[c]]
+        residual[v] = total
+    cut[order[0]] = True
+    return cut
+
+def reload_at_depot(depot: int, trip: List[int], demand, limit: float) -> List[int]:
+    """Visit a trip's stops in order, back to the depot in between whenever the next would exceed limit.
+    
+    Lets a smaller partner carry a trip cut for the largest one. The returned
+    stops end with the depot.
+    """
+    path = []
+    carried = 0.0
+    for node in trip:
+        if carried and carried + demand[node] > limit:
+            path.append(depot)
+            carried = 0.0
+        path.append(node)
+        carried += demand[node]
+    path.append(depot)
+    return path
+
+def optimize_route_greedy(problem: ProblemInstance, dist: Optional[DistanceMatrix] = None) -> List[Route]:
+    """Optimize routes using greedy approach (Kruskal's algorithm).
+    
+    The MST, rooted at the depot, is cut into subtrees that each fit the
+    largest partner's capacity. Each subtree is one trip, toured as a
+    shortcut preorder (the doubled-tree tour without repeat visits). Trips go,
+    heaviest first, to the partner they leave least loaded for its capacity.
+    Apart from sorting children and cuts, every step is linear in the stops.
+    """
+    # Find depot
+    depot = find_depot(problem)
+    
+    if dist is None:
+        dist = DistanceMatrix(problem)
+    
     routes = []
-    if not partners:
+    if not problem.num_partners:
         return routes
     
-    # Divide the MST into connected components for each partner
-    visited = set()
-    
-    for partner in partners:
-        if len(visited) == len(locations):
-            break
-        
-        # Find starting point (prefer depot if not visited)
-        start = depot.id if depot.id not in visited else next((loc_id for loc_id in locations if loc_id not in visited), None)
-        if start is None:
+    # Find MST
+    mst = kruskal_mst(dist)
+    order, children = rooted_tree(dist, mst, depot)
+    
+    # Divide the MST into subtrees within the largest capacity, one trip each
+    demand = problem.demand.tolist()
+    demand[depot] = 0.0
+    capacity = problem.capacity
+    cut = partition_tree(order, children, demand, float(capacity.max()))
+    
+    trips = []
+    for root in order:
+        if not cut[root]:
             continue
-        
-        # DFS to find path
-        path = []
-        stack = [start]
-        local_visited = set()
-        
+        # Shortcut preorder of the subtree, skipping the parts cut below it
+        trip = []
+        stack = [root]
         while stack:
             node = stack.pop()
-            if node in local_visited:
-                continue
-                
-            path.append(node)
-            local_visited.add(node)
-            visited.add(node)
-            
-            # Add neighbors to stack
-            for neighbor in adj_list[node]:
-                if neighbor not in local_visited:
-                    stack.append(neighbor)
-        
-        # Ensure path starts and ends at depot
-        if path[0] != depot.id:
-            path = [depot.id] + path
-        if path[-1] != depot.id:
-            path.append(depot.id)
-        
-        distance = calculate_route_distance(locations, path)
-        routes.append(Route(partner.id, path, distance))
+            if node != depot:
+                trip.append(node)
+            stack.extend(reversed(children[node]))
+        if trip:
+            trips.append((sum(demand[i] for i in trip), trip))
+    
+    # Heaviest trips first, each to the partner left with the lowest load / capacity
+    load = np.zeros(problem.num_partners)
+    share = np.where(capacity > 0, capacity, np.inf)
+    assigned = [[] for _ in range(problem.num_partners)]
+    for k in sorted(range(len(trips)), key=lambda k: -trips[k][0]):
+        weight = trips[k][0]
+        p = int(((load + weight) / share).argmin())
+        load[p] += weight
+        assigned[p].append(k)
+    
+    for p in range(problem.num_partners):
+        if not assigned[p]:
+            continue
+        path = [depot]
+        for k in sorted(assigned[p]):
+            path.extend(reload_at_depot(depot, trips[k][1], demand, float(capacity[p])))
+        distance = calculate_route_distance(dist, path)
+        routes.append(problem.route(p, path, distance))
     
     return routes
 
 # 3. Dynamic Programming - Traveling Salesperson Problem
-def solve_tsp_dp(locations: Dict[int, Location], start_id: int) -> List[int]:
-    """Solve TSP using dynamic programming"""
-    n = len(locations)
-    location_ids = list(locations.keys())
-    
-    # Create distance matrix
-    dist = np.zeros((n, n))
-    for i in range(n):
-        for j in range(n):
-            if i != j:
-                loc1 = locations[location_ids[i]]
-                loc2 = locations[location_ids[j]]
-                dist[i][j] = calculate_distance(loc1, loc2)
-    
-    # Map location IDs to indices
-    id_to_idx = {loc_id: i for i, loc_id in enumerate(location_ids)}
-    idx_to_id = {i: loc_id for i, loc_id in enumerate(location_ids)}
-    
-    start_idx = id_to_idx[start_id]
-    
-    # Initialize DP table
-    # dp[mask][i] = min cost to visit all vertices in mask and end at vertex i
-    dp = {}
-    parent = {}
-    
-    # Base case: start at vertex start_idx
-    for i in range(n):
-        if i != start_idx:
-            dp[(1 << start_idx) | (1 << i), i] = dist[start_idx][i]
-            parent[(1 << start_idx) | (1 << i), i] = start_idx
-    
-    # Fill DP table
-    for mask_size in range(3, n + 1):
-        for mask in range(1 << n):
-            if bin(mask).count('1') != mask_size:
-                continue
-                
-            # Make sure start_idx is in the mask
-            if not (mask & (1 << start_idx)):
-                continue
-                
-            for i in range(n):
-                if not (mask & (1 << i)) or i == start_idx:
-                    continue
-                    
-                # Previous mask without vertex i
-                prev_mask = mask ^ (1 << i)
-                
-                for j in range(n):
-                    if not (prev_mask & (1 << j)) or j == i or j == start_idx:
-                        continue
-                        
-                    # Check if we can get a better path to i by going through j
-                    if (prev_mask, j) in dp:
-                        cost = dp[(prev_mask, j)] + dist[j][i]
-                        if (mask, i) not in dp or cost < dp[(mask, i)]:
-                            dp[(mask, i)] = cost
-                            parent[(mask, i)] = j
-    
-    # Find the optimal ending vertex
-    end_mask = (1 << n) - 1
-    min_cost = float('inf')
-    end_vertex = -1
-    
-    for i in range(n):
-        if i != start_idx and (end_mask, i) in dp:
-            cost = dp[(end_mask, i)] + dist[i][start_idx]
-            if cost < min_cost:
-                min_cost = cost
-                end_vertex = i
-    
-    if end_vertex == -1:
-        return [start_id]  # No valid tour found
+# Memory allowed for the Held-Karp tables (float32 cost + int16 parent per cell)
+HELD_KARP_MEMORY_BUDGET = 64 * 1024 * 1024
+
+def held_karp_max_nodes(memory_budget: int = HELD_KARP_MEMORY_BUDGET) -> int:
+    """Largest tour size (start included) whose DP tables fit in the memory budget"""
+    m = 1
+    while (m + 1) * (1 << (m + 1)) * 6 <= memory_budget:
+        m += 1
+    return m + 1
+
+HELD_KARP_MAX_NODES = held_karp_max_nodes()
+
+# Problems with this many locations sequence their partners' clusters on the process pool
+PARALLEL_SEQUENCING_MIN_STOPS = 2000
+
+def held_karp(cost: np.ndarray, deadline: Optional[float] = None) -> Optional[Tuple[float, List[int]]]:
+    """Solve TSP exactly over a cost matrix, starting and ending at index 0.
+    
+    dp[mask, i] is the cheapest path that leaves index 0, visits the nodes in
+    ``mask`` (bit i stands for node i + 1) and ends at node i + 1. Masks are
+    grouped by popcount once and each layer is relaxed as one array operation
+    over all predecessors. Returns None if the deadline or the active search's
+    time limit passes first.
+    """
+    n = cost.shape[0]
+    if n <= 1:
+        return 0.0, [0]
+    if n == 2:
+        return float(cost[0, 1] + cost[1, 0]), [0, 1, 0]
+    
+    m = n - 1
+    full = 1 << m
+    inner = cost[1:, 1:].astype(np.float32)
+    
+    dp = np.full((full, m), np.inf, dtype=np.float32)
+    parent = np.full((full, m), -1, dtype=np.int16)
+    singles = 1 << np.arange(m)
+    dp[singles, np.arange(m)] = cost[0, 1:]
+    
+    # Enumerate masks once, grouped into layers by popcount
+    masks = np.arange(full, dtype=np.int64)
+    popcount = np.zeros(full, dtype=np.int8)
+    for bit in range(m):
+        popcount += ((masks >> bit) & 1).astype(np.int8)
+    order = np.argsort(popcount, kind="stable")
+    bounds = np.searchsorted(popcount[order], np.arange(m + 2))
+    
+    states = m
+    for size in range(2, m + 1):
+        layer = order[bounds[size]:bounds[size + 1]]
+        for i in range(m):
+            if expired(deadline):
+                count("dp_states", states)
+                return None
+            members = layer[(layer >> i) & 1 == 1]
+            states += len(members)
+            prev = members ^ (1 << i)
+            # Predecessors outside prev are still inf, so they never win
+            candidates = dp[prev] + inner[:, i]
+            best = candidates.argmin(axis=1)
+            dp[members, i] = candidates[np.arange(len(members)), best]
+            parent[members, i] = best
+    
+    count("dp_states", states)
+    count("dp_transitions", (states - m) * m)
+    
+    # Close the tour back to the start
+    closing = dp[full - 1] + cost[1:, 0]
+    end = int(closing.argmin())
+    total = float(closing[end])
     
     # Reconstruct the path
     path = []
-    mask = end_mask
-    curr = end_vertex
-    
-    while curr != start_idx:
-        path.append(idx_to_id[curr])
-        new_curr = parent[(mask, curr)]
-        mask ^= (1 << curr)
-        curr = new_curr
-    
-    path.append(start_id)
+    mask = full - 1
+    curr = end
+    while curr != -1:
+        path.append(curr + 1)
+        prev_node = int(parent[mask, curr])
+        mask ^= 1 << curr
+        curr = prev_node
+    
+    path.append(0)
     path.reverse()
-    path.append(start_id)  # Return to start
-    
-    return path
+    path.append(0)
+    return total, path
+
+def solve_tsp_dp(dist: DistanceMatrix, start: int, stops: List[int]) -> List[int]:
+    """Solve TSP using dynamic programming (Held-Karp)"""
+    if not stops:
+        return [start]
+    
+    # Put the start first and read this subset's distances from the shared matrix
+    nodes = [start] + [i for i in stops if i != start]
+    solved = held_karp(dist.submatrix(nodes))
+    if solved is None:
+        # Out of time: settle for whatever the heuristic reaches
+        return solve_tsp_local_search(dist, start, stops)
+    return [nodes[i] for i in solved[1]]
 
-def optimize_route_dynamic(locations: Dict[int, Location], partners: List[DeliveryPartner]) -> List[Route]:
+def nearest_neighbour_path(dist: DistanceMatrix, start: int, stops: List[int]) -> List[int]:
+    """Closed path from the start through the stops, always to the closest unvisited one"""
+    nodes = [start] + [i for i in stops if i != start]
+    return [nodes[i] for i in nearest_neighbour_tour(dist.submatrix(nodes))] + [start]
+
+def optimize_route_dynamic(problem: ProblemInstance, dist: Optional[DistanceMatrix] = None) -> List[Route]:
     """Optimize routes using dynamic programming approach (TSP)"""
     # Find depot
-    depot = next((loc for loc in locations.values() if loc.type == "depot"), None)
-    if not depot:
-        raise ValueError("No depot found in locations")
+    depot = find_depot(problem)
+    
+    if dist is None:
+        dist = DistanceMatrix(problem)
     
     # For small number of locations, solve TSP directly
-    if len(locations) <= 15:
-        path = solve_tsp_dp(locations, depot.id)
-        distance = calculate_route_distance(locations, path)
-        
-        if partners:
-            return [Route(partners[0].id, path, distance)]
-        return []
+    if len(problem) <= EXACT_TSP_MAX_NODES:
+        if not problem.num_partners:
+            return []
+        stops = [i for i in range(len(problem)) if i != depot]
+        if reporting():
+            path = nearest_neighbour_path(dist, depot, stops)
+            report([problem.route(0, path, calculate_route_distance(dist, path))])
+        path = solve_tsp_dp(dist, depot, stops)
+        distance = calculate_route_distance(dist, path)
+        return [problem.route(0, path, distance)]
     
     # For larger problems, divide locations and solve TSP for each subset
-    delivery_locations = [loc for loc in locations.values() if loc.type == "delivery"]
-    
-    # Sort by distance from depot to create clusters
-    sorted_locations = sorted(
-        delivery_locations,
-        key=lambda loc: calculate_distance(depot, loc)
-    )
-    
     routes = []
-    if not partners:
+    if not problem.num_partners:
         return routes
     
-    # Divide locations among partners
-    locations_per_partner = len(sorted_locations) // len(partners)
-    remainder = len(sorted_locations) % len(partners)
-    
-    start_idx = 0
-    for i, partner in enumerate(partners):
-        # Distribute remainder locations
-        count = locations_per_partner + (1 if i < remainder else 0)
-        if count == 0:
-            continue
-            
-        partner_locations = sorted_locations[start_idx:start_idx + count]
-        start_idx += count
+    # Divide locations among partners by geography
+    subsets = partition_deliveries(problem, depot)
+    
+    # Clusters are independent, so large problems sequence them in parallel
+    if parallel_workers() > 1 and len(subsets) > 1 and len(problem) >= PARALLEL_SEQUENCING_MIN_STOPS:
+        paths = sequence_clusters(dist, depot, [partner_locations for _, partner_locations in subsets])
+        return [problem.route(p, path, calculate_route_distance(dist, path)) for (p, _), path in zip(subsets, paths)]
+    
+    # A quick plan first for anyone streaming incumbents, then refined one partner at a time
+    listening = reporting()
+    if listening:
+        for p, partner_locations in subsets:
+            path = nearest_neighbour_path(dist, depot, partner_locations)
+            routes.append(problem.route(p, path, calculate_route_distance(dist, path)))
+        report(routes)
+    
+    for k, (p, partner_locations) in enumerate(subsets):
+        # Solve TSP for this subset (local search when it is too large for the DP)
+        path = solve_tsp(dist, depot, partner_locations)
+        distance = calculate_route_distance(dist, path)
         
-        # Create subset of locations including depot
-        subset = {depot.id: depot}
-        for loc in partner_locations:
-            subset[loc.id] = loc
-        
-        # Solve TSP for this subset
-        path = solve_tsp_dp(subset, depot.id)
-        distance = calculate_route_distance(locations, path)
-        
-        routes.append(Route(partner.id, path, distance))
+        route = problem.route(p, path, distance)
+        if listening:
+            routes[k] = route
+            report(routes)
+        else:
+            routes.append(route)
     
     return routes
 
 # 4. Backtracking - Constraint Satisfaction
-def is_valid_assignment(locations: Dict[int, Location], partner: DeliveryPartner, 
-                       assigned_locations: List[int], new_location_id: int) -> bool:
+# Search budget; when either runs out the best assignment found so far is used
+BACKTRACKING_MAX_NODES = 200_000
+BACKTRACKING_TIME_LIMIT = 1.0  # seconds
+
+def is_valid_assignment(problem: ProblemInstance, partner: int,
+                        assigned_locations: List[int], new_location: int) -> bool:
     """Check if assigning a new location to a partner is valid"""
-    # In a real system, we would check capacity, time windows, etc.
-    # For this example, we'll just check a simple capacity constraint
-    
-    # Count total "weight" of assigned locations (using distance as proxy)
-    depot = next((loc for loc in locations.values() if loc.type == "depot"), None)
-    if not depot:
-        return False
-    
-    total_distance = 0
-    for loc_id in assigned_locations:
-        loc = locations[loc_id]
-        total_distance += calculate_distance(depot, loc)
-    
-    # Add new location
-    new_loc = locations[new_location_id]
-    total_distance += calculate_distance(depot, new_loc)
-    
-    # Check if total distance is within partner's capacity
-    return total_distance <= partner.capacity * 10  # Arbitrary scaling factor
-
-def backtrack_assign(locations: Dict[int, Location], partners: List[DeliveryPartner], 
-                    delivery_ids: List[int], assignments: Dict[int, List[int]], 
-                    location_idx: int) -> bool:
-    """Recursively assign locations to partners using backtracking"""
-    # Base case: all locations assigned
-    if location_idx >= len(delivery_ids):
-        return True
-    
-    location_id = delivery_ids[location_idx]
-    
-    # Try assigning to each partner
-    for partner in partners:
-        if is_valid_assignment(locations, partner, assignments[partner.id], location_id):
-            # Try this assignment
-            assignments[partner.id].append(location_id)
-            
-            # Recursively assign the next location
-            if backtrack_assign(locations, partners, delivery_ids, assignments, location_idx + 1):
-                return True
-            
-            # If we couldn't assign all locations with this choice, backtrack
-            assignments[partner.id].remove(location_id)
+    # Time windows depend on the visiting order, so only the VRPTW mode checks them;
+    # here the partner must be able to carry the demand of every stop
+    load = problem.demand[assigned_locations].sum() + problem.demand[new_location]
+    return load <= problem.capacity[partner]
+
+def backtrack_assign(problem: ProblemInstance, dist: DistanceMatrix, delivery_order: List[int],
+                     max_nodes: int = BACKTRACKING_MAX_NODES,
+                     time_limit: float = BACKTRACKING_TIME_LIMIT) -> Optional[List[List[int]]]:
+    """Assign locations to partners with branch-and-bound backtracking.
+    
+    Locations are taken in the given order and appended to a partner's open
+    path, so each partner's cost and load are running totals updated in O(1).
+    The search tries the cheapest partner first, skips empty partners that
+    are interchangeable with one already tried, and prunes any branch whose
+    lower bound cannot beat the incumbent. Returns the best assignment found
+    within the node and time budget as one list of location indices per
+    partner, or None if no feasible assignment was reached.
+    """
+    m = len(delivery_order)
+    num_partners = problem.num_partners
+    if m == 0:
+        return [[] for _ in range(num_partners)]
+    
+    # Distances in search order: depot row plus the deliveries among themselves
+    idx = np.asarray(delivery_order, dtype=np.intp)
+    from_depot = dist.matrix[find_depot(problem), idx]
+    between = dist.matrix[np.ix_(idx, idx)]
+    
+    # Lower bound: every stop is entered from the depot or an earlier stop
+    earlier = np.where(np.triu(np.ones((m, m), dtype=bool), 1), between, np.inf).min(axis=0)
+    entry_bound = np.minimum(earlier, from_depot)
+    remaining_bound = np.append(np.cumsum(entry_bound[::-1])[::-1], 0.0).tolist()
+    
+    demand = problem.demand[idx].tolist()
+    remaining_demand = np.append(np.cumsum(demand[::-1])[::-1], 0.0).tolist()
+    capacity = problem.capacity.tolist()
+    kinds = list(zip(capacity, problem.vehicles))
+    from_depot = from_depot.tolist()
+    d = between.item
+    
+    # Running per-partner state
+    tail = [-1] * num_partners  # Position of the last stop, -1 while empty
+    load = [0.0] * num_partners
+    spare = float(sum(capacity))
+    cost = 0.0
+    assignment = [-1] * m
+    
+    def candidates(k: int) -> List[Tuple[float, int]]:
+        """Feasible partners for stop k with their cost increase, cheapest first"""
+        options = []
+        tried_empty = set()
+        for p in range(num_partners):
+            if load[p] + demand[k] > capacity[p]:
+                continue
+            if tail[p] < 0:
+                # Identical empty partners lead to symmetric subtrees
+                if kinds[p] in tried_empty:
+                    continue
+                tried_empty.add(kinds[p])
+                delta = 2 * from_depot[k]
+            else:
+                delta = d(tail[p], k) + from_depot[k] - from_depot[tail[p]]
+            options.append((delta, p))
+        options.sort()
+        return options
+    
+    best_cost = float("inf")
+    best = None
+    nodes = 0
+    deadline = time.perf_counter() + time_limit
+    listening = reporting()
+    
+    # Each frame: [stop position, candidates, next candidate, applied move]
+    stack = [[0, candidates(0), 0, None]]
+    while stack:
+        frame = stack[-1]
+        k, options, i, applied = frame
+        if applied is not None:
+            p, prev_tail, delta = applied
+            tail[p] = prev_tail
+            load[p] -= demand[k]
+            spare += demand[k]
+            cost -= delta
+            frame[3] = None
+        
+        if i >= len(options):
+            stack.pop()
+            continue
+        delta, p = options[i]
+        frame[2] = i + 1
+        
+        # Options are sorted, so once one cannot beat the incumbent none can
+        if cost + delta + remaining_bound[k + 1] >= best_cost - 1e-12:
+            stack.pop()
+            continue
+        
+        nodes += 1
+        frame[3] = (p, tail[p], delta)
+        tail[p] = k
+        load[p] += demand[k]
+        spare -= demand[k]
+        cost += delta
+        assignment[k] = p
+        
+        if k + 1 == m:
+            best_cost = cost
+            best = list(assignment)
+            if listening:
+                report(_assignment_routes(problem, dist, delivery_order, best))
+        elif remaining_demand[k + 1] <= spare:
+            stack.append([k + 1, candidates(k + 1), 0, None])
+        
+        if nodes >= max_nodes or (nodes & 1023 == 0 and expired(deadline)):
+            break
     
-    # If we tried all partners and couldn't assign this location, return false
-    return False
+    count("backtracking_nodes", nodes)
+    if best is None:
+        return None
+    
+    assignments = [[] for _ in range(num_partners)]
+    for k, p in enumerate(best):
+        assignments[p].append(delivery_order[k])
+    return assignments
+
+def _assignment_routes(problem: ProblemInstance, dist: DistanceMatrix, delivery_order: List[int],
+                       assignment: List[int]) -> List[Route]:
+    """Routes that visit each partner's stops in assignment order, as backtracking costs them"""
+    depot = find_depot(problem)
+    paths: Dict[int, List[int]] = {}
+    for k, p in enumerate(assignment):
+        paths.setdefault(p, [depot]).append(delivery_order[k])
+    return [problem.route(p, path + [depot], dist.route_distance(path + [depot])) for p, path in paths.items()]
 
-def optimize_route_backtracking(locations: Dict[int, Location], partners: List[DeliveryPartner]) -> List[Route]:
+def optimize_route_backtracking(problem: ProblemInstance, dist: Optional[DistanceMatrix] = None,
+                                max_nodes: int = BACKTRACKING_MAX_NODES,
+                                time_limit: float = BACKTRACKING_TIME_LIMIT) -> List[Route]:
     """Optimize routes using backtracking approach"""
     # Find depot
-    depot = next((loc for loc in locations.values() if loc.type == "depot"), None)
-    if not depot:
-        raise ValueError("No depot found in locations")
+    depot = find_depot(problem)
     
-    # Get delivery location IDs
-    delivery_ids = [loc.id for loc in locations.values() if loc.type == "delivery"]
+    if not problem.num_partners:
+        return []
     
-    # Sort by some priority (e.g., distance from depot)
-    delivery_ids.sort(key=lambda loc_id: calculate_distance(depot, locations[loc_id]))
+    if dist is None:
+        dist = DistanceMatrix(problem)
+    depot_row = dist.matrix[depot].tolist()
     
-    # Initialize assignments
-    assignments = {partner.id: [] for partner in partners}
+    # Get delivery location indices
+    delivery_order = problem.deliveries()
+    
+    # Sort by some priority (e.g., distance from depot)
+    delivery_order.sort(key=lambda i: depot_row[i])
     
     # Perform backtracking assignment
-    success = backtrack_assign(locations, partners, delivery_ids, assignments, 0)
+    assignments = backtrack_assign(problem, dist, delivery_order, max_nodes, time_limit)
     
     # If backtracking failed, use a greedy approach
-    if not success:
+    if assignments is None:
         # Simple greedy assignment: round-robin
-        for i, loc_id in enumerate(delivery_ids):
-            partner_idx = i % len(partners)
-            assignments[partners[partner_idx].id].append(loc_id)
+        assignments = [[] for _ in range(problem.num_partners)]
+        for i, loc in enumerate(delivery_order):
+            assignments[i % problem.num_partners].append(loc)
     
     # Convert assignments to routes
     routes = []
-    for partner in partners:
-        if not assignments[partner.id]:
+    for p, assigned in enumerate(assignments):
+        if not assigned:
             continue
-            
-        # For each partner, optimize the route of their assigned locations
-        subset = {depot.id: depot}
-        for loc_id in assignments[partner.id]:
-            subset[loc_id] = locations[loc_id]
         
-        if len(subset) <= 2:
+        # For each partner, optimize the route of their assigned locations
+        if len(assigned) == 1:
             # Only depot and one location
-            path = [depot.id] + assignments[partner.id] + [depot.id]
+            path = [depot] + assigned + [depot]
+        else:
+            # Solve TSP for this subset (local search when it is too large for the DP)
+            path = solve_tsp(dist, depot, assigned)
+        
+        distance = calculate_route_distance(dist, path)
+        routes.append(problem.route(p, path, distance))
+    
+    return routes
+
+# 5. Local Search - 2-opt / Or-opt
+# Number of nearest neighbours considered as move candidates for each node
+LOCAL_SEARCH_NEIGHBOURS = 8
+
+# A search examines about two nodes per tour node before it settles; this many
+# passes' worth stops one that never does
+LOCAL_SEARCH_MAX_PASSES = 50
+
+# Largest subset solve_tsp hands to Held-Karp; the DP would fit in memory up to
+# HELD_KARP_MAX_NODES but its run time doubles with every extra stop
+EXACT_TSP_MAX_NODES = min(16, HELD_KARP_MAX_NODES)
+
+def nearest_neighbour_tour(cost: np.ndarray, start: int = 0) -> List[int]:
+    """Build a construction tour by always visiting the closest unvisited node"""
+    n = cost.shape[0]
+    visited = np.zeros(n, dtype=bool)
+    tour = [start]
+    visited[start] = True
+    curr = start
+    
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, cost[curr])
+        curr = int(row.argmin())
+        visited[curr] = True
+        tour.append(curr)
+    
+    return tour
+
+def neighbour_lists(cost: np.ndarray, k: int = LOCAL_SEARCH_NEIGHBOURS) -> List[List[int]]:
+    """The k closest other nodes of every node, nearest first"""
+    n = cost.shape[0]
+    k = min(k, n - 1)
+    if k <= 0:
+        return [[] for _ in range(n)]
+    
+    # A block of rows at a time, so the masked copy and partition indices never span the whole matrix
+    result = []
+    for start in range(0, n, EUCLIDEAN_BLOCK_ROWS):
+        masked = cost[start:start + EUCLIDEAN_BLOCK_ROWS].copy()
+        rows = np.arange(len(masked))
+        masked[rows, start + rows] = np.inf
+        nearest = np.argpartition(masked, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(masked, nearest, axis=1).argsort(axis=1)
+        result.extend(np.take_along_axis(nearest, order, axis=1).tolist())
+    return result
+
+def _reverse_segment(tour: List[int], pos: List[int], i: int, j: int):
+    """Reverse tour positions i..j (cyclic), or the equivalent complement"""
+    n = len(tour)
+    if i > j:
+        # A wrapping segment is reversed through its non-wrapping complement
+        i, j = j + 1, i - 1
+        if i > j:
+            return
+    tour[i:j + 1] = tour[i:j + 1][::-1]
+    for k in range(i, j + 1):
+        pos[tour[k]] = k
+
+def _try_two_opt(a: int, tour: List[int], pos: List[int], neighbours: List[List[int]], d) -> Optional[Tuple[int, ...]]:
+    """Apply the first improving 2-opt move around node a"""
+    n = len(tour)
+    for forward in (True, False):
+        b = tour[(pos[a] + 1) % n] if forward else tour[pos[a] - 1]
+        d_ab = d(a, b)
+        for c in neighbours[a]:
+            d_ac = d(a, c)
+            if d_ac >= d_ab:
+                break
+            e = tour[(pos[c] + 1) % n] if forward else tour[pos[c] - 1]
+            if c == b or e == a:
+                continue
+            delta = d_ac + d(b, e) - d_ab - d(c, e)
+            if delta < -1e-12:
+                if forward:
+                    # a b ... c e  ->  a c ... b e
+                    _reverse_segment(tour, pos, pos[b], pos[c])
+                else:
+                    # e c ... b a  ->  e b ... c a
+                    _reverse_segment(tour, pos, pos[c], pos[b])
+                return a, b, c, e
+    return None
+
+def _try_or_opt(a: int, tour: List[int], pos: List[int], neighbours: List[List[int]], d) -> Optional[Tuple[int, ...]]:
+    """Apply the first improving move of a 1-3 node segment starting at a"""
+    n = len(tour)
+    for length in (1, 2, 3):
+        i = pos[a]
+        if length >= n - 2 or i + length > n:
+            return None
+        seg = tour[i:i + length]
+        first, last = seg[0], seg[-1]
+        prev_node = tour[i - 1]
+        next_node = tour[(i + length) % n]
+        removal_gain = d(prev_node, first) + d(last, next_node) - d(prev_node, next_node)
+        
+        for end, c in [(first, c) for c in neighbours[first]] + [(last, c) for c in neighbours[last]]:
+            if c in seg:
+                continue
+            for e in (tour[(pos[c] + 1) % n], tour[pos[c] - 1]):
+                if e in seg or (c == prev_node and e == next_node) or (e == prev_node and c == next_node):
+                    continue
+                # Insert the segment between c and e with `end` next to c
+                other = last if end == first else first
+                added = d(c, end) + d(other, e) - d(c, e)
+                if added - removal_gain < -1e-12:
+                    _move_segment(tour, pos, i, length, c, e, end == first)
+                    return prev_node, next_node, first, last, c, e
+    return None
+
+def _move_segment(tour: List[int], pos: List[int], i: int, length: int, c: int, e: int, first_next_to_c: bool):
+    """Cut tour[i:i+length] out and reinsert it between neighbours c and e"""
+    seg = tour[i:i + length]
+    del tour[i:i + length]
+    k_c = pos[c] - length if pos[c] > i else pos[c]
+    n = len(tour)
+    c_then_e = tour[(k_c + 1) % n] == e
+    # Orient so the segment reads c -> seg -> e along the list
+    if c_then_e:
+        insert_at = k_c + 1
+        block = seg if first_next_to_c else seg[::-1]
+    else:
+        insert_at = k_c
+        block = seg[::-1] if first_next_to_c else seg
+    tour[insert_at:insert_at] = block
+    lo = min(i, insert_at)
+    hi = max(i + length, insert_at + length)
+    for k in range(lo, min(hi, len(tour))):
+        pos[tour[k]] = k
+
+def improve_tour(cost: np.ndarray, tour: List[int], neighbours: Optional[List[List[int]]] = None,
+                 active: Optional[List[int]] = None, max_moves: Optional[int] = None,
+                 deadline: Optional[float] = None) -> List[int]:
+    """Improve a closed tour with 2-opt and Or-opt moves using don't-look bits.
+    
+    Only the ``active`` nodes (default: all) start out looked at. The search
+    stops early after ``max_moves`` improving moves, after LOCAL_SEARCH_MAX_PASSES
+    nodes examined per tour node, once time.perf_counter() passes ``deadline``
+    or once the active search runs out of time.
+    
+    The move deltas assume d(a, b) == d(b, a). Asymmetric costs, as one-way
+    roads give, are searched as (d + d.T) / 2 and the tour is then turned to
+    run in its cheaper direction.
+    """
+    n = len(tour)
+    if n < 4:
+        return list(tour)
+    
+    directed = None
+    if not np.array_equal(cost, cost.T):
+        directed, cost = cost, (cost + cost.T) / 2
+    if neighbours is None:
+        neighbours = neighbour_lists(cost)
+    
+    d = cost.item
+    tour = list(tour)
+    pos = [0] * n
+    for k, node in enumerate(tour):
+        pos[node] = k
+    
+    # A node is only revisited after a nearby move
+    queue = deque()
+    queued = [False] * n
+    for node in tour if active is None else active:
+        if not queued[node]:
+            queued[node] = True
+            queue.append(node)
+    examined = moves = 0
+    max_examined = LOCAL_SEARCH_MAX_PASSES * n
+    while queue:
+        if max_moves is not None and moves >= max_moves:
+            break
+        if examined >= max_examined:
+            break
+        if examined & 255 == 0 and expired(deadline):
+            break
+        a = queue.popleft()
+        queued[a] = False
+        examined += 1
+        touched = _try_two_opt(a, tour, pos, neighbours, d) or _try_or_opt(a, tour, pos, neighbours, d)
+        if touched:
+            moves += 1
+            for node in touched:
+                if not queued[node]:
+                    queued[node] = True
+                    queue.append(node)
+    
+    count("local_search_nodes_examined", examined)
+    count("local_search_moves", moves)
+    
+    if directed is not None:
+        idx = np.asarray(tour, dtype=np.intp)
+        following = np.roll(idx, -1)
+        if directed[following, idx].sum() < directed[idx, following].sum():
+            tour.reverse()
+    return tour
+
+def solve_tsp_local_search(dist: DistanceMatrix, start: int, stops: List[int],
+                           seed: Optional[int] = None) -> List[int]:
+    """Solve TSP heuristically: nearest-neighbour construction, then 2-opt / Or-opt.
+    
+    A seed starts the construction at a random node and visits nodes in a
+    random order during improvement, for multi-start runs.
+    """
+    if not stops:
+        return [start]
+    
+    nodes = [start] + [i for i in stops if i != start]
+    cost = dist.submatrix(nodes)
+    
+    # Candidate moves come from a spatial index rather than full matrix rows
+    neighbours = GridIndex(dist.lat[nodes], dist.lng[nodes]).knn_graph(LOCAL_SEARCH_NEIGHBOURS).tolist()
+    
+    if seed is None:
+        tour = improve_tour(cost, nearest_neighbour_tour(cost), neighbours)
+    else:
+        rng = np.random.default_rng(seed)
+        tour = nearest_neighbour_tour(cost, int(rng.integers(len(nodes))))
+        tour = improve_tour(cost, tour, neighbours, rng.permutation(len(nodes)).tolist())
+    
+    # Rotate so the tour starts and ends at the start location
+    k = tour.index(0)
+    tour = tour[k:] + tour[:k]
+    return [nodes[i] for i in tour] + [start]
+
+def solve_tsp(dist: DistanceMatrix, start: int, stops: List[int]) -> List[int]:
+    """Solve TSP exactly for small subsets, otherwise with local search"""
+    if len(stops) + 1 <= EXACT_TSP_MAX_NODES:
+        return solve_tsp_dp(dist, start, stops)
+    return solve_tsp_local_search(dist, start, stops)
+
+def optimize_route_local_search(problem: ProblemInstance, dist: Optional[DistanceMatrix] = None,
+                                seed: Optional[int] = None) -> List[Route]:
+    """Optimize routes using local search (route first, split second); a seed randomizes the giant tour"""
+    # Find depot
+    depot = find_depot(problem)
+    
+    if dist is None:
+        dist = DistanceMatrix(problem)
+    
+    routes = []
+    if not problem.num_partners:
+        return routes
+    
+    def stretches(giant: List[int]) -> List[Tuple[int, List[int]]]:
+        """Split a giant tour into consecutive stretches of deliveries, one per partner"""
+        giant = [i for i in giant if problem.type_code[i] == DELIVERY]
+        locations_per_partner = len(giant) // problem.num_partners
+        remainder = len(giant) % problem.num_partners
+        
+        split = []
+        start_idx = 0
+        for p in range(problem.num_partners):
+            count = locations_per_partner + (1 if p < remainder else 0)
+            if count == 0:
+                continue
+            split.append((p, giant[start_idx:start_idx + count]))
+            start_idx += count
+        return split
+    
+    stops = [i for i in range(len(problem)) if i != depot]
+    if reporting():
+        # The unimproved construction, split as-is, is a plan to show right away
+        for p, stretch in stretches(nearest_neighbour_path(dist, depot, stops)[1:-1]):
+            path = [depot] + stretch + [depot]
+            routes.append(problem.route(p, path, calculate_route_distance(dist, path)))
+        report(routes)
+        routes = []
+    
+    # One improved giant tour through every stop
+    giant = solve_tsp_local_search(dist, depot, stops, seed)[1:-1]
+    
+    for p, stretch in stretches(giant):
+        path = solve_tsp(dist, depot, stretch)
+        distance = calculate_route_distance(dist, path)
+        routes.append(problem.route(p, path, distance))
+    
+    return routes
+
+# 6. Savings - Clarke-Wright capacitated VRP
+def clarke_wright(dist: DistanceMatrix, depot_idx: int, delivery_idx: np.ndarray,
+                  demand: np.ndarray, capacity: float) -> List[List[int]]:
+    """Build capacity-feasible trips with the Clarke-Wright savings algorithm.
+    
+    Each delivery keeps its partners pre-sorted by saving and the heap holds
+    only the best remaining pair of every row, so it stays O(n) in size while
+    the whole merge sequence costs O(n^2 log n). Returns trips as lists of
+    positions into ``delivery_idx``.
+    """
+    n = len(delivery_idx)
+    # Every delivery starts on its own depot -> i -> depot trip
+    trips = {i: deque([i]) for i in range(n)}
+    trip_of = list(range(n))
+    load = {i: float(demand[i]) for i in range(n)}
+    if n < 2:
+        return [list(trip) for trip in trips.values()]
+    
+    d0 = dist.matrix[depot_idx, delivery_idx]
+    savings = d0[:, None] + d0[None, :] - dist.matrix[np.ix_(delivery_idx, delivery_idx)]
+    np.fill_diagonal(savings, -np.inf)
+    row_order = np.argsort(-savings, axis=1, kind="stable").astype(np.int32)
+    
+    # A stop stays mergeable only while it is still adjacent to the depot
+    interior = [False] * n
+    
+    def next_candidate(i: int, k: int) -> int:
+        """Advance row i past partners that can no longer be merged"""
+        row = row_order[i]
+        while k < n - 1 and interior[row[k]]:
+            k += 1
+        return k
+    
+    heap = [(-savings[i, row_order[i, 0]], i, 0) for i in range(n)]
+    heapq.heapify(heap)
+    
+    considered = 0
+    while heap:
+        neg_saving, i, k = heapq.heappop(heap)
+        considered += 1
+        if neg_saving >= 0:
+            # Every remaining saving is zero or negative
+            break
+        if interior[i]:
+            continue
+        j = int(row_order[i, k])
+        
+        k = next_candidate(i, k + 1)
+        if k < n - 1:
+            heapq.heappush(heap, (-savings[i, row_order[i, k]], i, k))
+        
+        ti, tj = trip_of[i], trip_of[j]
+        if interior[j] or ti == tj or load[ti] + load[tj] > capacity:
+            continue
+        a, b = trips[ti], trips[tj]
+        
+        # Orient so the merge reads ... i -> j ...
+        if a[-1] != i:
+            a.reverse()
+        if b[0] != j:
+            b.reverse()
+        if len(a) > 1:
+            interior[i] = True
+        if len(b) > 1:
+            interior[j] = True
+        
+        # Append the smaller trip onto the larger one
+        if len(a) >= len(b):
+            a.extend(b)
+            keep, drop = ti, tj
         else:
-            # Solve TSP for this subset
-            path = solve_tsp_dp(subset, depot.id)
+            b.extendleft(reversed(a))
+            keep, drop = tj, ti
+        for node in trips[drop]:
+            trip_of[node] = keep
+        load[keep] += load.pop(drop)
+        del trips[drop]
+    
+    count("savings_pairs_considered", considered)
+    count("savings_merges", n - len(trips))
+    return [list(trip) for trip in trips.values()]
+
+def assign_trips(problem: ProblemInstance, dist: DistanceMatrix, depot: int,
+                 trips: List[List[int]]) -> Tuple[List[List[int]], np.ndarray]:
+    """Hand trips out heaviest first, each to the partner that finishes it soonest.
+    
+    A partner smaller than a trip reloads at the depot partway through, at its
+    own cost. Returns every partner's path and distance travelled.
+    """
+    capacity = problem.capacity
+    paths = [[depot] for _ in range(problem.num_partners)]
+    travelled = np.zeros(problem.num_partners)
+    
+    for trip in sorted(trips, key=lambda trip: -problem.demand[trip].sum()):
+        tour = solve_tsp(dist, depot, trip)[1:-1]
+        able = np.flatnonzero(capacity >= problem.demand[trip].max())
+        best = None
+        # Partners of the same capacity drive the same path, so build it once per capacity
+        for limit in np.unique(capacity[able]):
+            path = reload_at_depot(depot, tour, problem.demand, float(limit))
+            cost = calculate_route_distance(dist, [depot] + path)
+            same = able[capacity[able] == limit]
+            q = int(same[travelled[same].argmin()])
+            if best is None or travelled[q] + cost < best[0]:
+                best = (travelled[q] + cost, q, path, cost)
         
-        distance = calculate_route_distance(locations, path)
-        routes.append(Route(partner.id, path, distance))
+        _, p, path, cost = best
+        paths[p].extend(path)
+        travelled[p] += cost
+    
+    return paths, travelled
+
+def optimize_route_savings(problem: ProblemInstance, dist: Optional[DistanceMatrix] = None) -> List[Route]:
+    """Optimize routes using the Clarke-Wright savings algorithm (capacitated VRP)"""
+    # Find depot
+    depot = find_depot(problem)
+    
+    if dist is None:
+        dist = DistanceMatrix(problem)
+    
+    routes = []
+    if not problem.num_partners:
+        return routes
+    
+    deliveries = np.asarray(problem.deliveries(), dtype=np.intp)
+    demand = problem.demand[deliveries]
+    capacity = problem.capacity
+    max_capacity = capacity.max()
+    
+    too_heavy = [problem.location_ids[i] for i in deliveries[demand > max_capacity]]
+    if too_heavy:
+        raise ValueError(f"Demand of locations {too_heavy} exceeds every partner's capacity")
+    
+    # Trips cut for the largest partner leave smaller ones idle or reloading mid-trip, trips cut
+    # for the smallest keep the largest going back and forth; merge at both sizes and keep the
+    # plan whose longest route is shorter
+    sizes = {float(capacity[capacity >= demand.max(initial=0)].min()), float(max_capacity)}
+    best = None
+    for size in sorted(sizes):
+        trips = clarke_wright(dist, depot, deliveries, demand, size)
+        paths, travelled = assign_trips(problem, dist, depot, [deliveries[trip].tolist() for trip in trips])
+        key = (travelled.max(), travelled.sum())
+        if best is None or key < best[0]:
+            best = (key, paths, travelled)
+    _, paths, travelled = best
+    
+    for p, path in enumerate(paths):
+        if len(path) > 1:
+            routes.append(problem.route(p, path, float(travelled[p])))
     
     return routes
 
+# 7. Time windows - VRPTW insertion and relocate
+# Kilometres per distance unit, to turn distances into travel times
+KM_PER_UNIT = {"km": 1.0, "degrees": 111.32}
+
+# Nearest stops whose positions are tried when inserting or relocating a stop
+VRPTW_NEIGHBOURS = 10
+VRPTW_TIME_LIMIT = 2.0  # Seconds of relocate search after the insertion phase
+
+class TimedPath:
+    """One partner's path from the depot through its trips, with its schedule.
+    
+    ``start[k]`` is the earliest service start at position k and ``latest[k]``
+    the latest start that still keeps every later visit inside its window
+    (forward and backward time slack), so a stop inserted between positions k
+    and k + 1 is checked in O(1) instead of re-simulating the path. Interior
+    depot visits split the path into trips; ``load[t]`` is carried on trip t.
+    """
+    def __init__(self, problem: ProblemInstance, dist: DistanceMatrix, p: int, depot: int, minutes_per_unit: float):
+        self.problem = problem
+        self.d = dist.matrix.item
+        self.matrix = dist.matrix
+        self.partner = p
+        self.depot = depot
+        self.capacity = float(problem.capacity[p])
+        self.minutes = minutes_per_unit
+        self.path = [depot, depot]
+        self.update()
+    
+    def __len__(self) -> int:
+        return len(self.path)
+    
+    def update(self) -> bool:
+        """Recompute the schedule after the path changed; False if a window is missed"""
+        problem = self.problem
+        path = np.asarray(self.path, dtype=np.intp)
+        step = problem.service_time[path[:-1]] + self.minutes * self.matrix[path[:-1], path[1:]]
+        offset = np.concatenate(([0.0], np.cumsum(step)))
+        # start[k] = max(ready[k], start[k - 1] + step[k - 1]), unrolled into prefix maxima
+        start = offset + np.maximum.accumulate(problem.ready_time[path] - offset)
+        latest = offset + np.minimum.accumulate((problem.due_time[path] - offset)[::-1])[::-1]
+        
+        at_depot = path == self.depot
+        trip = np.cumsum(at_depot) - 1  # Trip of the gap after each position
+        load = np.bincount(trip, weights=np.where(at_depot, 0.0, problem.demand[path]))
+        # Per gap: the two ends, the departure side's start, the arrival side's latest start, the trip load
+        self.gaps = path[:-1], path[1:], start[:-1], latest[1:], load[trip[:-1]]
+        # Scalar checks read plain lists, which index much faster than arrays
+        self.load = load.tolist()
+        self.trip = trip.tolist()
+        self.start = start.tolist()
+        self.latest = latest.tolist()
+        return bool(np.all(start <= problem.due_time[path] + 1e-9))
+    
+    def insertion(self, k: int, u: int, freed: float = 0.0) -> Optional[float]:
+        """Distance added by visiting u between positions k and k + 1, or None if infeasible.
+        
+        ``freed`` is load already leaving the trip, for a stop moved within it.
+        """
+        problem = self.problem
+        if self.load[self.trip[k]] - freed + problem.demand[u] > self.capacity:
+            return None
+        i, j = self.path[k], self.path[k + 1]
+        d = self.d
+        begin = max(problem.ready_time[u], self.start[k] + problem.service_time[i] + self.minutes * d(i, u))
+        if begin > problem.due_time[u]:
+            return None
+        if begin + problem.service_time[u] + self.minutes * d(u, j) > self.latest[k + 1]:
+            return None
+        return d(i, u) + d(u, j) - d(i, j)
+    
+    def new_trip(self, u: int, k: Optional[int] = None) -> Optional[float]:
+        """Distance added by serving u on an extra trip from the depot visit at position k, or None if infeasible.
+        
+        The trip goes in right after that visit; by default it is the last
+        one, so the extra trip ends the day.
+        """
+        problem = self.problem
+        depot = self.depot
+        if len(self.path) == 2 or problem.demand[u] > self.capacity:
+            return None
+        if k is None:
+            k = len(self.path) - 1
+        d = self.d
+        begin = max(problem.ready_time[u], self.start[k] + problem.service_time[depot] + self.minutes * d(depot, u))
+        if begin > problem.due_time[u]:
+            return None
+        back = max(problem.ready_time[depot], begin + problem.service_time[u] + self.minutes * d(u, depot))
+        if back > problem.due_time[depot]:
+            return None
+        # The trips after it start later, by as much as their slack allows
+        if k + 1 < len(self.path):
+            following = self.path[k + 1]
+            if back + problem.service_time[depot] + self.minutes * d(depot, following) > self.latest[k + 1]:
+                return None
+        return d(depot, u) + d(u, depot)
+    
+    def drop_empty_trips(self):
+        """Remove depot visits that no longer have a stop between them"""
+        depot = self.depot
+        path = [node for k, node in enumerate(self.path) if not (node == depot and k and self.path[k - 1] == depot)]
+        self.path = path + [depot] if len(path) == 1 else path
+
+def _cheapest_gap(paths: List[TimedPath], u: int) -> Tuple[Optional[Tuple[int, int]], float]:
+    """Cheapest feasible (path, gap) for u over every gap of every path, checked in one pass"""
+    problem = paths[0].problem
+    matrix = paths[0].matrix
+    i, j, start, latest, load = (np.concatenate(column) for column in zip(*(timed.gaps for timed in paths)))
+    sizes = [len(timed) - 1 for timed in paths]
+    minutes = np.repeat([timed.minutes for timed in paths], sizes)
+    capacity = np.repeat([timed.capacity for timed in paths], sizes)
+    
+    to_u, from_u = matrix[i, u], matrix[u, j]
+    begin = np.maximum(problem.ready_time[u], start + problem.service_time[i] + minutes * to_u)
+    feasible = ((load + problem.demand[u] <= capacity)
+                & (begin <= problem.due_time[u])
+                & (begin + problem.service_time[u] + minutes * from_u <= latest))
+    added = np.where(feasible, to_u + from_u - matrix[i, j], np.inf)
+    k = int(added.argmin())
+    if not feasible[k]:
+        return None, np.inf
+    q = int(np.searchsorted(np.cumsum(sizes), k, side="right"))
+    return (q, k - sum(sizes[:q])), float(added[k])
+
+def _index_path(where: Dict[int, Tuple[int, int]], q: int, path: List[int], depot: int):
+    for k, node in enumerate(path):
+        if node != depot:
+            where[node] = (q, k)
+
+def solve_vrptw(problem: ProblemInstance, dist: DistanceMatrix,
+                time_limit: float = VRPTW_TIME_LIMIT) -> Tuple[List[Route], List[int]]:
+    """Plan routes that serve every stop inside its time window (VRPTW).
+    
+    Stops are inserted earliest-due first at the cheapest feasible position
+    next to one of their nearest stops, or on a new trip; stops left over
+    get another try at every gap and at a new trip between any two trips of
+    a path. A relocate search then moves stops between and within paths
+    until no move helps or the time limit passes, and the stops still left
+    over get one more try. Travel times follow each partner's vehicle speed and the
+    depot's window bounds the shift. Returns the routes and the stops that
+    no partner could serve in time.
+    """
+    depot = find_depot(problem)
+    deliveries = problem.deliveries()
+    if not problem.num_partners:
+        return [], deliveries
+    
+    minutes = 60 * KM_PER_UNIT[dist.units] / problem.speed
+    paths = [TimedPath(problem, dist, p, depot, float(minutes[p])) for p in range(problem.num_partners)]
+    d = dist.matrix.item
+    
+    # Candidate positions come from the nearest stops, so a move costs O(k) checks
+    nearest = neighbour_lists(dist.submatrix(deliveries), VRPTW_NEIGHBOURS)
+    neighbours = {i: [deliveries[j] for j in row] for i, row in zip(deliveries, nearest)}
+    
+    where: Dict[int, Tuple[int, int]] = {}  # Stop -> (path, position)
+    unassigned = []
+    depot_row = dist.matrix[depot]
+    # Earliest due first; stops the windows don't tell apart are swept by angle around the depot,
+    # so each one lands next to the previous instead of opening a trip of its own
+    angle = np.arctan2(problem.lat - problem.lat[depot], problem.lng - problem.lng[depot])
+    order = sorted(deliveries, key=lambda i: (problem.due_time[i], angle[i], -depot_row[i]))
+    
+    def place_leftovers(leftovers: List[int]) -> List[int]:
+        """Insert stops at the cheapest gap or new trip anywhere; returns those that still fit nowhere"""
+        # A new trip may go between two existing ones, not only at the end
+        # of the day, where a late stop already keeps the partner waiting
+        still = []
+        for u in leftovers:
+            best, best_cost = _cheapest_gap(paths, u)
+            trip = False
+            for q, timed in enumerate(paths):
+                for k, node in enumerate(timed.path):
+                    if node != depot:
+                        continue
+                    added = timed.new_trip(u, k)
+                    if added is not None and added < best_cost:
+                        best, best_cost, trip = (q, k), added, True
+            if best is None:
+                still.append(u)
+                continue
+            
+            q, k = best
+            timed = paths[q]
+            timed.path[k + 1:k + 1] = [u, depot] if trip else [u]
+            timed.update()
+            _index_path(where, q, timed.path, depot)
+        return still
+    
+    with phase("insertion"):
+        for u in order:
+            best, best_cost = None, np.inf
+            for v in neighbours[u]:
+                if v not in where:
+                    continue
+                q, l = where[v]
+                for k in (l - 1, l):
+                    added = paths[q].insertion(k, u)
+                    if added is not None and added < best_cost:
+                        best, best_cost = (q, k), added
+            if best is None and not np.isfinite(problem.due_time[u]):
+                # Without a window any gap will do, and one is usually cheaper than a new trip;
+                # windowed stops keep that slack for later stops unless nothing else fits
+                best, best_cost = _cheapest_gap(paths, u)
+            # An extra trip costs the same on any partner; the one whose day ends first takes it
+            trip, trip_key = None, (best_cost, np.inf)
+            for q, timed in enumerate(paths):
+                added = timed.insertion(0, u) if len(timed) == 2 else timed.new_trip(u)
+                if added is not None and (added, timed.start[-1]) < trip_key:
+                    trip, trip_key = (q, None if len(timed) > 2 else 0), (added, timed.start[-1])
+            if trip is not None and trip_key[0] < best_cost:
+                best, best_cost = trip, trip_key[0]
+            if best is None:
+                best, best_cost = _cheapest_gap(paths, u)
+            if best is None:
+                unassigned.append(u)
+                continue
+            
+            q, k = best
+            timed = paths[q]
+            if k is None:
+                timed.path[-1:-1] = [depot, u]
+            else:
+                timed.path.insert(k + 1, u)
+            timed.update()
+            _index_path(where, q, timed.path, depot)
+        
+        unassigned = place_leftovers(unassigned)
+    
+    def scheduled_routes() -> List[Route]:
+        routes = []
+        ids = problem.location_ids
+        for timed in paths:
+            if len(timed) > 2:
+                distance = calculate_route_distance(dist, timed.path)
+                start_times = [round(t, 2) for t in timed.start]
+                routes.append(ScheduledRoute(problem.partner_ids[timed.partner], [ids[i] for i in timed.path],
+                                             distance, start_times))
+        return routes
+    
+    if reporting():
+        report(scheduled_routes())
+    
+    with phase("relocate"):
+        deadline = time.perf_counter() + time_limit
+        queue = deque(u for u in order if u in where)
+        queued = {u: True for u in queue}
+        examined = moves = 0
+        while queue:
+            if examined & 255 == 0 and expired(deadline):
+                break
+            u = queue.popleft()
+            queued[u] = False
+            examined += 1
+            
+            p, k = where[u]
+            source = paths[p]
+            prev_node, next_node = source.path[k - 1], source.path[k + 1]
+            gain = d(prev_node, u) + d(u, next_node) - d(prev_node, next_node)
+            
+            # Schedules still include u, which only makes these checks stricter
+            best, best_delta = None, -1e-9
+            for v in neighbours[u]:
+                if v not in where:
+                    continue
+                q, l = where[v]
+                target = paths[q]
+                for gap in (l - 1, l):
+                    if q == p and gap in (k - 1, k):
+                        continue
+                    freed = problem.demand[u] if q == p and target.trip[gap] == source.trip[k] else 0.0
+                    added = target.insertion(gap, u, freed)
+                    if added is not None and added - gain < best_delta:
+                        best, best_delta = (q, gap), added - gain
+            if best is None:
+                continue
+            
+            q, gap = best
+            target = paths[q]
+            saved = list(source.path), list(target.path)
+            del source.path[k]
+            if q == p and gap > k:
+                gap -= 1
+            target.path.insert(gap + 1, u)
+            source.drop_empty_trips()
+            target.drop_empty_trips()
+            # Distances that break the triangle inequality can still make the source late
+            if not (source.update() & target.update()):
+                source.path, target.path = saved
+                source.update()
+                target.update()
+                continue
+            
+            _index_path(where, p, source.path, depot)
+            _index_path(where, q, target.path, depot)
+            moves += 1
+            k = target.path.index(u)
+            for node in (u, prev_node, next_node, target.path[k - 1], target.path[k + 1]):
+                if node != depot and not queued.get(node):
+                    queued[node] = True
+                    queue.append(node)
+        count("local_search_nodes_examined", examined)
+        count("local_search_moves", moves)
+    
+    if unassigned:
+        # Relocating stops may have freed time for the ones left over
+        with phase("insertion"):
+            unassigned = place_leftovers(unassigned)
+    
+    return scheduled_routes(), unassigned
+
+def optimize_route_vrptw(problem: ProblemInstance, dist: Optional[DistanceMatrix] = None) -> List[Route]:
+    """Optimize routes under time windows; stops that cannot be served in time are left out.
+    
+    Use solve_vrptw for the list of those stops; optimize_routes reports
+    them under "unassigned".
+    """
+    if dist is None:
+        dist = DistanceMatrix(problem)
+    return solve_vrptw(problem, dist)[0]
+
 # Main optimization function
-def optimize_routes(locations_data: List[Dict], partners_data: List[Dict], algorithm: str) -> Dict:
-    """Main function to optimize routes based on the selected algorithm"""
-    # Convert input data to objects
-    locations = {}
-    for loc_data in locations_data:
-        loc = Location(
-            id=loc_data["id"],
-            name=loc_data["name"],
-            lat=loc_data["lat"],
-            lng=loc_data["lng"],
-            location_type=loc_data.get("type", "delivery")
-        )
-        locations[loc.id] = loc
-    
-    partners = []
-    for partner_data in partners_data:
-        partner = DeliveryPartner(
-            id=partner_data["id"],
-            name=partner_data["name"],
-            vehicle=partner_data.get("vehicle", "Car"),
-            capacity=partner_data.get("capacity", 100)
-        )
-        partners.append(partner)
+def distance_provider(distance: str, location_ids: Optional[List] = None):
+    """Provider for a request's distance option, "euclidean" or "road", by name.
+    
+    Road distances between known location ids are kept in the persistent
+    distance store when DISTANCE_STORE_PATH is set.
+    """
+    if distance == "euclidean":
+        return EuclideanDistance()
+    if distance == "road":
+        store = default_store("road")
+        if store is not None and location_ids is not None:
+            return StoredDistance(store, default_network(), location_ids)
+        return default_network()
+    raise ValueError(f"Unknown distance: {distance}")
+
+def optimize_routes(locations_data: List[Dict], partners_data: List[Dict], algorithm: str,
+                    profile: bool = False, distance: str = "euclidean", time_limit: Optional[float] = None,
+                    on_incumbent: Optional[Callable[[Dict], None]] = None,
+                    cancelled: Optional[threading.Event] = None) -> Dict:
+    """Main function to optimize routes based on the selected algorithm.
+    
+    With profile=True the result also carries per-phase timings and search
+    counters. The "route_cost" phase is part of "search".
+    
+    With a time_limit in seconds the search loops stop once it passes and
+    the best solution reached so far is returned; building the distance
+    matrix and a first solution always completes. on_incumbent is called
+    with {"routes", "distance"} for every complete solution that improves on
+    the previous ones, the last being the returned result.
+    """
+    if profile:
+        with profiling() as collected:
+            result = optimize_routes(locations_data, partners_data, algorithm, distance=distance,
+                                     time_limit=time_limit, on_incumbent=on_incumbent, cancelled=cancelled)
+        result["profile"] = collected.to_dict()
+        return result
+    
+    if time_limit is not None or on_incumbent is not None or cancelled is not None:
+        def publish(routes: List[Route], total: float):
+            on_incumbent({"routes": [route.to_dict() for route in routes], "distance": total})
+        
+        with anytime(time_limit, publish if on_incumbent else None, cancelled):
+            return optimize_routes(locations_data, partners_data, algorithm, distance=distance)
+    
+    # Convert input data to a compact array-backed problem
+    with phase("parse"):
+        problem = ProblemInstance(locations_data, partners_data)
+    
+    # Pairwise distances shared by every optimizer; the hierarchical one only ever builds them area by area
+    provider = distance_provider(distance, problem.location_ids)
+    if algorithm != "hierarchical":
+        with phase("distance_matrix"):
+            dist = DistanceMatrix(problem, provider)
     
     # Select algorithm and optimize
-    if algorithm == "divide_and_conquer":
-        routes = optimize_route_divide_conquer(locations, partners)
-        algo_name = "Divide and Conquer (Merge Sort)"
-    elif algorithm == "greedy":
-        routes = optimize_route_greedy(locations, partners)
-        algo_name = "Greedy Method (Kruskal's Algorithm)"
-    elif algorithm == "dynamic":
-        routes = optimize_route_dynamic(locations, partners)
-        algo_name = "Dynamic Programming (TSP)"
-    elif algorithm == "backtracking":
-        routes = optimize_route_backtracking(locations, partners)
-        algo_name = "Backtracking (Constraint Satisfaction)"
-    else:
-        raise ValueError(f"Unknown algorithm: {algorithm}")
+    unassigned = portfolio = None
+    with phase("search"):
+        if algorithm == "divide_and_conquer":
+            routes = optimize_route_divide_conquer(problem, dist)
+            algo_name = "Divide and Conquer (Merge Sort)"
+        elif algorithm == "greedy":
+            routes = optimize_route_greedy(problem, dist)
+            algo_name = "Greedy Method (Kruskal's Algorithm)"
+        elif algorithm == "dynamic":
+            routes = optimize_route_dynamic(problem, dist)
+            algo_name = "Dynamic Programming (TSP)"
+        elif algorithm == "backtracking":
+            routes = optimize_route_backtracking(problem, dist)
+            algo_name = "Backtracking (Constraint Satisfaction)"
+        elif algorithm == "local_search":
+            routes = optimize_route_local_search(problem, dist)
+            algo_name = "Local Search (2-opt / Or-opt)"
+        elif algorithm == "savings":
+            routes = optimize_route_savings(problem, dist)
+            algo_name = "Savings (Clarke-Wright CVRP)"
+        elif algorithm == "vrptw":
+            routes, unassigned = solve_vrptw(problem, dist)
+            algo_name = "Time Windows (Insertion + Relocate VRPTW)"
+        elif algorithm == "portfolio":
+            # Imported here because the portfolio runs the optimizers of this module
+            from portfolio import solve_portfolio
+            routes, portfolio = solve_portfolio(problem, dist, locations_data, partners_data)
+            algo_name = f"Portfolio (best: {portfolio['winner']})"
+        elif algorithm == "hierarchical":
+            # Imported here because the hierarchical solver builds on this module
+            from hierarchical import solve_hierarchical
+            routes = solve_hierarchical(problem, distance, [loc.get("area") for loc in locations_data])
+            algo_name = "Hierarchical (Cluster, Solve, Stitch)"
+        else:
+            raise ValueError(f"Unknown algorithm: {algorithm}")
+        # A cut-short refinement can end above an earlier incumbent
+        report(routes)
+        routes = best_routes(routes)
     
     # Convert results to dictionary
-    result = {
-        "algorithm": algo_name,
-        "routes": [route.to_dict() for route in routes]
-    }
+    with phase("serialize"):
+        result = {
+            "algorithm": algo_name,
+            "routes": [route.to_dict() for route in routes],
+            "distanceUnits": provider.units
+        }
+        if unassigned is not None:
+            result["unassigned"] = [problem.location_ids[i] for i in unassigned]
+        if portfolio is not None:
+            result["portfolio"] = portfolio
     
     return result
 
@@ -568,7 +1825,7 @@ if __name__ == "__main__":
     ]
     
     # Test each algorithm
-    algorithms = ["divide_and_conquer", "greedy", "dynamic", "backtracking"]
+    algorithms = ["divide_and_conquer", "greedy", "dynamic", "backtracking", "local_search", "savings"]
     
     for algo in algorithms:
         result = optimize_routes(locations_data, partners_data, algo)
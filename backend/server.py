@@ -1,42 +1,499 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from route_optimizer import optimize_routes
+from distance_store import default_store
+from incremental import reoptimize_routes
+from evaluation import evaluate
+from jobs import JobManager, QueueFullError, MAX_BATCH_SIZE
+from result_cache import ResultCache, problem_key
+from metrics import MetricsRegistry, phase, profiling
+from replanner import Replanner
+from werkzeug.exceptions import BadRequest
+from typing import Optional
 import json
+import math
+import os
+import queue
+import threading
+import time
+
+try:
+    import orjson
+except ImportError:  # Optional: request and response bodies go through the json module without it
+    orjson = None
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Request limits, overridable from the environment; larger requests are rejected with 413
+MAX_REQUEST_BYTES = int(os.environ.get("OPTIMIZER_MAX_REQUEST_BYTES", 16 * 1024 * 1024))
+# A solve holds its n x n float64 distance matrix and, for savings, up to about three more of that size;
+# the default location cap keeps that within this many bytes per solve
+MATRIX_MEMORY_BUDGET = int(os.environ.get("OPTIMIZER_MATRIX_MEMORY_BUDGET", 256 * 1024 * 1024))
+MAX_LOCATIONS = int(os.environ.get("OPTIMIZER_MAX_LOCATIONS", math.isqrt(MATRIX_MEMORY_BUDGET // (4 * 8))))
+MAX_PARTNERS = int(os.environ.get("OPTIMIZER_MAX_PARTNERS", 1000))
+MAX_EVALUATE_PLANS = int(os.environ.get("OPTIMIZER_MAX_EVALUATE_PLANS", 1000))
+
+# Algorithms whose running time grows faster than the distance matrix accept fewer locations; the
+# hierarchical solver never builds the full matrix and takes city-scale instances
+ALGORITHM_MAX_LOCATIONS = {
+    "savings": min(MAX_LOCATIONS, 5000),
+    "vrptw": min(MAX_LOCATIONS, 3000),
+    "portfolio": min(MAX_LOCATIONS, 3000),
+    "hierarchical": int(os.environ.get("OPTIMIZER_MAX_HIERARCHICAL_LOCATIONS", 100000)),
+}
+
+# Algorithms that fan out over their own process pool; their requests only coordinate it, so they solve
+# on the request thread rather than on a job pool worker, where they would run their work inline
+POOLED_ALGORITHMS = ("portfolio", "hierarchical")
+
+# Every algorithm a fresh worker runs once before taking requests; the portfolio would start a process pool
+WARM_UP_ALGORITHMS = ("divide_and_conquer", "greedy", "dynamic", "backtracking", "local_search", "savings", "vrptw")
+
+# Repeated submissions of the same problem are answered from the cache
+result_cache = ResultCache()
+
+# Background optimizations run on a process pool so slow solves don't block requests
+job_manager = JobManager(cache=result_cache)
+
+# Latency histograms and search counters exposed at /api/metrics
+optimizer_metrics = MetricsRegistry()
+
+# Re-sequences in-progress routes from the riders' reported positions
+replanner = Replanner()
+
+def read_json():
+    """The request body parsed as JSON, or None if it is not JSON"""
+    if not request.is_json:
+        return None
+    if orjson is None:
+        return request.get_json()
+    try:
+        return orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        raise BadRequest("Failed to decode JSON object")
+
+def dumps(payload) -> str:
+    """Serialize a payload for a streamed response"""
+    if orjson is None:
+        return json.dumps(payload)
+    return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS).decode()
+
+def json_response(payload) -> Response:
+    """jsonify, with orjson when it is installed"""
+    if orjson is None:
+        return jsonify(payload)
+    return Response(orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS), mimetype='application/json')
+
+@app.before_request
+def limit_request_size():
+    if request.content_length is not None and request.content_length > MAX_REQUEST_BYTES:
+        return json_response({"error": f"Request body too large (limit {MAX_REQUEST_BYTES} bytes)"}), 413
+
+def validate_optimize_request(data):
+    """Return an error message if an optimization request is invalid"""
+    if not data:
+        return "No request body provided"
+    
+    if not data.get('locations'):
+        return "No locations provided"
+    
+    if not any(loc.get('type') == 'depot' for loc in data['locations']):
+        return "No depot location found"
+    
+    if not data.get('partners'):
+        return "No delivery partners provided"
+    
+    time_limit_ms = data.get('time_limit_ms')
+    if time_limit_ms is not None and (isinstance(time_limit_ms, bool) or not isinstance(time_limit_ms, (int, float))
+                                      or time_limit_ms <= 0):
+        return "time_limit_ms must be a positive number"
+    
+    return None
+
+def _is_id(value) -> bool:
+    return isinstance(value, (str, int)) and not isinstance(value, bool)
+
+def validate_plan_routes(plans) -> Optional[str]:
+    """Return an error message if a route of the plans is not a {"partnerId", "path"} object"""
+    for k, plan in enumerate(plans):
+        for r, route in enumerate(plan['routes']):
+            if not isinstance(route, dict) or not _is_id(route.get('partnerId')):
+                return f"Route {r} of plan {k} needs a partnerId"
+            path = route.get('path')
+            if not isinstance(path, list) or not all(_is_id(loc_id) for loc_id in path):
+                return f"Route {r} of plan {k} needs a path of location ids"
+    return None
+
+def problem_too_large(data, algorithm: Optional[str] = None, max_locations: Optional[int] = None) -> Optional[str]:
+    """Return an error message if a valid request's problem is too large for its algorithm"""
+    limit = max_locations or ALGORITHM_MAX_LOCATIONS.get(algorithm, MAX_LOCATIONS)
+    if len(data['locations']) > limit:
+        solver = f" for {algorithm}" if algorithm else ""
+        return f"Too many locations{solver} (limit {limit})"
+    
+    if len(data['partners']) > MAX_PARTNERS:
+        return f"Too many delivery partners (limit {MAX_PARTNERS})"
+    
+    return None
+
+def time_limit_of(data) -> Optional[float]:
+    """The request's time_limit_ms in seconds, or None for no limit"""
+    time_limit_ms = data.get('time_limit_ms')
+    return time_limit_ms / 1000 if time_limit_ms is not None else None
+
 @app.route('/api/optimize', methods=['POST'])
 def optimize():
     try:
-        data = request.json
+        data = read_json()
+        
+        # Validate input
+        error = validate_optimize_request(data)
+        if error:
+            return json_response({"error": error}), 400
         
         # Extract data from request
         algorithm = data.get('algorithm', 'greedy')
+        error = problem_too_large(data, algorithm)
+        if error:
+            return json_response({"error": error}), 413
+        
         locations = data.get('locations', [])
         partners = data.get('partners', [])
+        distance = data.get('distance', 'euclidean')
+        time_limit = time_limit_of(data)
+        
+        # A time-limited result may be cut short, so it is cached apart from the full one
+        options = {"distance": distance}
+        if time_limit is not None:
+            options["time_limit_ms"] = data['time_limit_ms']
+        
+        # Run optimization, unless the same problem was solved recently
+        start = time.perf_counter()
+        with profiling() as profile:
+            with phase("cache_lookup"):
+                key = problem_key(locations, partners, algorithm, **options)
+                result = result_cache.get(key)
+        cache = "hit" if result is not None else "miss"
+        if result is None:
+            if algorithm in POOLED_ALGORITHMS:
+                with profiling() as solved:
+                    result = optimize_routes(locations, partners, algorithm, distance=distance, time_limit=time_limit)
+            else:
+                # Solved on the job pool, so concurrent requests don't take turns on this process's GIL
+                result, solved = job_manager.solve(locations, partners, algorithm, distance=distance,
+                                                   time_limit=time_limit)
+            profile.merge(solved)
+            result_cache.put(key, result)
+        optimizer_metrics.observe(algorithm, time.perf_counter() - start, profile, cache)
+        
+        # Opt-in per-phase timings and search counters
+        if data.get('profile'):
+            result = dict(result, profile=dict(profile.to_dict(), cache=cache))
+        
+        return json_response(result)
+    
+    except Exception as e:
+        optimizer_metrics.observe_error()
+        return json_response({"error": str(e)}), 500
+
+@app.route('/api/optimize/stream', methods=['POST'])
+def optimize_stream():
+    """Server-Sent Events: an "incumbent" event per improved solution, then "result" or "error" """
+    data = read_json()
+    
+    # Validate input
+    error = validate_optimize_request(data)
+    if error:
+        return json_response({"error": error}), 400
+    
+    algorithm = data.get('algorithm', 'greedy')
+    error = problem_too_large(data, algorithm)
+    if error:
+        return json_response({"error": error}), 413
+    
+    events = queue.Queue()
+    cancelled = threading.Event()
+    start = time.perf_counter()
+    
+    def on_incumbent(incumbent):
+        events.put(("incumbent", dict(incumbent, elapsedMs=round((time.perf_counter() - start) * 1000, 1))))
+    
+    def solve():
+        try:
+            with profiling() as profile:
+                result = optimize_routes(data['locations'], data['partners'], algorithm,
+                                         distance=data.get('distance', 'euclidean'), time_limit=time_limit_of(data),
+                                         on_incumbent=on_incumbent, cancelled=cancelled)
+            optimizer_metrics.observe(algorithm, time.perf_counter() - start, profile)
+            events.put(("result", result))
+        except Exception as e:
+            optimizer_metrics.observe_error()
+            events.put(("error", {"error": str(e)}))
+    
+    def generate():
+        # The solver runs beside the response so incumbents go out as they are found
+        threading.Thread(target=solve, name="optimize-stream", daemon=True).start()
+        try:
+            while True:
+                event, payload = events.get()
+                yield f"event: {event}\ndata: {dumps(payload)}\n\n"
+                if event != "incumbent":
+                    break
+        finally:
+            # A client that went away stops the search at its next time check
+            cancelled.set()
+    
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+@app.route('/api/optimize/incremental', methods=['POST'])
+def optimize_incremental():
+    try:
+        data = read_json()
+        
+        # Validate input
+        error = validate_optimize_request(data)
+        if error:
+            return json_response({"error": error}), 400
+        
+        if not isinstance(data.get('routes'), list):
+            return json_response({"error": "No current routes provided"}), 400
+        
+        if not data.get('add') and not data.get('remove'):
+            return json_response({"error": "No added or removed stops provided"}), 400
+        
+        error = problem_too_large(data)
+        if error:
+            return json_response({"error": error}), 413
+        
+        # Repair only the routes the change touches
+        result = reoptimize_routes(
+            data['locations'],
+            data['partners'],
+            data['routes'],
+            data.get('add', []),
+            data.get('remove', []),
+            data.get('distance', 'euclidean')
+        )
+        
+        return json_response(result)
+    
+    except ValueError as e:
+        return json_response({"error": str(e)}), 400
+    
+    except Exception as e:
+        return json_response({"error": str(e)}), 500
+
+@app.route('/api/evaluate', methods=['POST'])
+def evaluate_plans():
+    try:
+        data = read_json()
         
         # Validate input
-        if not locations:
-            return jsonify({"error": "No locations provided"}), 400
+        error = validate_optimize_request(data)
+        if error:
+            return json_response({"error": error}), 400
+        
+        plans = data.get('plans')
+        if not isinstance(plans, list) or not plans:
+            return json_response({"error": "No plans provided"}), 400
+        
+        if not all(isinstance(plan, dict) and isinstance(plan.get('routes'), list) for plan in plans):
+            return json_response({"error": "Every plan needs a list of routes"}), 400
+        
+        error = validate_plan_routes(plans)
+        if error:
+            return json_response({"error": error}), 400
+        
+        if len(plans) > MAX_EVALUATE_PLANS:
+            return json_response({"error": f"Too many plans (limit {MAX_EVALUATE_PLANS})"}), 413
+        
+        # Euclidean scoring builds no distance matrix, so it takes plans as large as the hierarchical solver's
+        distance = data.get('distance', 'euclidean')
+        max_locations = ALGORITHM_MAX_LOCATIONS["hierarchical"] if distance == "euclidean" else None
+        error = problem_too_large(data, max_locations=max_locations)
+        if error:
+            return json_response({"error": error}), 413
+        
+        return json_response(evaluate(data['locations'], data['partners'], plans, distance))
+    
+    except ValueError as e:
+        return json_response({"error": str(e)}), 400
+    
+    except Exception as e:
+        return json_response({"error": str(e)}), 500
+
+@app.route('/api/optimize/jobs', methods=['POST'])
+def create_optimize_job():
+    try:
+        data = read_json()
+        
+        error = validate_optimize_request(data)
+        if error:
+            return json_response({"error": error}), 400
+        
+        error = problem_too_large(data, data.get('algorithm', 'greedy'))
+        if error:
+            return json_response({"error": error}), 413
+        
+        job = job_manager.submit(
+            data['locations'],
+            data['partners'],
+            data.get('algorithm', 'greedy'),
+            data.get('distance', 'euclidean')
+        )
+        
+        response = json_response({"jobId": job.id, "status": job.status})
+        response.headers['Location'] = f"/api/optimize/jobs/{job.id}"
+        return response, 202
+    
+    except QueueFullError as e:
+        return json_response({"error": str(e)}), 429
+    
+    except Exception as e:
+        return json_response({"error": str(e)}), 500
+
+@app.route('/api/optimize/jobs/<job_id>', methods=['GET'])
+def get_optimize_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return json_response({"error": "Job not found"}), 404
+    
+    return json_response(job.to_dict())
+
+@app.route('/api/optimize/jobs/<job_id>', methods=['DELETE'])
+def cancel_optimize_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return json_response({"error": "Job not found"}), 404
+    
+    if not job_manager.cancel(job_id):
+        return json_response({"error": f"Job already {job.status}"}), 409
+    
+    return json_response(job.to_dict())
+
+@app.route('/api/optimize/batch', methods=['POST'])
+def optimize_batch():
+    data = read_json()
+    instances = data.get('instances') if isinstance(data, dict) else None
+    
+    # Validate input
+    if not instances or not isinstance(instances, list):
+        return json_response({"error": "No instances provided"}), 400
+    
+    if len(instances) > MAX_BATCH_SIZE:
+        return json_response({"error": f"Too many instances (limit {MAX_BATCH_SIZE})"}), 413
+    
+    invalid = []
+    valid = []
+    for index, instance in enumerate(instances):
+        if not isinstance(instance, dict):
+            invalid.append({"index": index, "id": None, "status": "failed", "error": "Instance must be an object"})
+            continue
+        error = validate_optimize_request(instance) or problem_too_large(instance, instance.get('algorithm', 'greedy'))
+        if error:
+            invalid.append({"index": index, "id": instance.get('id'), "status": "failed", "error": error})
+        else:
+            valid.append((index, instance))
+    
+    def generate():
+        # One JSON object per line, in completion order
+        for item in invalid:
+            yield dumps(item) + "\n"
+        for item in job_manager.run_batch(valid):
+            yield dumps(item) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/replan/routes', methods=['POST'])
+def load_replan_routes():
+    try:
+        data = read_json()
         
-        if not any(loc.get('type') == 'depot' for loc in locations):
-            return jsonify({"error": "No depot location found"}), 400
+        # Validate input
+        if not data or not data.get('locations'):
+            return json_response({"error": "No locations provided"}), 400
         
-        if not partners:
-            return jsonify({"error": "No delivery partners provided"}), 400
+        if not isinstance(data.get('routes'), list):
+            return json_response({"error": "No routes provided"}), 400
         
-        # Run optimization
-        result = optimize_routes(locations, partners, algorithm)
+        count = replanner.load(data['locations'], data['routes'])
+        return json_response({"partners": count})
+    
+    except ValueError as e:
+        return json_response({"error": str(e)}), 400
+    
+    except Exception as e:
+        return json_response({"error": str(e)}), 500
+
+@app.route('/api/replan/positions', methods=['POST'])
+def update_replan_positions():
+    try:
+        data = read_json()
+        updates = data.get('updates') if isinstance(data, dict) else None
+        if not isinstance(updates, list):
+            return json_response({"error": "No position updates provided"}), 400
         
-        return jsonify(result)
+        # Fixes are only recorded here; re-sequencing happens in coalesced batches. Malformed
+        # updates are reported by index, like batch instances, and the rest still apply
+        accepted, unknown, invalid = replanner.update_positions(updates)
+        return json_response({"accepted": accepted, "unknownPartners": unknown, "invalid": invalid}), 202
+    
+    except ValueError as e:
+        return json_response({"error": str(e)}), 400
     
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}), 500
+
+@app.route('/api/replan/routes/<partner_id>', methods=['GET'])
+def get_replan_route(partner_id):
+    plan = replanner.get(int(partner_id) if partner_id.isdigit() else partner_id)
+    if plan is None:
+        return json_response({"error": "Partner not found"}), 404
+    
+    return json_response(plan)
+
+@app.route('/api/optimize/cache', methods=['GET'])
+def cache_stats():
+    return json_response(result_cache.stats())
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    stats = result_cache.stats()
+    cache_metrics = [
+        ("route_optimizer_cache_hits_total", "counter", "Result cache hits", stats["hits"]),
+        ("route_optimizer_cache_misses_total", "counter", "Result cache misses", stats["misses"]),
+        ("route_optimizer_cache_evictions_total", "counter", "Result cache evictions", stats["evictions"]),
+        ("route_optimizer_cache_entries", "gauge", "Results held in memory", stats["size"]),
+    ]
+    store = default_store("road")
+    if store is not None:
+        store_stats = store.stats()
+        cache_metrics += [
+            ("route_optimizer_distance_store_entries", "gauge", "Locations in the road distance store",
+             store_stats["entries"]),
+            ("route_optimizer_distance_store_bytes", "gauge", "Size of the road distance tile file",
+             store_stats["bytes"]),
+        ]
+    return Response(optimizer_metrics.render(cache_metrics), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "healthy"})
+    return json_response({"status": "healthy"})
+
+def warm_up():
+    """Solve a tiny problem with every algorithm, so a new worker's first requests skip the one-off costs"""
+    locations = [{"id": 0, "name": "Depot", "lat": 12.9716, "lng": 77.5946, "type": "depot"}]
+    locations += [{"id": i, "name": f"Stop {i}", "lat": 12.9716 + 0.01 * (i % 3), "lng": 77.5946 + 0.01 * (i // 3),
+                   "type": "delivery"} for i in range(1, 7)]
+    partners = [{"id": 1, "name": "Partner 1", "vehicle": "Bike", "capacity": 5},
+                {"id": 2, "name": "Partner 2", "vehicle": "Car", "capacity": 10}]
+    for algorithm in WARM_UP_ALGORITHMS:
+        dumps(optimize_routes(locations, partners, algorithm))
+    # Synchronous solves run on the job pool; start its processes before the first request needs them
+    job_manager.start()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # The debugger runs arbitrary code from the browser, so it stays off unless asked for
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_DEBUG') == '1')
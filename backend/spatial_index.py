@@ -0,0 +1,175 @@
+import numpy as np
+from typing import List, Optional, Tuple
+
+class GridIndex:
+    """Uniform grid over lat/lng points for k-nearest and radius queries.
+    
+    Points are bucketed into square cells sized so that each cell holds a
+    handful of points on average. Queries scan rings of cells outwards from
+    the query point until no unscanned cell can hold a closer point.
+    """
+    def __init__(self, lat: np.ndarray, lng: np.ndarray, points_per_cell: float = 4.0):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lng = np.asarray(lng, dtype=np.float64)
+        n = len(self.lat)
+        
+        self.min_lat = float(self.lat.min()) if n else 0.0
+        self.min_lng = float(self.lng.min()) if n else 0.0
+        span = max(float(self.lat.max()) - self.min_lat, float(self.lng.max()) - self.min_lng, 1e-9) if n else 1.0
+        cells_per_side = max(1, int(np.sqrt(n / points_per_cell)))
+        self.cell_size = span / cells_per_side
+        
+        # Sort points by cell so every cell is one contiguous slice of `order`
+        self.rows = ((self.lat - self.min_lat) / self.cell_size).astype(np.int64)
+        self.cols = ((self.lng - self.min_lng) / self.cell_size).astype(np.int64)
+        keys = self.rows * (cells_per_side + 1) + self.cols
+        self._stride = cells_per_side + 1
+        self.order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[self.order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) if n else np.array([], dtype=np.int64)
+        ends = np.r_[starts[1:], n]
+        self.cells = {int(sorted_keys[s]): (int(s), int(e)) for s, e in zip(starts, ends)}
+        self.max_ring = cells_per_side + 1
+    
+    def __len__(self) -> int:
+        return len(self.lat)
+    
+    def _cell_points(self, row: int, col: int) -> Optional[np.ndarray]:
+        if col < 0 or col >= self._stride or row < 0:
+            return None
+        span = self.cells.get(row * self._stride + col)
+        if span is None:
+            return None
+        return self.order[span[0]:span[1]]
+    
+    def _ring(self, row: int, col: int, r: int) -> List[np.ndarray]:
+        """Point indices of the cells exactly r cells away from (row, col)"""
+        if r == 0:
+            cells = [(row, col)]
+        else:
+            cells = [(row - r, c) for c in range(col - r, col + r + 1)]
+            cells += [(row + r, c) for c in range(col - r, col + r + 1)]
+            cells += [(rw, col - r) for rw in range(row - r + 1, row + r)]
+            cells += [(rw, col + r) for rw in range(row - r + 1, row + r)]
+        found = []
+        for rw, c in cells:
+            points = self._cell_points(rw, c)
+            if points is not None:
+                found.append(points)
+        return found
+    
+    def _locate(self, lat: float, lng: float) -> Tuple[int, int]:
+        return int((lat - self.min_lat) // self.cell_size), int((lng - self.min_lng) // self.cell_size)
+    
+    def knn(self, lat: float, lng: float, k: int, exclude: Optional[int] = None) -> np.ndarray:
+        """Indices of the k points closest to (lat, lng), nearest first"""
+        n = len(self) - (1 if exclude is not None else 0)
+        k = min(k, n)
+        if k <= 0:
+            return np.array([], dtype=np.int64)
+        
+        row, col = self._locate(lat, lng)
+        if not (0 <= row < self._stride and 0 <= col < self._stride):
+            # Far outside the indexed area rings are no help; compare everything
+            idx = np.arange(len(self))
+            if exclude is not None:
+                idx = idx[idx != exclude]
+            d = np.hypot(self.lat[idx] - lat, self.lng[idx] - lng)
+            return idx[np.argsort(d, kind="stable")[:k]]
+        
+        candidates = []
+        count = 0
+        r = 0
+        while True:
+            for points in self._ring(row, col, r):
+                candidates.append(points)
+                count += len(points)
+            # Once k candidates are known, one more ring covers every point
+            # within the k-th candidate distance
+            if count - (1 if exclude is not None else 0) >= k or r > self.max_ring:
+                break
+            r += 1
+        
+        idx = np.concatenate(candidates)
+        if exclude is not None:
+            idx = idx[idx != exclude]
+        d = np.hypot(self.lat[idx] - lat, self.lng[idx] - lng)
+        radius = np.partition(d, k - 1)[k - 1]
+        
+        # Scan further rings while they could still hold something closer
+        extra = []
+        while r < self.max_ring and r * self.cell_size < radius:
+            r += 1
+            extra.extend(self._ring(row, col, r))
+        if extra:
+            more = np.concatenate(extra)
+            if exclude is not None:
+                more = more[more != exclude]
+            idx = np.concatenate([idx, more])
+            d = np.concatenate([d, np.hypot(self.lat[more] - lat, self.lng[more] - lng)])
+        
+        nearest = np.argpartition(d, k - 1)[:k]
+        return idx[nearest[np.argsort(d[nearest], kind="stable")]]
+    
+    def radius(self, lat: float, lng: float, radius: float) -> np.ndarray:
+        """Indices of all points within `radius` of (lat, lng)"""
+        row, col = self._locate(lat, lng)
+        reach = int(np.ceil(radius / self.cell_size))
+        found = []
+        for r in range(min(reach, self.max_ring) + 1):
+            found.extend(self._ring(row, col, r))
+        if not found:
+            return np.array([], dtype=np.int64)
+        idx = np.concatenate(found)
+        return idx[np.hypot(self.lat[idx] - lat, self.lng[idx] - lng) <= radius]
+    
+    def knn_graph(self, k: int) -> np.ndarray:
+        """(n, k) array with the k nearest other points of every point, nearest first.
+        
+        Points are handled one cell at a time against the 3x3 block of cells
+        around it; only points whose k-th neighbour could lie outside that
+        block fall back to a ring query.
+        """
+        n = len(self)
+        k = min(k, n - 1)
+        result = np.empty((n, max(k, 0)), dtype=np.int64)
+        if k <= 0:
+            return result
+        
+        for key, (start, end) in self.cells.items():
+            row, col = divmod(key, self._stride)
+            members = self.order[start:end]
+            block = np.concatenate([points for r in (0, 1) for points in self._ring(row, col, r)])
+            
+            d = np.hypot(self.lat[members, None] - self.lat[None, block], self.lng[members, None] - self.lng[None, block])
+            d[members[:, None] == block[None, :]] = np.inf
+            
+            if len(block) - 1 >= k:
+                nearest = np.argpartition(d, k - 1, axis=1)[:, :k]
+                nd = np.take_along_axis(d, nearest, axis=1)
+                order = np.argsort(nd, axis=1, kind="stable")
+                result[members] = block[np.take_along_axis(nearest, order, axis=1)]
+                # Neighbours are exact when the k-th one is closer than the block edge
+                edge = np.minimum.reduce([
+                    self.lat[members] - (self.min_lat + row * self.cell_size) + self.cell_size,
+                    (self.min_lat + (row + 2) * self.cell_size) - self.lat[members],
+                    self.lng[members] - (self.min_lng + col * self.cell_size) + self.cell_size,
+                    (self.min_lng + (col + 2) * self.cell_size) - self.lng[members]
+                ])
+                unsure = members[np.take_along_axis(nd, order, axis=1)[:, -1] > edge]
+            else:
+                unsure = members
+            
+            for i in unsure:
+                result[i] = self.knn(self.lat[i], self.lng[i], k, exclude=int(i))
+        
+        return result
+    
+    def candidate_edges(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Undirected k-nearest-neighbour edges (u < v), each listed once"""
+        neighbours = self.knn_graph(k)
+        u = np.repeat(np.arange(len(self)), neighbours.shape[1])
+        v = neighbours.ravel()
+        lo, hi = np.minimum(u, v), np.maximum(u, v)
+        pairs = np.unique(lo * len(self) + hi)
+        return pairs // len(self), pairs % len(self)